@@ -0,0 +1,153 @@
+"""Admission control in front of query execution.
+
+At most ``max_concurrent`` admitted requests run at a time.  Requests that
+can't run yet wait in one of three queues; when a slot frees up the highest
+priority non-empty queue goes first, and within a queue the client with the
+fewest running requests does, so one client's batch of requests can't lock
+out everyone else.  A request that waits longer than the budget of its class,
+or arrives to a full queue, is shed with :class:`Overloaded`.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Generator
+
+PRIORITIES = ("interactive", "heavy", "background")
+
+# Requests are attributed to clients by this header or cookie, falling back
+# to the remote address.
+CLIENT_HEADER = "X-Scubaduck-Client"
+CLIENT_COOKIE = "scubaduck_client"
+
+DEFAULT_BUDGETS = {"interactive": 5.0, "heavy": 30.0, "background": 300.0}
+
+_RECENT_WAITS = 1000
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of admitted."""
+
+    def __init__(self, priority: str, retry_after: float) -> None:
+        super().__init__(f"Server is busy; too many {priority} requests queued")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+@dataclass
+class _Ticket:
+    priority: str
+    client: str
+    enqueued: float
+    granted: bool = False
+
+
+class AdmissionController:
+    """Bounded concurrency with priority queues and per-client fair share."""
+
+    def __init__(
+        self,
+        max_concurrent: int = 4,
+        budgets: dict[str, float] | None = None,
+        max_queue: int = 100,
+    ) -> None:
+        self.max_concurrent = max_concurrent
+        self.budgets = {**DEFAULT_BUDGETS, **(budgets or {})}
+        self.max_queue = max_queue
+        self._queues: dict[str, list[_Ticket]] = {p: [] for p in PRIORITIES}
+        self._running: Counter[str] = Counter()
+        self._clients: Counter[str] = Counter()
+        self._admitted: Counter[str] = Counter()
+        self._shed: Counter[str] = Counter()
+        self._waits: dict[str, deque[float]] = {
+            p: deque(maxlen=_RECENT_WAITS) for p in PRIORITIES
+        }
+        self._cond = threading.Condition()
+
+    def _grant(self) -> None:
+        # Called with ``self._cond`` held.
+        granted = False
+        while sum(self._running.values()) < self.max_concurrent:
+            queue = next((self._queues[p] for p in PRIORITIES if self._queues[p]), None)
+            if queue is None:
+                break
+            ticket = min(queue, key=lambda t: (self._clients[t.client], t.enqueued))
+            queue.remove(ticket)
+            ticket.granted = True
+            self._running[ticket.priority] += 1
+            self._clients[ticket.client] += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, priority: str, client: str) -> Generator[None]:
+        """Wait for a slot for ``client`` and hold it for the enclosed work."""
+        ticket = self.acquire(priority, client)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def acquire(self, priority: str, client: str) -> _Ticket:
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority: {priority}")
+        budget = self.budgets[priority]
+        ticket = _Ticket(priority, client, time.monotonic())
+        with self._cond:
+            queue = self._queues[priority]
+            if len(queue) >= self.max_queue:
+                self._shed[priority] += 1
+                raise Overloaded(priority, self._retry_after(priority))
+            queue.append(ticket)
+            self._grant()
+            deadline = ticket.enqueued + budget
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue.remove(ticket)
+                    self._shed[priority] += 1
+                    raise Overloaded(priority, self._retry_after(priority))
+                self._cond.wait(remaining)
+            self._admitted[priority] += 1
+            self._waits[priority].append(time.monotonic() - ticket.enqueued)
+        return ticket
+
+    def _retry_after(self, priority: str) -> float:
+        # Called with ``self._cond`` held.
+        waits = self._waits[priority]
+        return max(1.0, sum(waits) / len(waits)) if waits else 1.0
+
+    def release(self, ticket: _Ticket) -> None:
+        with self._cond:
+            self._running[ticket.priority] -= 1
+            self._clients[ticket.client] -= 1
+            if not self._clients[ticket.client]:
+                del self._clients[ticket.client]
+            self._grant()
+
+    def status(self) -> dict[str, Any]:
+        with self._cond:
+            classes: dict[str, Any] = {}
+            for p in PRIORITIES:
+                waits = sorted(self._waits[p])
+                classes[p] = {
+                    "queued": len(self._queues[p]),
+                    "running": self._running[p],
+                    "admitted": self._admitted[p],
+                    "shed": self._shed[p],
+                    "budget": self.budgets[p],
+                    "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+                    "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                    "wait_max": waits[-1] if waits else 0.0,
+                }
+            return {
+                "max_concurrent": self.max_concurrent,
+                "running": sum(self._running.values()),
+                "clients": dict(self._clients),
+                "classes": classes,
+            }
@@ -0,0 +1,291 @@
+"""ASGI serving path for the ScubaDuck app.
+
+:class:`AsgiApp` serves the routes of :func:`~scubaduck.server.create_app`
+from an asyncio event loop, for instance with ``uvicorn scubaduck.asgi:app``.
+Request bodies are read and responses are sent on the loop, while the Flask
+handlers, and with them every DuckDB call, run on a bounded thread pool.  A
+request only holds a thread while its handler runs, so idle keep-alive
+connections cost almost nothing and streamed exports are sent chunk by chunk.
+
+``GET /api/saved/<name>/events`` is only available here: a server-sent event
+stream with the saved query's response, sent again after every refresh.  Its
+subscribers wait on the loop and don't hold a thread at all.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import io
+import json
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, cast
+
+from flask import Flask
+
+from .saved_queries import SavedQueries, SavedQuery
+from .server import create_app
+
+Scope = Dict[str, Any]
+Message = Dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+
+_EVENTS_RE = re.compile(r"/api/saved/([^/]+)/events")
+
+# Event streams send a comment this often so proxies keep them open.
+KEEPALIVE = 15.0
+
+
+def _environ(scope: Scope, body: bytes) -> Dict[str, Any]:
+    """Return the WSGI environ for the HTTP request ``scope``."""
+    root = cast(str, scope.get("root_path", ""))
+    path = cast(str, scope["path"])
+    if root and path.startswith(root):
+        path = path[len(root) :]
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ: Dict[str, Any] = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root.encode().decode("latin-1"),
+        "PATH_INFO": path.encode().decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in cast(List[List[bytes]], scope.get("headers", [])):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name == "CONTENT_LENGTH":
+            continue
+        if name != "CONTENT_TYPE":
+            name = "HTTP_" + name
+        environ[name] = f"{environ[name]}, {value}" if name in environ else value
+    return environ
+
+
+async def _read_body(receive: Receive) -> bytes | None:
+    """Return the request body, or ``None`` if the client went away."""
+    chunks: List[bytes] = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _wait_disconnect(receive: Receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+class AsgiApp:
+    """ASGI application running the handlers of ``app`` on a thread pool."""
+
+    def __init__(self, app: Flask, threads: int | None = None) -> None:
+        self.app = app
+        if threads is None:
+            threads = cast(int | None, app.config["SCUBADUCK_ASGI_THREADS"])
+        if threads is None:
+            threads = cast(int, app.config["SCUBADUCK_MAX_CONCURRENT"]) + 4
+        self.threads = threads
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="scubaduck")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise ValueError(f"Unsupported ASGI scope: {scope['type']}")
+        match = _EVENTS_RE.fullmatch(scope["path"])
+        if match and scope["method"] == "GET":
+            await self._events(match.group(1), receive, send)
+        else:
+            await self._wsgi(scope, receive, send)
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.get_running_loop().run_in_executor(None, self.close)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def close(self) -> None:
+        """Stop the app's background threads and the thread pool."""
+        self.app.extensions["scubaduck_saved_queries"].stop()
+        self.app.extensions["scubaduck_warmup"].stop()
+        self.app.extensions["scubaduck_indexes"].stop()
+        self.executor.shutdown()
+
+    async def _wsgi(self, scope: Scope, receive: Receive, send: Send) -> None:
+        body = await _read_body(receive)
+        if body is None:
+            return
+        environ = _environ(scope, body)
+        started: List[Any] = []
+
+        def start_response(
+            status: str, headers: List[tuple[str, str]], exc_info: Any = None
+        ) -> Callable[[bytes], None]:
+            started[:] = [status, headers]
+            return lambda data: None
+
+        result = cast(
+            Iterable[bytes], await self._run(self.app, environ, start_response)
+        )
+        disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+            iterator = iter(result)
+            status, headers = started
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": int(status.split()[0]),
+                    "headers": [
+                        (k.lower().encode("latin-1"), v.encode("latin-1"))
+                        for k, v in headers
+                    ],
+                }
+            )
+            # Chunks of streamed responses such as exports are produced on
+            # the thread pool; stop early once the client is gone.
+            while not disconnected.done():
+                chunk = await self._run(next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            disconnected.cancel()
+            close = getattr(result, "close", None)
+            if close is not None:
+                await self._run(close)
+
+    async def _events(self, name: str, receive: Receive, send: Send) -> None:
+        saved: SavedQueries = self.app.extensions["scubaduck_saved_queries"]
+        try:
+            query = cast(SavedQuery, await self._run(saved.load, name))
+        except KeyError:
+            body = json.dumps({"error": f"Unknown saved query: {name}"}).encode()
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 404,
+                    "headers": [(b"content-type", b"application/json")],
+                }
+            )
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+
+        def listener(refreshed: SavedQuery) -> None:
+            # Saving a query again, or picking it up from another worker,
+            # replaces the object, so match on the name.
+            if refreshed.name == name:
+                loop.call_soon_threadsafe(changed.set)
+
+        saved.subscribe(listener)
+        disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [
+                        (b"content-type", b"text/event-stream"),
+                        (b"cache-control", b"no-cache"),
+                    ],
+                }
+            )
+            while not disconnected.done():
+                changed.clear()
+                event = cast(bytes, await self._run(_event, query))
+                await send(
+                    {"type": "http.response.body", "body": event, "more_body": True}
+                )
+                while not changed.is_set() and not disconnected.done():
+                    waiter = asyncio.ensure_future(changed.wait())
+                    await asyncio.wait(
+                        [waiter, disconnected],
+                        timeout=KEEPALIVE,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    waiter.cancel()
+                    if not changed.is_set() and not disconnected.done():
+                        await send(
+                            {
+                                "type": "http.response.body",
+                                "body": b": keepalive\n\n",
+                                "more_body": True,
+                            }
+                        )
+                # The query may have been saved again as a new object.
+                try:
+                    query = cast(SavedQuery, await self._run(saved.load, name))
+                except KeyError:
+                    break
+        finally:
+            disconnected.cancel()
+            saved.unsubscribe(listener)
+
+
+def _event(query: SavedQuery) -> bytes:
+    """Return the server-sent event with the latest response of ``query``."""
+    if query.result is None:
+        data = {"error": query.error, "saved": query.info()}
+    else:
+        data = {**query.result, "saved": query.info()}
+    return f"event: result\ndata: {json.dumps(data, default=str)}\n\n".encode()
+
+
+def create_asgi_app(
+    db_file: str | Path | None = None,
+    landing_queries: List[Dict[str, Any]] | None = None,
+    cache_dir: str | Path | None = None,
+    config: Dict[str, Any] | None = None,
+) -> AsgiApp:
+    """Create the ScubaDuck app for ``db_file`` and wrap it for ASGI."""
+    return AsgiApp(create_app(db_file, landing_queries, cache_dir, config))
+
+
+_app: AsgiApp | None = None
+_app_lock = threading.Lock()
+
+
+def __getattr__(name: str) -> Any:
+    """Create the module level ``app`` on first access."""
+    global _app
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _app_lock:
+        if _app is None:
+            _app = create_asgi_app()
+        return _app
@@ -0,0 +1,185 @@
+"""The ``scubaduck`` command line.
+
+``scubaduck serve [DB]`` loads the database, runs a first query to measure
+how long it takes before queries can be answered and then serves the app.
+Options can also come from a TOML file given with ``--config`` whose keys are
+the long option names (``threads = 8``, ``cache-dir = "cache"``); options
+on the command line win over the file.
+
+With ``--workers N`` the data is first copied into a DuckDB snapshot and N
+pre-forked worker processes serve it read-only (see :mod:`scubaduck.prefork`).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+import tomllib
+from pathlib import Path
+from typing import Any, Sequence
+
+from flask import Flask
+
+from . import prefork
+from .server import create_app, prepare_snapshot
+
+# Options that map directly onto app config keys.
+CONFIG_KEYS = {
+    "threads": "SCUBADUCK_THREADS",
+    "memory_limit": "SCUBADUCK_MEMORY_LIMIT",
+    "temp_directory": "SCUBADUCK_TEMP_DIRECTORY",
+    "cache_dir": "SCUBADUCK_CACHE_DIR",
+    "config_dir": "SCUBADUCK_CONFIG_DIR",
+    "cache_max_bytes": "SCUBADUCK_CACHE_MAX_BYTES",
+    "result_cache_size": "SCUBADUCK_RESULT_CACHE_SIZE",
+    "result_cache_bytes": "SCUBADUCK_RESULT_CACHE_BYTES",
+    "max_concurrent": "SCUBADUCK_MAX_CONCURRENT",
+    "warmup": "SCUBADUCK_WARMUP",
+    "read_only": "SCUBADUCK_READ_ONLY",
+    "query_workers": "SCUBADUCK_QUERY_WORKERS",
+    "query_timeout": "SCUBADUCK_QUERY_TIMEOUT",
+}
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="scubaduck")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="serve the ScubaDuck UI")
+    serve.add_argument(
+        "db",
+        nargs="?",
+        help="database, CSV, Parquet or SQLite file (default: $SCUBADUCK_DB)",
+    )
+    serve.add_argument("--config", type=Path, help="TOML file with options")
+    serve.add_argument("--host")
+    serve.add_argument("--port", type=int)
+    serve.add_argument("--threads", type=int, help="DuckDB threads")
+    serve.add_argument("--memory-limit", help="DuckDB memory limit, e.g. 4GB")
+    serve.add_argument("--temp-directory", help="where DuckDB spills to disk")
+    serve.add_argument(
+        "--cache-dir", help="directory for the result cache, shared by workers"
+    )
+    serve.add_argument("--cache-max-bytes", type=int)
+    serve.add_argument("--config-dir", help="directory saved queries are kept in")
+    serve.add_argument("--result-cache-size", type=int, help="results kept in memory")
+    serve.add_argument(
+        "--result-cache-bytes", type=int, help="memory used by kept results"
+    )
+    serve.add_argument(
+        "--max-concurrent", type=int, help="queries run at the same time"
+    )
+    serve.add_argument(
+        "--warmup",
+        action=argparse.BooleanOptionalAction,
+        help="prime caches in the background at startup (default: on)",
+    )
+    serve.add_argument(
+        "--landing-queries",
+        type=Path,
+        help="JSON file with a list of /api/query payloads to warm",
+    )
+    serve.add_argument(
+        "--read-only",
+        action="store_true",
+        default=None,
+        help="open a DuckDB database read-only",
+    )
+    serve.add_argument(
+        "--query-workers",
+        type=int,
+        help="run queries in killable worker processes",
+    )
+    serve.add_argument(
+        "--query-timeout", type=float, help="seconds before a query is killed"
+    )
+    serve.add_argument("--workers", type=int, help="worker processes (default: 1)")
+    serve.add_argument(
+        "--snapshot",
+        type=Path,
+        help="DuckDB file the data is copied into for the workers",
+    )
+    serve.add_argument("--debug", action="store_true", default=None)
+    return parser
+
+
+def load_options(argv: Sequence[str] | None = None) -> dict[str, Any]:
+    """Return the ``serve`` options from ``argv`` and the config file."""
+    args = _parser().parse_args(argv)
+    options: dict[str, Any] = {}
+    if args.config is not None:
+        with args.config.open("rb") as f:
+            for key, value in tomllib.load(f).items():
+                options[key.replace("-", "_")] = value
+    for key, value in vars(args).items():
+        if value is not None:
+            options[key] = value
+    return options
+
+
+def build_app(options: dict[str, Any]) -> tuple[Flask, dict[str, float]]:
+    """Create the app for ``options`` and time its first query.
+
+    Returns the app and the time in seconds it took to load the database and
+    to answer the first query.
+    """
+    config = {CONFIG_KEYS[k]: v for k, v in options.items() if k in CONFIG_KEYS}
+    landing = options.get("landing_queries")
+    if isinstance(landing, (str, Path)):
+        landing = json.loads(Path(landing).read_text())
+    start = time.perf_counter()
+    app = create_app(options.get("db"), landing_queries=landing, config=config)
+    loaded = time.perf_counter()
+    rv = app.test_client().post("/api/query", json={"limit": 1, "time_column": ""})
+    if rv.status_code != 200:
+        raise RuntimeError(f"First query failed: {rv.get_json()}")
+    first = time.perf_counter()
+    return app, {"load": loaded - start, "first_query": first - start}
+
+
+def _report(timings: dict[str, float]) -> None:
+    print(
+        f"[{os.getpid()}] Loaded database in {timings['load'] * 1000:.0f} ms; "
+        f"first query answered {timings['first_query'] * 1000:.0f} ms after start",
+        file=sys.stderr,
+    )
+
+
+def serve_workers(options: dict[str, Any]) -> int:
+    """Serve ``options`` from pre-forked workers sharing a read-only snapshot."""
+    workers = int(options["workers"])
+    snapshot = prepare_snapshot(options.get("db"), options.get("snapshot"))
+    options = {**options, "db": str(snapshot), "read_only": True}
+    # Without a limit every worker's DuckDB would use all cores.
+    options.setdefault("threads", max(1, (os.cpu_count() or 1) // workers))
+
+    def make_app() -> Flask:
+        app, timings = build_app(options)
+        _report(timings)
+        return app
+
+    return prefork.serve(
+        make_app, options.get("host", "127.0.0.1"), options.get("port", 5000), workers
+    )
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    options = load_options(argv)
+    if options.get("workers", 1) > 1 or "snapshot" in options:
+        return serve_workers({"workers": 1, **options})
+    app, timings = build_app(options)
+    _report(timings)
+    app.run(
+        host=options.get("host", "127.0.0.1"),
+        port=options.get("port", 5000),
+        debug=options.get("debug", False),
+        use_reloader=False,
+        threaded=True,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
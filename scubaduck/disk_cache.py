@@ -0,0 +1,246 @@
+"""On-disk store for query results that survives server restarts.
+
+Results are kept in a directory, one Parquet file per result, so they are
+stored in a compressed columnar format.  Entries are keyed by the query
+fingerprint together with a version of the data it read, so a result is
+never served after its table changed.  Nothing is read at startup: a result
+is loaded the first time its key is looked up.  When the stored results grow
+past ``max_bytes`` the least recently used ones are deleted.
+
+Results are written by a background thread, so storing one never delays the
+query that produced it; they are handed to DuckDB as a JSON file in one go.
+Files are written under a temporary name and renamed into place, and reads
+record use in the file's modification time, so several server processes can
+share one directory.
+"""
+
+from __future__ import annotations
+
+import datetime
+import decimal
+import hashlib
+import json
+import os
+import queue
+import threading
+import traceback
+import uuid
+from pathlib import Path
+from typing import Any, Callable
+
+import duckdb
+
+from .sql import literal
+
+Row = tuple[Any, ...]
+
+_SUFFIX = ".parquet"
+
+_SIMPLE_TYPES: dict[type, str] = {
+    bool: "BOOLEAN",
+    float: "DOUBLE",
+    str: "VARCHAR",
+    bytes: "BLOB",
+    datetime.date: "DATE",
+    datetime.time: "TIME",
+    datetime.timedelta: "INTERVAL",
+    uuid.UUID: "UUID",
+}
+
+
+def _column_type(values: list[Any]) -> str | None:
+    """Return a DuckDB type that round-trips ``values`` or ``None``."""
+    kinds: set[type] = {type(v) for v in values if v is not None}
+    if not kinds:
+        return "VARCHAR"
+    if len(kinds) > 1:
+        return None
+    kind = kinds.pop()
+    if kind is int:
+        big = any(abs(v) >= 2**63 for v in values if v is not None)
+        return "HUGEINT" if big else "BIGINT"
+    if kind is datetime.timedelta:
+        # Parquet keeps intervals with millisecond precision.
+        if any(v.microseconds % 1000 for v in values if v is not None):
+            return None
+        return "INTERVAL"
+    if kind is datetime.datetime:
+        # Aware datetimes would come back in the session's time zone.
+        if any(v.tzinfo is not None for v in values if v is not None):
+            return None
+        return "TIMESTAMP"
+    if kind is decimal.Decimal:
+        scale = 0
+        for v in values:
+            if v is not None:
+                exponent = v.as_tuple().exponent
+                if not isinstance(exponent, int):
+                    return None
+                scale = max(scale, -exponent)
+        return f"DECIMAL(38, {min(scale, 37)})"
+    return _SIMPLE_TYPES.get(kind)
+
+
+# How values of each column type are written to JSON and read back.
+_ENCODERS: dict[str, Callable[[Any], Any]] = {
+    "BOOLEAN": lambda v: v,
+    "DOUBLE": repr,
+    "VARCHAR": lambda v: v,
+    "BLOB": lambda v: v.hex(),
+    "DATE": lambda v: v.isoformat(),
+    "TIME": lambda v: v.isoformat(),
+    "TIMESTAMP": lambda v: v.isoformat(),
+    "INTERVAL": lambda v: v // datetime.timedelta(microseconds=1),
+}
+_DECODERS = {
+    "BLOB": "unhex({})",
+    "INTERVAL": "to_microseconds(CAST({} AS BIGINT))",
+}
+
+
+def _write_json(path: Path, rows: list[Row], types: list[str]) -> None:
+    encoders = [_ENCODERS.get(t, str) for t in types]
+    with path.open("w") as fh:
+        for row in rows:
+            values = [None if v is None else e(v) for e, v in zip(encoders, row)]
+            fh.write(json.dumps(dict(zip(_names(types), values))))
+            fh.write("\n")
+
+
+def _names(types: list[str]) -> list[str]:
+    return [f"c{i}" for i in range(len(types))]
+
+
+class DiskCache:
+    """LRU store of query results in a directory of Parquet files."""
+
+    def __init__(self, path: str | Path, max_bytes: int = 1 << 30) -> None:
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._con = duckdb.connect()
+        self._lock = threading.Lock()
+        self._pending: set[str] = set()
+        self._tasks: queue.Queue[tuple[str, list[Row]]] = queue.Queue()
+        self._worker: threading.Thread | None = None
+
+    def _file(self, key: str) -> Path:
+        return self.path / (hashlib.sha1(key.encode()).hexdigest() + _SUFFIX)
+
+    def get(self, key: str) -> list[Row] | None:
+        path = self._file(key)
+        try:
+            os.utime(path)
+            cur = self._con.cursor()
+            try:
+                return cur.execute(
+                    f"SELECT * FROM read_parquet({literal(str(path))})"
+                ).fetchall()
+            finally:
+                cur.close()
+        except (FileNotFoundError, duckdb.IOException):
+            # Missing, or evicted by another process in the meantime.
+            return None
+
+    def put(self, key: str, rows: list[Row]) -> bool:
+        """Store ``rows`` under ``key``; returns whether they were stored.
+
+        Results with values that have no exact DuckDB equivalent, or that are
+        larger than the whole store, are skipped.
+        """
+        types: list[str] = ["VARCHAR"]
+        if rows:
+            types = []
+            for i in range(len(rows[0])):
+                ctype = _column_type([r[i] for r in rows])
+                if ctype is None:
+                    return False
+                types.append(ctype)
+        path = self._file(key)
+        tmp = path.with_name(f".{path.stem}.{os.getpid()}.{threading.get_ident()}")
+        source = tmp.with_suffix(".json")
+        try:
+            _write_json(source, rows, types)
+            names = _names(types)
+            columns = ", ".join(f"{literal(n)}: 'VARCHAR'" for n in names)
+            select = ", ".join(
+                _DECODERS.get(t, f"CAST({{}} AS {t})").format(n) + f" AS {n}"
+                for n, t in zip(names, types)
+            )
+            cur = self._con.cursor()
+            try:
+                cur.execute(
+                    f"COPY (SELECT {select} FROM read_json({literal(str(source))}, "
+                    f"columns = {{{columns}}}, format = 'newline_delimited')) "
+                    f"TO {literal(str(tmp))} (FORMAT PARQUET, COMPRESSION ZSTD)"
+                )
+            finally:
+                cur.close()
+        finally:
+            source.unlink(missing_ok=True)
+        if tmp.stat().st_size > self.max_bytes:
+            tmp.unlink()
+            return False
+        os.replace(tmp, path)
+        self._evict()
+        return True
+
+    def put_later(self, key: str, rows: list[Row]) -> None:
+        """Store ``rows`` under ``key`` in the background, like :meth:`put`."""
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            self._tasks.put((key, rows))
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                key, rows = self._tasks.get(timeout=1.0)
+            except queue.Empty:
+                with self._lock:
+                    if self._tasks.empty():
+                        self._worker = None
+                        return
+                continue
+            try:
+                self.put(key, rows)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+                self._tasks.task_done()
+
+    def wait(self) -> None:
+        """Block until all results stored in the background are written."""
+        self._tasks.join()
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        entries: list[tuple[float, int, Path]] = []
+        for path in self.path.glob("*" + _SUFFIX):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self) -> None:
+        total = 0
+        for _, size, path in sorted(self._entries(), reverse=True):
+            total += size
+            if total > self.max_bytes:
+                path.unlink(missing_ok=True)
+
+    def status(self) -> dict[str, Any]:
+        entries = self._entries()
+        return {
+            "path": str(self.path),
+            "entries": len(entries),
+            "bytes": sum(e[1] for e in entries),
+            "max_bytes": self.max_bytes,
+        }
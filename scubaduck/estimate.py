@@ -0,0 +1,204 @@
+"""Cost estimates for queries, used to guard against very expensive ones.
+
+Estimates combine the row count DuckDB keeps in its catalog with per-column
+statistics (time bounds and approximate distinct counts).  Column statistics
+are computed once from a sample of the table and cached until the table
+changes.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+import duckdb
+from dateutil import parser as dtparser
+
+from .query_ir import QueryParams
+from .sql import UNIT_SCALE, epoch_unit, quote
+
+STATS_SAMPLE_ROWS = 100_000
+
+# Relative cost per scanned row of aggregates that are more expensive than a
+# simple running total.
+_AGGREGATE_WEIGHTS = {"count distinct": 4.0}
+_PERCENTILE_WEIGHT = 3.0
+
+
+def _seconds(value: Any, unit: str) -> float | None:
+    """Return ``value`` as seconds since the epoch.
+
+    Numbers are epochs in ``unit``, which must be an effective unit as
+    returned by :func:`~scubaduck.sql.epoch_unit`.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value / UNIT_SCALE[unit]
+    if isinstance(value, str):
+        value = dtparser.parse(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return None
+
+
+def _aggregate_weight(agg: str) -> float:
+    if agg.startswith("p"):
+        return _PERCENTILE_WEIGHT
+    return _AGGREGATE_WEIGHTS.get(agg, 1.0)
+
+
+class CostEstimator:
+    """Estimate rows scanned, group cardinality and cost of a query.
+
+    ``version(table)`` must change whenever the table does; the statistics
+    of a table are recomputed once its version changes.
+    """
+
+    def __init__(
+        self,
+        con: duckdb.DuckDBPyConnection,
+        version: Callable[[str], str] | None = None,
+    ) -> None:
+        self.con = con
+        self.version = version
+        self._versions: dict[str, str] = {}
+        self._rows: dict[str, int] = {}
+        self._distinct: dict[tuple[str, str], int] = {}
+        self._bounds: dict[tuple[str, str, str], tuple[float, float] | None] = {}
+        self._lock = threading.Lock()
+
+    def _check_version(self, table: str) -> None:
+        """Forget the statistics of ``table`` if it changed since."""
+        if self.version is None:
+            return
+        version = self.version(table)
+        with self._lock:
+            if self._versions.get(table) == version:
+                return
+            self._versions[table] = version
+            self._rows.pop(table, None)
+            for key in [k for k in self._distinct if k[0] == table]:
+                del self._distinct[key]
+            for key in [k for k in self._bounds if k[0] == table]:
+                del self._bounds[key]
+
+    def row_count(self, table: str) -> int:
+        self._check_version(table)
+        with self._lock:
+            cached = self._rows.get(table)
+        if cached is not None:
+            return cached
+        rows = self.con.execute(
+            "SELECT estimated_size FROM duckdb_tables() WHERE table_name = ?",
+            [table],
+        ).fetchall()
+        if rows:
+            count = int(rows[0][0])
+        else:
+            # Views have no catalog statistics.
+            query = f"SELECT count(*) FROM {quote(table)}"
+            count = int(self.con.execute(query).fetchall()[0][0])
+        with self._lock:
+            self._rows[table] = count
+        return count
+
+    def distinct(self, table: str, column: str) -> int:
+        """Return the approximate number of distinct values of ``column``."""
+        self._check_version(table)
+        key = (table, column)
+        with self._lock:
+            cached = self._distinct.get(key)
+        if cached is not None:
+            return cached
+        seen, sampled = self.con.execute(
+            f"SELECT approx_count_distinct({quote(column)}), count(*) FROM "
+            f"(SELECT {quote(column)} FROM {quote(table)} "
+            f"USING SAMPLE {STATS_SAMPLE_ROWS} ROWS)"
+        ).fetchall()[0]
+        total = self.row_count(table)
+        count = int(seen)
+        if sampled and total > sampled and seen > sampled / 2:
+            # Mostly unique in the sample: assume it stays that way.
+            count = int(seen / sampled * total)
+        count = max(count, 1)
+        with self._lock:
+            self._distinct[key] = count
+        return count
+
+    def time_bounds(
+        self, table: str, column: str, unit: str
+    ) -> tuple[float, float] | None:
+        """Return the smallest and largest value of ``column`` in seconds.
+
+        ``unit`` is the effective epoch unit of numeric columns.
+        """
+        self._check_version(table)
+        key = (table, column, unit)
+        with self._lock:
+            if key in self._bounds:
+                return self._bounds[key]
+        mn, mx = self.con.execute(
+            f"SELECT min({quote(column)}), max({quote(column)}) FROM {quote(table)}"
+        ).fetchall()[0]
+        lo, hi = _seconds(mn, unit), _seconds(mx, unit)
+        bounds = (lo, hi) if lo is not None and hi is not None else None
+        with self._lock:
+            self._bounds[key] = bounds
+        return bounds
+
+    def estimate(
+        self, params: QueryParams, column_types: dict[str, str]
+    ) -> dict[str, Any]:
+        """Return estimated row counts and cost for ``params``."""
+        total = self.row_count(params.table)
+        selectivity = 1.0
+        if params.time_column and (params.start or params.end):
+            unit = epoch_unit(params.time_column, column_types, params.time_unit)
+            bounds = self.time_bounds(params.table, params.time_column, unit or "s")
+            if bounds is not None and bounds[1] > bounds[0]:
+                lo = _seconds(params.start, "s") if params.start else bounds[0]
+                hi = _seconds(params.end, "s") if params.end else bounds[1]
+                assert lo is not None and hi is not None
+                overlap = min(hi, bounds[1]) - max(lo, bounds[0])
+                selectivity = max(overlap, 0.0) / (bounds[1] - bounds[0])
+        for f in params.filters:
+            if f.op != "=" or f.column not in column_types or f.value is None:
+                continue
+            k = len(f.value) if isinstance(f.value, list) else 1
+            selectivity *= min(1.0, k / self.distinct(params.table, f.column))
+        scanned = int(math.ceil(total * selectivity))
+
+        groups = 1
+        for col in params.group_by:
+            if col in column_types:
+                groups *= self.distinct(params.table, col)
+            else:
+                groups = scanned
+        groups = min(groups, max(scanned, 1))
+        buckets = 1
+        if params.graph_type == "timeseries" and params.bucket_size:
+            lo = _seconds(params.start, "s")
+            hi = _seconds(params.end, "s")
+            if lo is not None and hi is not None:
+                buckets = max(1, math.ceil((hi - lo) / params.bucket_size))
+        aggregated = bool(params.group_by) or params.graph_type != "samples"
+        if aggregated:
+            output = min(scanned, groups * buckets)
+            agg = (params.aggregate or "count").lower()
+            weight = _aggregate_weight(agg)
+        else:
+            output = scanned if params.limit is None else min(scanned, params.limit)
+            weight = 1.0
+        return {
+            "rows_total": total,
+            "rows_scanned": scanned,
+            "group_cardinality": groups,
+            "buckets": buckets,
+            "output_rows": output,
+            "cost": scanned * weight + output,
+        }
@@ -0,0 +1,397 @@
+"""Running query SQL, in the server process or in killable worker processes.
+
+A bad derived column expression or a pathological aggregation can keep a
+DuckDB query busy for a very long time, or make it grow until the process
+runs out of memory.  :class:`QueryPool` runs queries in worker processes that
+attach the same database file read-only instead.  While a query runs the
+server watches its worker; one that exceeds the time or memory budget is
+killed, the query fails with :class:`QueryKilled` and a new worker takes its
+place, without affecting queries running in other workers.
+
+Large results come back pickled through shared memory rather than through
+the worker's pipe.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import pickle
+import queue
+import signal
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Any
+
+import duckdb
+
+from .sql import literal, quote
+
+Row = tuple[Any, ...]
+
+# Maps the name of a temporary table to the SQL type of its ``value`` column
+# and its values (see ``build_query``).
+ValueTables = dict[str, tuple[str, list[str]]]
+
+FETCH_CHUNK_ROWS = 10000
+
+# Pickled results at least this large are passed through shared memory.
+SHARED_MEMORY_THRESHOLD = 1 << 16
+
+# How often a running query's worker is checked against the budgets.
+_POLL_INTERVAL = 0.05
+# How often a query waiting for an idle worker checks that any are left.
+_IDLE_POLL_INTERVAL = 0.5
+
+
+class QueryFailed(Exception):
+    """Raised when a query fails in a worker process."""
+
+
+class QueryKilled(QueryFailed):
+    """Raised when a query's worker was killed, or died, while running it."""
+
+
+def create_value_tables(cur: duckdb.DuckDBPyConnection, tables: ValueTables) -> None:
+    """Create the temporary tables of ``tables`` on ``cur``."""
+    for name, (ctype, values) in tables.items():
+        cur.execute(
+            f"CREATE TEMP TABLE {quote(name)} AS "
+            f"SELECT DISTINCT CAST(unnest(?::VARCHAR[]) AS {ctype}) AS value",
+            [values],
+        )
+
+
+def row_bytes(row: Row) -> int:
+    """Roughly estimate the size of ``row`` once serialized to JSON."""
+    return sum(len(str(v)) + 2 for v in row) + 2
+
+
+def fetch_rows(
+    res: duckdb.DuckDBPyRelation,
+    max_rows: int | None = None,
+    max_bytes: int | None = None,
+) -> tuple[list[Row], bool]:
+    """Fetch the rows of ``res`` in chunks.
+
+    Fetching stops once ``max_rows`` rows or about ``max_bytes`` bytes have
+    been read.  Returns the rows and whether they were truncated.
+    """
+    rows: list[Row] = []
+    size = 0
+    while True:
+        chunk = res.fetchmany(FETCH_CHUNK_ROWS)
+        if not chunk:
+            return rows, False
+        for row in chunk:
+            if max_rows is not None and len(rows) >= max_rows:
+                return rows, True
+            if max_bytes is not None:
+                size += row_bytes(row)
+                if size > max_bytes:
+                    return rows, True
+            rows.append(row)
+
+
+def _send_result(conn: Connection, result: tuple[list[Row], bool]) -> None:
+    data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) < SHARED_MEMORY_THRESHOLD:
+        conn.send(("rows", data))
+        return
+    shm = SharedMemory(create=True, size=len(data))
+    try:
+        assert shm.buf is not None
+        shm.buf[: len(data)] = data
+        conn.send(("shm", shm.name, len(data)))
+    finally:
+        shm.close()
+
+
+def _receive_result(message: tuple[Any, ...]) -> tuple[list[Row], bool]:
+    if message[0] == "rows":
+        return pickle.loads(message[1])
+    shm = SharedMemory(name=message[1])
+    try:
+        assert shm.buf is not None
+        view = shm.buf[: message[2]]
+        try:
+            return pickle.loads(view)
+        finally:
+            # The block can't be closed while a view of it is alive.
+            view.release()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _worker_main(conn: Connection, db_path: str, settings: dict[str, Any]) -> None:
+    # Ctrl-C reaches the whole process group; the server stops its workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        con = duckdb.connect(db_path, read_only=True)
+        for name, value in settings.items():
+            con.execute(f"SET {name} = {literal(value)}")
+        default_threads = con.execute("SELECT current_setting('threads')").fetchall()
+    except Exception as exc:
+        conn.send(("error", str(exc)))
+        return
+    conn.send(("ready",))
+    while True:
+        try:
+            sql, tables, max_rows, max_bytes, threads = conn.recv()
+        except EOFError:
+            return
+        try:
+            con.execute(f"SET threads = {threads or default_threads[0][0]}")
+            cur = con.cursor()
+            try:
+                create_value_tables(cur, tables)
+                result = fetch_rows(cur.execute(sql), max_rows, max_bytes)
+            finally:
+                cur.close()
+        except Exception as exc:
+            conn.send(("error", str(exc)))
+            continue
+        _send_result(conn, result)
+
+
+@dataclass(eq=False)
+class _Worker:
+    process: BaseProcess
+    conn: Connection
+
+    def rss(self) -> int | None:
+        """Return the resident memory of the worker in bytes, if known."""
+        try:
+            statm = Path(f"/proc/{self.process.pid}/statm").read_text()
+        except OSError:
+            return None
+        return int(statm.split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _context() -> Any:
+    # DuckDB can't be used across a fork of a process that has opened a
+    # database, so workers come from a fork server or are spawned.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload([__name__])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+class QueryPool:
+    """Worker processes running queries on ``db_path`` opened read-only.
+
+    ``timeout`` (seconds) and ``max_memory`` (resident bytes on top of what
+    the worker used when it was handed the query) are the budgets of a single
+    query; ``None`` disables them.  ``settings`` are
+    DuckDB settings applied in every worker, such as ``memory_limit``.
+    """
+
+    def __init__(
+        self,
+        db_path: str | Path,
+        workers: int = 2,
+        timeout: float | None = 60.0,
+        max_memory: int | None = None,
+        settings: dict[str, Any] | None = None,
+    ) -> None:
+        self.db_path = str(db_path)
+        self.workers = workers
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.settings = dict(settings or {})
+        self._ctx = _context()
+        self._idle: queue.Queue[_Worker] = queue.Queue()
+        self._all: set[_Worker] = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._queries = 0
+        self._killed = 0
+        self._starting: set[threading.Thread] = set()
+        started = [self._spawn() for _ in range(workers)]
+        for worker in started:
+            error = self._wait_ready(worker)
+            if error is not None:
+                self.close()
+                raise RuntimeError(f"Query worker failed to start: {error}")
+            self._idle.put(worker)
+
+    def _spawn(self) -> _Worker:
+        parent, child = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child, self.db_path, self.settings),
+            daemon=True,
+        )
+        process.start()
+        child.close()
+        worker = _Worker(process, parent)
+        with self._lock:
+            self._all.add(worker)
+        return worker
+
+    @staticmethod
+    def _wait_ready(worker: _Worker) -> str | None:
+        """Wait until ``worker`` has started; return why it didn't, if so."""
+        message: tuple[Any, ...] = ("error", "timed out")
+        try:
+            if worker.conn.poll(60):
+                message = worker.conn.recv()
+        except (EOFError, OSError):
+            message = ("error", "worker exited")
+        return None if message[0] == "ready" else message[1]
+
+    def _replace(self) -> None:
+        """Start a worker in the background and make it idle once it's ready.
+
+        Until then it isn't handed queries, so its startup doesn't count
+        against the budget of a query.
+        """
+
+        def start() -> None:
+            try:
+                worker = self._spawn()
+                error = self._wait_ready(worker)
+                with self._lock:
+                    closed = self._closed
+                if error is not None or closed:
+                    self._retire(worker)
+                    if not closed:
+                        print(
+                            f"Replacement query worker failed to start: {error}",
+                            file=sys.stderr,
+                        )
+                    return
+                self._idle.put(worker)
+            finally:
+                with self._lock:
+                    self._starting.discard(threading.current_thread())
+
+        thread = threading.Thread(target=start, daemon=True)
+        with self._lock:
+            self._starting.add(thread)
+        thread.start()
+
+    def wait_started(self) -> None:
+        """Block until the replacement workers being started are idle."""
+        with self._lock:
+            starting = list(self._starting)
+        for thread in starting:
+            thread.join()
+
+    def _retire(self, worker: _Worker) -> None:
+        with self._lock:
+            self._all.discard(worker)
+        worker.conn.close()
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join()
+
+    def execute(
+        self,
+        sql: str,
+        tables: ValueTables | None = None,
+        max_rows: int | None = None,
+        max_bytes: int | None = None,
+        threads: int | None = None,
+    ) -> tuple[list[Row], bool]:
+        """Run ``sql`` in a worker and return its rows like :func:`fetch_rows`.
+
+        Waits for an idle worker first, for at most ``timeout``.  Raises
+        :class:`QueryFailed` when the query fails or no worker became idle
+        and :class:`QueryKilled` when its worker was killed.
+        """
+        worker = self._take()
+        healthy = False
+        try:
+            # The memory budget is for what the query adds to the worker.
+            baseline = worker.rss() if self.max_memory is not None else None
+            worker.conn.send((sql, tables or {}, max_rows, max_bytes, threads))
+            with self._lock:
+                self._queries += 1
+            message = self._wait(worker, baseline or 0)
+            healthy = True
+        finally:
+            if healthy:
+                self._idle.put(worker)
+            else:
+                self._retire(worker)
+                with self._lock:
+                    self._killed += 1
+                    closed = self._closed
+                if not closed:
+                    self._replace()
+        if message[0] == "error":
+            raise QueryFailed(message[1])
+        return _receive_result(message)
+
+    def _take(self) -> _Worker:
+        """Return an idle worker, waiting for at most ``timeout``."""
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise QueryFailed("Query workers have been shut down")
+                if not self._all and not self._starting:
+                    raise QueryFailed("No query workers are running")
+            try:
+                # Short waits, so that losing the last worker is noticed.
+                return self._idle.get(timeout=_IDLE_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+            if deadline is not None and time.monotonic() > deadline:
+                raise QueryFailed(
+                    f"No query worker became idle within {self.timeout:g} s"
+                )
+
+    def _wait(self, worker: _Worker, baseline: int) -> tuple[Any, ...]:
+        start = time.monotonic()
+        while True:
+            if worker.conn.poll(_POLL_INTERVAL):
+                try:
+                    message = worker.conn.recv()
+                except EOFError:
+                    raise QueryKilled("Query worker died while running the query")
+                return message
+            if self.timeout is not None and time.monotonic() - start > self.timeout:
+                raise QueryKilled(
+                    f"Query ran longer than {self.timeout:g} s and was cancelled"
+                )
+            if self.max_memory is not None:
+                rss = worker.rss()
+                if rss is not None and rss - baseline > self.max_memory:
+                    raise QueryKilled(
+                        f"Query used more than {self.max_memory:,} bytes of "
+                        "memory and was cancelled"
+                    )
+
+    def status(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "idle": self._idle.qsize(),
+                "starting": len(self._starting),
+                "timeout": self.timeout,
+                "max_memory": self.max_memory,
+                "queries": self._queries,
+                "killed": self._killed,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            workers = list(self._all)
+        for worker in workers:
+            self._retire(worker)
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
@@ -0,0 +1,258 @@
+"""Build and drop ART indexes based on the equality filters queries use.
+
+Sample queries that pull a few rows by a high-cardinality id scan the whole
+table unless the column is indexed.  :class:`IndexAdvisor` counts the ``=``
+filters of every query per ``(table, column)`` and indexes the columns that
+are used often, within a budget of ``max_indexes``.
+
+The indexes are stored in the database and outlive the server, so indexes
+built by an earlier run are picked up again at startup: they count against
+the budget and are dropped once they go unused like any other.
+"""
+
+from __future__ import annotations
+
+import queue
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Iterable, Protocol
+
+import duckdb
+
+from .sql import quote
+
+
+class _FilterLike(Protocol):
+    column: str
+    op: str
+    value: Any
+
+
+@dataclass
+class IndexUsage:
+    table: str
+    column: str
+    uses: int = 0
+    last_used: float = 0.0
+    state: str = "tracking"
+    index_name: str | None = None
+    error: str | None = None
+
+
+INDEX_PREFIX = "scubaduck_idx_"
+
+
+def _index_name(table: str, column: str) -> str:
+    """Return a deterministic index name for ``table``/``column``."""
+    slug = re.sub(r"[^0-9A-Za-z_]", "_", f"{table}__{column}")
+    return f"{INDEX_PREFIX}{slug}"
+
+
+class IndexAdvisor:
+    """Create ART indexes on columns that are frequently filtered with ``=``.
+
+    Usage is recorded per ``(table, column)`` from the filters of each query.
+    Once a column has been used ``threshold`` times an index is built on a
+    background thread, unless ``max_indexes`` indexes exist already.
+    Indexes that have not been used for ``idle_seconds`` are dropped again so
+    that they don't accumulate; after :meth:`start` that is checked every
+    ``tick`` seconds even while no queries come in.
+    """
+
+    def __init__(
+        self,
+        con: duckdb.DuckDBPyConnection,
+        threshold: int = 5,
+        idle_seconds: float = 3600.0,
+        enabled: bool = True,
+        max_indexes: int = 8,
+        tick: float = 60.0,
+    ) -> None:
+        self.con = con
+        self.threshold = threshold
+        self.idle_seconds = idle_seconds
+        self.enabled = enabled
+        self.max_indexes = max_indexes
+        self.tick = tick
+        self._usage: dict[tuple[str, str], IndexUsage] = {}
+        self._lock = threading.Lock()
+        self._tasks: queue.Queue[tuple[str, IndexUsage]] = queue.Queue()
+        self._worker: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._load()
+
+    def _load(self) -> None:
+        """Register the indexes an earlier run left in the database."""
+        rows = self.con.execute(
+            "SELECT i.index_name, i.table_name, c.column_name "
+            "FROM duckdb_indexes() i JOIN duckdb_columns() c "
+            "ON c.database_name = i.database_name "
+            "AND c.schema_name = i.schema_name AND c.table_name = i.table_name "
+            "WHERE i.database_name = current_database() "
+            "AND starts_with(i.index_name, ?)",
+            [INDEX_PREFIX],
+        ).fetchall()
+        now = time.time()
+        for name, table, column in rows:
+            # The name is derived from the column, which is more reliable
+            # than parsing the index expressions.
+            if _index_name(table, column) != name:
+                continue
+            self._usage[(table, column)] = IndexUsage(
+                table, column, last_used=now, state="indexed", index_name=name
+            )
+
+    def record(
+        self, table: str, filters: Iterable[_FilterLike], columns: Iterable[str]
+    ) -> None:
+        """Count equality filters of a query against known ``columns``."""
+        if not self.enabled:
+            return
+        valid = set(columns)
+        now = time.time()
+        with self._lock:
+            for f in filters:
+                if f.op != "=" or f.value is None or f.value == []:
+                    continue
+                if f.column not in valid:
+                    continue
+                key = (table, f.column)
+                usage = self._usage.get(key)
+                if usage is None:
+                    usage = IndexUsage(table, f.column)
+                    self._usage[key] = usage
+                usage.uses += 1
+                usage.last_used = now
+                if (
+                    usage.state == "tracking"
+                    and usage.uses >= self.threshold
+                    and self._indexed() < self.max_indexes
+                ):
+                    usage.state = "pending"
+                    self._submit("create", usage)
+        self.drop_idle()
+
+    def drop_idle(self) -> None:
+        """Schedule dropping the indexes unused for ``idle_seconds``."""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            for usage in self._usage.values():
+                if (
+                    usage.state == "indexed"
+                    and now - usage.last_used > self.idle_seconds
+                ):
+                    usage.state = "dropping"
+                    self._submit("drop", usage)
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.tick):
+            self.drop_idle()
+
+    def _indexed(self) -> int:
+        # Called with ``self._lock`` held.
+        return sum(
+            u.state in ("pending", "indexed", "dropping") for u in self._usage.values()
+        )
+
+    def _submit(self, action: str, usage: IndexUsage) -> None:
+        # Called with ``self._lock`` held.
+        self._tasks.put((action, usage))
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+
+    def _run(self) -> None:
+        cur = self.con.cursor()
+        try:
+            while True:
+                try:
+                    action, usage = self._tasks.get(timeout=1.0)
+                except queue.Empty:
+                    with self._lock:
+                        if self._tasks.empty():
+                            self._worker = None
+                            return
+                    continue
+                try:
+                    if action == "create":
+                        self._create(cur, usage)
+                    else:
+                        self._drop(cur, usage)
+                finally:
+                    self._tasks.task_done()
+        finally:
+            cur.close()
+
+    def _create(self, cur: duckdb.DuckDBPyConnection, usage: IndexUsage) -> None:
+        name = _index_name(usage.table, usage.column)
+        qcol = quote(usage.column)
+        try:
+            is_table = cur.execute(
+                "SELECT count(*) FROM duckdb_tables() WHERE table_name = ?",
+                [usage.table],
+            ).fetchall()[0][0]
+            if not is_table:
+                raise ValueError(f"{usage.table} is not a base table")
+            cur.execute(
+                f'CREATE INDEX IF NOT EXISTS "{name}" ON "{usage.table}" ({qcol})'
+            )
+        except Exception as exc:
+            with self._lock:
+                usage.state = "error"
+                usage.error = str(exc)
+            return
+        with self._lock:
+            usage.state = "indexed"
+            usage.index_name = name
+            usage.error = None
+
+    def _drop(self, cur: duckdb.DuckDBPyConnection, usage: IndexUsage) -> None:
+        try:
+            if usage.index_name:
+                cur.execute(f'DROP INDEX IF EXISTS "{usage.index_name}"')
+        except Exception as exc:
+            with self._lock:
+                usage.state = "error"
+                usage.error = str(exc)
+            return
+        with self._lock:
+            usage.state = "tracking"
+            usage.uses = 0
+            usage.index_name = None
+
+    def wait(self) -> None:
+        """Block until all scheduled index builds and drops have finished."""
+        self._tasks.join()
+
+    def status(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "table": u.table,
+                    "column": u.column,
+                    "uses": u.uses,
+                    "last_used": u.last_used,
+                    "state": u.state,
+                    "index": u.index_name,
+                    "error": u.error,
+                }
+                for u in sorted(
+                    self._usage.values(), key=lambda u: (u.table, u.column)
+                )
+            ]
@@ -0,0 +1,218 @@
+"""JSON path columns extracted from string columns holding JSON objects.
+
+A column named ``payload->>$.route`` refers to the ``$.route`` path of the
+JSON documents in the ``payload`` column.  The type of a path is inferred from
+a sample of the table.  The first query that uses a path schedules its
+extraction into a stored column via
+:class:`~scubaduck.materialize.MaterializedColumns` on a background thread;
+until that finishes, queries extract the path from every document themselves.
+Later filters, group-bys and aggregations read the stored column instead of
+re-parsing every document.  A path whose extraction failed is not retried.
+"""
+
+from __future__ import annotations
+
+import queue
+import re
+import sys
+import threading
+from typing import Any
+
+import duckdb
+
+from .materialize import MaterializedColumns
+from .sql import literal, quote
+
+SAMPLE_ROWS = 1000
+
+_NAME_RE = re.compile(r"^(?P<column>.+?)->>(?P<path>\$.*)$")
+_KEY_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_STRING_TYPES = ("VARCHAR", "TEXT", "STRING", "JSON")
+
+
+def parse_json_column(name: str) -> tuple[str, str] | None:
+    """Split ``name`` into its source column and JSON path."""
+    m = _NAME_RE.match(name)
+    if m is None:
+        return None
+    return m.group("column"), m.group("path")
+
+
+def json_column_name(column: str, key: str) -> str:
+    """Return the column name for the top-level ``key`` of ``column``."""
+    if _KEY_RE.match(key):
+        return f"{column}->>$.{key}"
+    escaped = key.replace('"', '\\"')
+    return f'{column}->>$."{escaped}"'
+
+
+def extract_expr(column: str, path: str, ctype: str) -> str:
+    """Return the SQL that extracts ``path`` from ``column`` as ``ctype``."""
+    qcol = quote(column)
+    expr = (
+        f"CASE WHEN json_valid({qcol}) "
+        f"THEN json_extract_string({qcol}, {literal(path)}) END"
+    )
+    if ctype == "VARCHAR":
+        return expr
+    return f"TRY_CAST({expr} AS {ctype})"
+
+
+def _is_string(ctype: str) -> bool:
+    return any(t in ctype.upper() for t in _STRING_TYPES)
+
+
+def _sql_type(json_types: set[str]) -> str:
+    """Pick a column type for the JSON value types seen in a sample."""
+    json_types = json_types - {"NULL"}
+    if json_types and json_types <= {"BIGINT", "UBIGINT"}:
+        return "BIGINT"
+    if json_types and json_types <= {"BIGINT", "UBIGINT", "DOUBLE"}:
+        return "DOUBLE"
+    if json_types == {"BOOLEAN"}:
+        return "BOOLEAN"
+    return "VARCHAR"
+
+
+class JsonPaths:
+    """Discover, type and extract JSON path columns of a database."""
+
+    def __init__(
+        self,
+        con: duckdb.DuckDBPyConnection,
+        materialized: MaterializedColumns,
+        extract: bool = True,
+    ) -> None:
+        self.con = con
+        self.materialized = materialized
+        self.extract = extract
+        self._types: dict[tuple[str, str], str] = {}
+        self._discovered: dict[str, list[tuple[str, str]]] = {}
+        self._pending: set[tuple[str, str]] = set()
+        self._failed: dict[tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+        self._tasks: queue.Queue[tuple[str, str, str]] = queue.Queue()
+        self._worker: threading.Thread | None = None
+
+    def _sample(self, table: str, column: str) -> str:
+        qcol = quote(column)
+        return (
+            f"(SELECT {qcol} AS doc FROM {quote(table)} "
+            f"WHERE {qcol} IS NOT NULL LIMIT {SAMPLE_ROWS}) s"
+        )
+
+    def _infer(self, table: str, column: str, path: str) -> str:
+        rows = self.con.execute(
+            f"SELECT DISTINCT CASE WHEN json_valid(doc) "
+            f"THEN json_type(doc, {literal(path)}) END "
+            f"FROM {self._sample(table, column)}"
+        ).fetchall()
+        return _sql_type({r[0] for r in rows if r[0] is not None})
+
+    def discover(
+        self, table: str, column_types: dict[str, str]
+    ) -> list[tuple[str, str]]:
+        """Return ``(name, type)`` for the top-level keys of JSON columns."""
+        with self._lock:
+            cached = self._discovered.get(table)
+        if cached is not None:
+            return cached
+        found: list[tuple[str, str]] = []
+        for column, ctype in column_types.items():
+            if not _is_string(ctype):
+                continue
+            rows = self.con.execute(
+                "SELECT DISTINCT unnest(json_keys(doc)) AS k FROM ("
+                f"SELECT doc FROM {self._sample(table, column)} WHERE CASE "
+                "WHEN json_valid(doc) THEN json_type(doc) = 'OBJECT' ELSE false END"
+                ") ORDER BY k"
+            ).fetchall()
+            for (key,) in rows:
+                name = json_column_name(column, key)
+                found.append((name, self.type_of(table, name) or "VARCHAR"))
+        with self._lock:
+            self._discovered[table] = found
+        return found
+
+    def type_of(self, table: str, name: str) -> str | None:
+        """Return the inferred type of the JSON path column ``name``."""
+        parsed = parse_json_column(name)
+        if parsed is None:
+            return None
+        with self._lock:
+            ctype = self._types.get((table, name))
+        if ctype is None:
+            ctype = self._infer(table, *parsed)
+            with self._lock:
+                self._types[(table, name)] = ctype
+        return ctype
+
+    def resolve(
+        self, table: str, name: str, column_types: dict[str, str]
+    ) -> tuple[str, str] | None:
+        """Return the extraction expression and type of ``name``.
+
+        The first time a path is resolved its extraction into a stored column
+        is scheduled in the background.
+        """
+        parsed = parse_json_column(name)
+        if parsed is None or not _is_string(column_types.get(parsed[0], "")):
+            return None
+        ctype = self.type_of(table, name)
+        assert ctype is not None
+        expr = extract_expr(parsed[0], parsed[1], ctype)
+        if self.extract and expr not in self.materialized.expressions(table):
+            self._schedule(table, name, expr)
+        return expr, ctype
+
+    def _schedule(self, table: str, name: str, expr: str) -> None:
+        with self._lock:
+            key = (table, name)
+            if key in self._pending or key in self._failed:
+                return
+            self._pending.add(key)
+            self._tasks.put((table, name, expr))
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                table, name, expr = self._tasks.get(timeout=1.0)
+            except queue.Empty:
+                with self._lock:
+                    if self._tasks.empty():
+                        self._worker = None
+                        return
+                continue
+            try:
+                self._extract(table, name, expr)
+            finally:
+                self._tasks.task_done()
+
+    def _extract(self, table: str, name: str, expr: str) -> None:
+        error = None
+        try:
+            self.materialized.save(table, name, expr)
+        except Exception as exc:
+            error = str(exc)
+            print(f"Could not extract {name} of {table}: {error}", file=sys.stderr)
+        with self._lock:
+            self._pending.discard((table, name))
+            if error is not None:
+                self._failed[(table, name)] = error
+
+    def wait(self) -> None:
+        """Block until all scheduled extractions have finished."""
+        self._tasks.join()
+
+    def status(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": [{"table": t, "name": n} for t, n in sorted(self._pending)],
+                "failed": [
+                    {"table": t, "name": n, "error": e}
+                    for (t, n), e in sorted(self._failed.items())
+                ],
+            }
@@ -0,0 +1,390 @@
+"""Derived columns saved as stored values next to their table.
+
+The values of saved derived columns are kept in a hidden sidecar table
+(prefixed with ``__scubaduck_``) keyed by the ``rowid`` of the source row, so
+the user's table itself is never altered.  ``build_query`` joins the sidecar
+in on the row id and reads the stored value instead of evaluating the
+expression whenever a query's derived expression matches a saved one.
+
+Next to the values the sidecar keeps a hash of the visible columns of each
+row.  :meth:`MaterializedColumns.refresh` compares it with the table to
+recompute the values of new and changed rows and forget deleted ones.  Queries
+don't look at the hashes: stored values are only used while the version of the
+table (see ``version``) is the one they were last found current at.  Once the
+version changes, queries evaluate the expression again while the sidecar is
+refreshed, or on a read-only database re-checked, in the background.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import queue
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import duckdb
+
+from .sql import quote
+
+HIDDEN_PREFIX = "__scubaduck_"
+ROW_HASH_COLUMN = "__scubaduck_rowhash"
+SOURCE_ROWID_COLUMN = "__scubaduck_source_rowid"
+_REGISTRY = "__scubaduck_materialized"
+
+
+def is_hidden(name: str) -> bool:
+    """Return whether ``name`` is a table or column managed by ScubaDuck."""
+    return name.startswith(HIDDEN_PREFIX)
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def _column_name(expr: str) -> str:
+    return f"{HIDDEN_PREFIX}mat_{_digest(expr)}"
+
+
+def sidecar_name(table: str) -> str:
+    """Return the name of the table holding the stored values of ``table``."""
+    return f"{HIDDEN_PREFIX}values_{_digest(table)}"
+
+
+@dataclass
+class MaterializedColumn:
+    table: str
+    name: str
+    expr: str
+    column: str
+    type: str
+    rows_updated: int = 0
+    refreshed: float = 0.0
+
+
+@dataclass(frozen=True)
+class StoredValues:
+    """The sidecar of a table and the saved expressions it holds.
+
+    ``columns`` maps saved expressions to sidecar columns.
+    """
+
+    sidecar: str
+    columns: dict[str, str]
+
+
+class MaterializedColumns:
+    """Registry of derived columns stored in sidecar tables.
+
+    Saved columns are recorded in a ``__scubaduck_materialized`` table inside
+    the database so that they are picked up again when it is reopened.
+    ``version(table)`` must change whenever the table does; without it stored
+    values are trusted until the next refresh.  With ``writable`` false the
+    sidecars are only checked, never refreshed.
+    """
+
+    def __init__(
+        self,
+        con: duckdb.DuckDBPyConnection,
+        version: Callable[[str], str] | None = None,
+        writable: bool = True,
+    ) -> None:
+        self.con = con
+        self.version = version
+        self.writable = writable
+        self._columns: dict[tuple[str, str], MaterializedColumn] = {}
+        self._hashes: dict[str, str] = {}
+        # The table version the sidecar was last checked at and whether it
+        # matched the table then.
+        self._checked: dict[str, tuple[str, bool]] = {}
+        self._pending: set[str] = set()
+        self._tasks: queue.Queue[str] = queue.Queue()
+        self._worker: threading.Thread | None = None
+        # ``_lock`` guards the registry and is only held briefly, so that
+        # queries looking up stored columns don't wait for ``_write_lock``,
+        # which is held while the values are written.
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        if self._is_base_table(_REGISTRY):
+            rows = con.execute(
+                f"SELECT table_name, name, expr, column_name, column_type "
+                f"FROM {_REGISTRY}"
+            ).fetchall()
+            for table, name, expr, column, ctype in rows:
+                self._columns[(table, name)] = MaterializedColumn(
+                    table, name, expr, column, ctype
+                )
+            for table in {m.table for m in self._columns.values()}:
+                try:
+                    self._hashes[table] = self._row_hash(table)
+                except duckdb.Error:
+                    # The table is gone; its saved columns are not used.
+                    pass
+
+    def _is_base_table(self, table: str) -> bool:
+        return bool(
+            self.con.execute(
+                "SELECT count(*) FROM duckdb_tables() WHERE table_name = ?",
+                [table],
+            ).fetchall()[0][0]
+        )
+
+    def _row_hash(self, table: str) -> str:
+        rows = self.con.execute(f"PRAGMA table_info({quote(table)})").fetchall()
+        return "hash(" + ", ".join(f"t.{quote(r[1])}" for r in rows) + ")"
+
+    def tables(self) -> list[str]:
+        """Return the tables that have saved columns."""
+        with self._lock:
+            return sorted({m.table for m in self._columns.values()})
+
+    def expressions(self, table: str) -> set[str]:
+        """Return the saved expressions of ``table``."""
+        with self._lock:
+            return {m.expr for m in self._columns.values() if m.table == table}
+
+    def stored(self, table: str) -> StoredValues | None:
+        """Return where the saved expressions of ``table`` are stored.
+
+        ``None`` is returned while the stored values may be out of date; a
+        check is then scheduled in the background.
+        """
+        version = self._version(table)
+        with self._lock:
+            columns = {
+                m.expr: m.column for m in self._columns.values() if m.table == table
+            }
+            checked = self._checked.get(table)
+        if not columns:
+            return None
+        if checked is None or checked[0] != version:
+            self._schedule(table)
+            return None
+        if not checked[1]:
+            return None
+        return StoredValues(sidecar_name(table), columns)
+
+    def _version(self, table: str) -> str:
+        return self.version(table) if self.version is not None else ""
+
+    def _mark_checked(self, table: str, current: bool) -> None:
+        version = self._version(table)
+        with self._lock:
+            self._checked[table] = (version, current)
+
+    def _schedule(self, table: str) -> None:
+        with self._lock:
+            if table in self._pending:
+                return
+            self._pending.add(table)
+            self._tasks.put(table)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                table = self._tasks.get(timeout=1.0)
+            except queue.Empty:
+                with self._lock:
+                    if self._tasks.empty():
+                        self._worker = None
+                        return
+                continue
+            try:
+                self.check(table)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._pending.discard(table)
+                self._tasks.task_done()
+
+    def wait(self) -> None:
+        """Block until all scheduled checks have finished."""
+        self._tasks.join()
+
+    def check(self, table: str) -> bool:
+        """Bring the sidecar of ``table`` up to date, or check that it is.
+
+        Returns whether queries may use the stored values.
+        """
+        if not self.expressions(table):
+            return False
+        if self.writable:
+            self.refresh(table)
+            return True
+        with self._write_lock:
+            version = self._version(table)
+            current = self._is_base_table(sidecar_name(table)) and not self._stale(
+                table
+            )
+            with self._lock:
+                self._checked[table] = (version, current)
+        return current
+
+    def _stale(self, table: str) -> int:
+        """Return the number of rows whose stored values are out of date."""
+        sidecar = sidecar_name(table)
+        return self.con.execute(
+            f"SELECT count(*) FROM {quote(table)} AS t "
+            f"FULL JOIN {sidecar} AS s ON s.{SOURCE_ROWID_COLUMN} = t.rowid "
+            f"WHERE s.{ROW_HASH_COLUMN} IS DISTINCT FROM {self._row_hash(table)}"
+        ).fetchall()[0][0]
+
+    def _entries(self, table: str) -> list[MaterializedColumn]:
+        with self._lock:
+            return [m for m in self._columns.values() if m.table == table]
+
+    def _rebuild(self, table: str, entries: list[MaterializedColumn]) -> int:
+        """Recompute the sidecar of ``table`` from scratch for ``entries``."""
+        # Called with ``self._write_lock`` held.
+        values = {m.column: m.expr for m in entries}
+        row_hash = self._row_hash(table)
+        select = ", ".join(
+            [f"t.rowid AS {SOURCE_ROWID_COLUMN}", f"{row_hash} AS {ROW_HASH_COLUMN}"]
+            + [f"{expr} AS {quote(col)}" for col, expr in values.items()]
+        )
+        self.con.execute(
+            f"CREATE OR REPLACE TABLE {sidecar_name(table)} AS "
+            f"SELECT {select} FROM {quote(table)} AS t"
+        )
+        with self._lock:
+            self._hashes[table] = row_hash
+        return self.con.execute(
+            f"SELECT count(*) FROM {sidecar_name(table)}"
+        ).fetchall()[0][0]
+
+    def save(self, table: str, name: str, expr: str) -> MaterializedColumn:
+        """Store the values of ``expr`` for ``table`` and register it as ``name``.
+
+        Queries keep using the previously saved columns while the values are
+        computed; the new column is only used once it is complete.
+        """
+        expr = expr.strip()
+        if not expr:
+            raise ValueError("Expression required")
+        with self._write_lock:
+            if not self._is_base_table(table):
+                raise ValueError(f"{table} is not a base table")
+            column = _column_name(expr)
+            ctype = self.con.execute(
+                f"DESCRIBE SELECT {expr} AS v FROM {quote(table)}"
+            ).fetchall()[0][1]
+            with self._lock:
+                existing = self._columns.get((table, name))
+            if existing is not None and existing.expr != expr:
+                self._remove(existing)
+            entries = self._entries(table)
+            entry = MaterializedColumn(table, name, expr, column, ctype)
+            updated = 0
+            rebuilt = not any(m.column == column for m in entries)
+            if rebuilt:
+                updated = self._rebuild(table, entries + [entry])
+            self.con.execute(
+                f"CREATE TABLE IF NOT EXISTS {_REGISTRY} (table_name VARCHAR, "
+                "name VARCHAR, expr VARCHAR, column_name VARCHAR, column_type VARCHAR)"
+            )
+            self.con.execute(
+                f"DELETE FROM {_REGISTRY} WHERE table_name = ? AND name = ?",
+                [table, name],
+            )
+            self.con.execute(
+                f"INSERT INTO {_REGISTRY} VALUES (?, ?, ?, ?, ?)",
+                [table, name, expr, column, ctype],
+            )
+            entry.rows_updated = updated
+            entry.refreshed = time.time()
+            with self._lock:
+                self._columns[(table, name)] = entry
+            if rebuilt:
+                self._mark_checked(table, True)
+            return entry
+
+    def drop(self, table: str, name: str) -> None:
+        """Forget the saved column ``name`` and drop its storage if unused."""
+        with self._write_lock:
+            with self._lock:
+                entry = self._columns.get((table, name))
+            if entry is None:
+                raise KeyError(name)
+            self._remove(entry)
+
+    def _remove(self, entry: MaterializedColumn) -> None:
+        # Called with ``self._write_lock`` held.
+        with self._lock:
+            del self._columns[(entry.table, entry.name)]
+        self.con.execute(
+            f"DELETE FROM {_REGISTRY} WHERE table_name = ? AND name = ?",
+            [entry.table, entry.name],
+        )
+        remaining = self._entries(entry.table)
+        sidecar = sidecar_name(entry.table)
+        if not remaining:
+            with self._lock:
+                self._hashes.pop(entry.table, None)
+                self._checked.pop(entry.table, None)
+            self.con.execute(f"DROP TABLE IF EXISTS {sidecar}")
+        elif not any(m.column == entry.column for m in remaining):
+            self.con.execute(f"ALTER TABLE {sidecar} DROP COLUMN {quote(entry.column)}")
+
+    def refresh(self, table: str) -> int:
+        """Recompute stored values of ``table`` for new or changed rows.
+
+        Returns the number of rows that were recomputed.
+        """
+        with self._write_lock:
+            entries = self._entries(table)
+            if not entries:
+                return 0
+            row_hash = self._row_hash(table)
+            with self._lock:
+                current = self._hashes.get(table)
+            if row_hash != current or not self._is_base_table(sidecar_name(table)):
+                # The columns of the table changed; every row hash did too.
+                updated = self._rebuild(table, entries)
+            else:
+                sidecar = sidecar_name(table)
+                qtable = quote(table)
+                self.con.execute(
+                    f"DELETE FROM {sidecar} WHERE NOT EXISTS ("
+                    f"SELECT 1 FROM {qtable} AS t "
+                    f"WHERE t.rowid = {sidecar}.{SOURCE_ROWID_COLUMN} "
+                    f"AND {row_hash} = {sidecar}.{ROW_HASH_COLUMN})"
+                )
+                values = {m.column: m.expr for m in entries}
+                columns = [SOURCE_ROWID_COLUMN, ROW_HASH_COLUMN] + [
+                    quote(c) for c in values
+                ]
+                select = ", ".join(["t.rowid", row_hash, *values.values()])
+                updated = self.con.execute(
+                    f"INSERT INTO {sidecar} ({', '.join(columns)}) "
+                    f"SELECT {select} FROM {qtable} AS t WHERE NOT EXISTS ("
+                    f"SELECT 1 FROM {sidecar} AS s "
+                    f"WHERE s.{SOURCE_ROWID_COLUMN} = t.rowid)"
+                ).fetchall()[0][0]
+            now = time.time()
+            with self._lock:
+                for m in entries:
+                    m.rows_updated = updated
+                    m.refreshed = now
+            self._mark_checked(table, True)
+            return updated
+
+    def status(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "table": m.table,
+                    "name": m.name,
+                    "expr": m.expr,
+                    "column": m.column,
+                    "type": m.type,
+                    "rows_updated": m.rows_updated,
+                    "refreshed": m.refreshed,
+                }
+                for m in sorted(self._columns.values(), key=lambda m: (m.table, m.name))
+            ]
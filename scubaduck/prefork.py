@@ -0,0 +1,114 @@
+"""Serve the app from several pre-forked worker processes.
+
+One process answering requests on threads is bound by the GIL for the Python
+side of every query (validating payloads, serializing results).  :func:`serve`
+binds the listening socket once and forks workers that accept connections on
+it, restarting any worker that dies.
+
+DuckDB must not be carried across a fork, so every worker creates its own
+app after forking.  Workers open the same DuckDB snapshot read-only: data is
+loaded into the snapshot once (see :func:`~scubaduck.server.prepare_snapshot`)
+instead of into the memory of each worker, and the operating system's page
+cache is shared between them.  Results are shared through the on-disk result
+cache when the app has one.
+"""
+
+from __future__ import annotations
+
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from types import FrameType
+from typing import Callable
+
+from flask import Flask
+from werkzeug.serving import make_server
+
+
+# A worker that exits sooner than this after starting is broken rather than
+# unlucky; respawning it would only loop.
+_MIN_UPTIME = 5.0
+
+
+def _raise_exit(signum: int, frame: FrameType | None) -> None:
+    raise SystemExit(0)
+
+
+def _worker(make_app: Callable[[], Flask], sock: socket.socket) -> int:
+    signal.signal(signal.SIGTERM, _raise_exit)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        app = make_app()
+        host, port = sock.getsockname()[:2]
+        server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def serve(make_app: Callable[[], Flask], host: str, port: int, workers: int) -> int:
+    """Serve the apps made by ``make_app`` from ``workers`` processes.
+
+    Runs until SIGTERM or SIGINT and returns the exit status.  ``port`` may
+    be 0 to pick a free port; the address is printed to stderr.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.create_server((host, port), family=family, backlog=128)
+    bound = sock.getsockname()[1]
+    print(f"Serving on http://{host}:{bound} with {workers} workers", file=sys.stderr)
+    children: dict[int, float] = {}
+    stopping = False
+    status = 0
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = _worker(make_app, sock)
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                # Skip the parent's exit handlers and DuckDB's destructors.
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum: int, frame: FrameType | None) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    previous = {s: signal.signal(s, stop) for s in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        for _ in range(workers):
+            spawn()
+        while children:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            started = children.pop(pid, None)
+            if started is None or stopping:
+                continue
+            if time.monotonic() - started < _MIN_UPTIME:
+                print(f"Worker {pid} exited during startup", file=sys.stderr)
+                status = 1
+                stop(signal.SIGTERM, None)
+                continue
+            spawn()
+    finally:
+        for s, handler in previous.items():
+            signal.signal(s, handler)
+        sock.close()
+    return status
@@ -0,0 +1,252 @@
+"""Typed query representation shared by validation, caching and SQL generation.
+
+``QueryParams`` is what the ``/api/query`` payload is parsed into.  Before SQL
+is generated it is run through :func:`canonicalize`, which applies a sequence of
+normalization passes so that queries that must return the same rows compare
+equal.  :func:`fingerprint` hashes the canonical form and is what caches key on.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any, Callable
+
+from dateutil import parser as dtparser
+
+
+@dataclass
+class Filter:
+    column: str
+    op: str
+    value: str | int | float | list[str] | None
+
+
+@dataclass
+class QueryParams:
+    start: str | None = None
+    end: str | None = None
+    order_by: str | None = None
+    order_dir: str = "ASC"
+    limit: int | None = None
+    columns: list[str] = field(default_factory=lambda: [])
+    filters: list[Filter] = field(default_factory=lambda: [])
+    derived_columns: dict[str, str] = field(default_factory=lambda: {})
+    json_columns: dict[str, str] = field(default_factory=lambda: {})
+    graph_type: str = "samples"
+    group_by: list[str] = field(default_factory=lambda: [])
+    aggregate: str | None = None
+    show_hits: bool = False
+    x_axis: str | None = None
+    granularity: str = "Auto"
+    fill: str = "0"
+    table: str = "events"
+    time_column: str | None = "timestamp"
+    time_unit: str = "s"
+    chart_width: int | None = None
+    bucket_size: int | None = None
+    end_exclusive: bool = False
+    keyset: bool = False
+    after_value: str | int | float | None = None
+    after_rowid: int | None = None
+    sample_percent: float | None = None
+
+
+Pass = Callable[[QueryParams], QueryParams]
+
+_NUMBER = re.compile(r"[+-]?\d+(\.\d*)?")
+
+
+def _filter_key(f: Filter) -> tuple[str, str, str]:
+    return (f.column, f.op, json.dumps(f.value, sort_keys=True, default=str))
+
+
+def drop_noop_filters(params: QueryParams) -> QueryParams:
+    """Remove filters without a value; ``build_query`` ignores them anyway."""
+    kept: list[Filter] = []
+    for f in params.filters:
+        if f.op not in {"empty", "!empty"}:
+            if f.value is None or f.value == []:
+                continue
+        else:
+            f = Filter(f.column, f.op, None)
+        kept.append(f)
+    return replace(params, filters=kept)
+
+
+def normalize_value_lists(params: QueryParams) -> QueryParams:
+    """Sort and deduplicate IN lists; single element lists become scalars."""
+    out: list[Filter] = []
+    for f in params.filters:
+        if isinstance(f.value, list):
+            values = sorted(set(f.value), key=str)
+            value: str | int | float | list[str] | None = (
+                values[0] if len(values) == 1 else values
+            )
+            f = Filter(f.column, f.op, value)
+        out.append(f)
+    return replace(params, filters=out)
+
+
+def merge_equality_filters(params: QueryParams) -> QueryParams:
+    """Intersect ``=`` filters on the same column into a single filter.
+
+    Filters whose intersection is empty are left alone so that the query still
+    (correctly) returns nothing.
+    """
+    by_column: dict[str, list[Filter]] = {}
+    for f in params.filters:
+        if f.op == "=" and isinstance(f.value, (str, int, float, list)):
+            by_column.setdefault(f.column, []).append(f)
+    out: list[Filter] = []
+    merged: set[str] = set()
+    for f in params.filters:
+        group = by_column.get(f.column)
+        if group is None or len(group) < 2 or not any(g is f for g in group):
+            out.append(f)
+            continue
+        if f.column in merged:
+            continue
+        # Values are compared as strings, as ``1`` and ``"1"`` select the
+        # same rows, but the first spelling seen is kept.
+        common: dict[str, Any] | None = None
+        for g in group:
+            items: list[Any] = g.value if isinstance(g.value, list) else [g.value]
+            vals = {str(v): v for v in reversed(items)}
+            if common is None:
+                common = vals
+            else:
+                common = {k: v for k, v in common.items() if k in vals}
+        if not common:
+            out.append(f)
+            continue
+        merged.add(f.column)
+        values = [common[k] for k in sorted(common)]
+        out.append(Filter(f.column, "=", values[0] if len(values) == 1 else values))
+    return replace(params, filters=out)
+
+
+def merge_inequality_filters(params: QueryParams) -> QueryParams:
+    """Union ``!=`` filters on the same column into a single NOT IN list."""
+    values: dict[str, set[Any]] = {}
+    for f in params.filters:
+        if f.op == "!=" and isinstance(f.value, (str, list)):
+            vals = set(f.value) if isinstance(f.value, list) else {f.value}
+            values.setdefault(f.column, set()).update(vals)
+    out: list[Filter] = []
+    for f in params.filters:
+        if f.op != "!=" or not isinstance(f.value, (str, list)):
+            out.append(f)
+            continue
+        vals = values.pop(f.column, None)
+        if vals is None:
+            continue
+        merged = sorted(vals, key=repr)
+        out.append(Filter(f.column, "!=", merged[0] if len(merged) == 1 else merged))
+    return replace(params, filters=out)
+
+
+def fold_time_filters(params: QueryParams) -> QueryParams:
+    """Merge ``>=``/``<=`` filters on the time column into ``start``/``end``.
+
+    The resulting range is the intersection of the explicit range and any
+    inclusive bounds expressed as filters.  Bare numbers are left alone: they
+    may be epochs or other integers that ``dateutil`` would read as dates.
+    """
+    tcol = params.time_column
+    if not tcol:
+        return params
+    start, end = params.start, params.end
+    out: list[Filter] = []
+    for f in params.filters:
+        if (
+            f.column != tcol
+            or f.op not in {">=", "<="}
+            or not isinstance(f.value, str)
+            or _NUMBER.fullmatch(f.value.strip())
+        ):
+            out.append(f)
+            continue
+        try:
+            bound = dtparser.parse(f.value).strftime("%Y-%m-%d %H:%M:%S")
+        except (ValueError, OverflowError):
+            out.append(f)
+            continue
+        if f.op == ">=":
+            if start is None or dtparser.parse(bound) > dtparser.parse(start):
+                start = bound
+        elif end is None or dtparser.parse(bound) < dtparser.parse(end):
+            if params.end_exclusive:
+                # An inclusive bound can't tighten an exclusive end.
+                out.append(f)
+                continue
+            end = bound
+    return replace(params, start=start, end=end, filters=out)
+
+
+def dedupe_filters(params: QueryParams) -> QueryParams:
+    """Drop repeated filters and put the rest in a deterministic order."""
+    unique = {_filter_key(f): f for f in params.filters}
+    return replace(params, filters=[unique[k] for k in sorted(unique)])
+
+
+def normalize_options(params: QueryParams) -> QueryParams:
+    """Normalize fields that don't change the generated SQL.
+
+    ``fill`` and ``show_hits`` only affect rendering, and once the bucket size
+    has been resolved the granularity name and chart width are redundant.
+    """
+    aggregate = params.aggregate.lower() if params.aggregate else None
+    granularity = params.granularity
+    chart_width = params.chart_width
+    if params.graph_type != "timeseries":
+        granularity = "Auto"
+        chart_width = None
+    elif params.bucket_size is not None:
+        granularity = f"{params.bucket_size} seconds"
+        chart_width = None
+    order_by = params.order_by
+    if order_by and order_by.strip().lower() == "samples":
+        order_by = "Hits"
+    return replace(
+        params,
+        aggregate=aggregate,
+        granularity=granularity,
+        chart_width=chart_width,
+        order_by=order_by,
+        order_dir=params.order_dir.upper(),
+        fill="0",
+        show_hits=False,
+    )
+
+
+PASSES: list[Pass] = [
+    drop_noop_filters,
+    normalize_value_lists,
+    merge_equality_filters,
+    merge_inequality_filters,
+    fold_time_filters,
+    dedupe_filters,
+    normalize_options,
+]
+
+
+def canonicalize(params: QueryParams) -> QueryParams:
+    """Return the canonical form of ``params`` after all :data:`PASSES`."""
+    for p in PASSES:
+        params = p(params)
+    return params
+
+
+def to_json(params: QueryParams) -> dict[str, Any]:
+    return asdict(params)
+
+
+def fingerprint(params: QueryParams) -> str:
+    """Return a stable hash of the canonical form of ``params``."""
+    data = json.dumps(
+        to_json(canonicalize(params)), sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
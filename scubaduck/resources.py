@@ -0,0 +1,93 @@
+"""DuckDB resource settings and per-query thread caps.
+
+``memory_limit``, ``threads`` and ``temp_directory`` are applied once when
+the server starts; with a temp directory DuckDB spills large aggregations and
+sorts to disk instead of failing when they outgrow the memory limit.
+
+DuckDB's thread count is a setting of the whole database, not of a single
+query.  :meth:`ResourceGovernor.limit` therefore sets it to the largest cap
+among the queries running at the time: a capped query only runs with fewer
+threads while nothing uncapped runs next to it, and never slows one down.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Generator
+
+import duckdb
+
+from .sql import literal
+
+PRIORITY_HEADER = "X-Scubaduck-Priority"
+
+
+class ResourceGovernor:
+    """Apply DuckDB resource settings and per-query thread caps."""
+
+    def __init__(
+        self,
+        con: duckdb.DuckDBPyConnection,
+        memory_limit: str | None = None,
+        threads: int | None = None,
+        temp_directory: str | None = None,
+    ) -> None:
+        self.con = con
+        if memory_limit is not None:
+            con.execute(f"SET memory_limit = {literal(memory_limit)}")
+        if threads is not None:
+            con.execute(f"SET threads = {int(threads)}")
+        if temp_directory is not None:
+            con.execute(f"SET temp_directory = {literal(temp_directory)}")
+        self.max_threads = int(self._setting("threads"))
+        self._running: Counter[int] = Counter()
+        self._threads = self.max_threads
+        self._lock = threading.Lock()
+
+    def _setting(self, name: str) -> Any:
+        return self.con.execute("SELECT current_setting(?)", [name]).fetchall()[0][0]
+
+    def _apply(self) -> None:
+        # Called with ``self._lock`` held.
+        threads = max(self._running, default=self.max_threads)
+        if threads != self._threads:
+            self.con.execute(f"SET threads = {threads}")
+            self._threads = threads
+
+    @contextmanager
+    def limit(self, threads: int | None) -> Generator[None]:
+        """Run the enclosed query with at most ``threads`` threads."""
+        cap = self.max_threads if threads is None else min(threads, self.max_threads)
+        cap = max(cap, 1)
+        with self._lock:
+            self._running[cap] += 1
+            self._apply()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running[cap] -= 1
+                if not self._running[cap]:
+                    del self._running[cap]
+                self._apply()
+
+    def status(self) -> dict[str, Any]:
+        memory = self.con.execute(
+            "SELECT tag, memory_usage_bytes, temporary_storage_bytes "
+            "FROM duckdb_memory() ORDER BY tag"
+        ).fetchall()
+        with self._lock:
+            running = sum(self._running.values())
+            threads = self._threads
+        return {
+            "memory_limit": self._setting("memory_limit"),
+            "threads": self.max_threads,
+            "current_threads": threads,
+            "temp_directory": self._setting("temp_directory"),
+            "memory_usage": sum(r[1] for r in memory),
+            "temporary_storage": sum(r[2] for r in memory),
+            "memory_by_tag": {r[0]: r[1] for r in memory if r[1]},
+            "running_queries": running,
+        }
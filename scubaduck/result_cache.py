@@ -0,0 +1,429 @@
+"""Query result cache with semantic reuse of cached aggregates.
+
+Besides exact hits on a query fingerprint, :func:`derive_rows` answers
+an aggregated query from a cached one when the cached result is strictly more
+detailed: finer buckets, extra ``group_by`` columns or a wider time range.
+This only works for aggregates that can be merged (count, sum, min and max).
+
+Time series whose range extends past a cached one (such as a sliding window
+ending "now") are answered by :func:`extend_range`: the overlap comes from the
+cache and only the new buckets at the end are queried.
+
+Results can also be written through to a :class:`~scubaduck.disk_cache.DiskCache`
+so that exact hits survive restarts.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+from dateutil import parser as dtparser
+
+from .disk_cache import DiskCache
+from .execution import row_bytes
+from .query_ir import QueryParams, fingerprint
+
+Row = tuple[Any, ...]
+
+_MERGEABLE = {"count", "sum", "min", "max"}
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+@dataclass
+class CachedResult:
+    params: QueryParams
+    rows: list[Row]
+    complete: bool
+    created: float
+    version: str = ""
+    size: int = 0
+
+
+def output_columns(params: QueryParams) -> list[str] | None:
+    """Return the names of the columns ``build_query`` selects for ``params``.
+
+    ``None`` is returned for queries that aren't aggregated.
+    """
+    group_cols = list(params.group_by)
+    if params.graph_type == "timeseries":
+        group_cols = ["bucket"] + group_cols
+    if not group_cols and params.aggregate is None:
+        return None
+    agg = (params.aggregate or "count").lower()
+    cols = group_cols + ["Hits"]
+    if agg == "count":
+        if params.graph_type != "table":
+            cols.append("Count")
+        agg_cols = list(params.derived_columns)
+    else:
+        agg_cols = params.columns + [
+            c for c in params.derived_columns if c not in params.columns
+        ]
+    cols.extend(c for c in agg_cols if c not in group_cols)
+    return cols
+
+
+def _epoch_seconds(value: str) -> float:
+    dt = dtparser.parse(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - _EPOCH).total_seconds()
+
+
+def _covers_range(cached: QueryParams, new: QueryParams, step: int | None) -> bool:
+    """Return whether every row of ``new`` is in ``cached`` in whole buckets."""
+    if new.start != cached.start:
+        if step is None or new.start is None or cached.start is None:
+            return False
+        s_new = _epoch_seconds(new.start)
+        if s_new < _epoch_seconds(cached.start) or s_new % step:
+            return False
+    if new.end != cached.end or new.end_exclusive != cached.end_exclusive:
+        if step is None or new.end is None or not new.end_exclusive:
+            return False
+        e_new = _epoch_seconds(new.end)
+        if e_new % step:
+            return False
+        if cached.end is not None and e_new > _epoch_seconds(cached.end):
+            return False
+    return True
+
+
+def _sort_rows(rows: list[Row], keys: list[tuple[int, bool]]) -> list[Row]:
+    """Sort like DuckDB's ORDER BY, which puts NULLs last in both directions.
+
+    ``keys`` are ``(index, descending)`` pairs, most significant first.
+    """
+    for index, desc in reversed(keys):
+        present = [r for r in rows if r[index] is not None]
+        missing = [r for r in rows if r[index] is None]
+        present.sort(key=lambda r: r[index], reverse=desc)
+        rows = present + missing
+    return rows
+
+
+def sort_columns(params: QueryParams) -> list[str]:
+    """Return the columns ``build_query`` sorts aggregated results by.
+
+    After ``order_by`` the result is sorted by the bucket and every
+    ``group_by`` column, so that the order of the rows is fully determined
+    and results derived from the cache come out in the same order.
+    """
+    keys = [params.order_by] if params.order_by else []
+    group_cols = list(params.group_by)
+    if params.graph_type == "timeseries":
+        group_cols = ["bucket"] + group_cols
+    return keys + [c for c in group_cols if c not in keys]
+
+
+def _merge(agg: str, a: Any, b: Any) -> Any:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if agg == "min":
+        return min(a, b)
+    if agg == "max":
+        return max(a, b)
+    return a + b
+
+
+def derive_rows(cached: CachedResult, new: QueryParams) -> list[Row] | None:
+    """Compute the rows of ``new`` from ``cached`` or return ``None``."""
+    old = cached.params
+    if not cached.complete:
+        return None
+    if new.graph_type != old.graph_type or new.graph_type not in {
+        "table",
+        "timeseries",
+    }:
+        return None
+    if not new.derived_columns.items() <= old.derived_columns.items():
+        return None
+    if not new.json_columns.items() <= old.json_columns.items():
+        return None
+    same = [
+        "table",
+        "filters",
+        "time_column",
+        "time_unit",
+        "x_axis",
+        "aggregate",
+        "sample_percent",
+    ]
+    if any(getattr(new, f) != getattr(old, f) for f in same):
+        return None
+    agg = (new.aggregate or "count").lower()
+    if agg not in _MERGEABLE:
+        return None
+    if not set(new.group_by) <= set(old.group_by):
+        return None
+    old_cols = output_columns(old)
+    new_cols = output_columns(new)
+    if old_cols is None or new_cols is None:
+        return None
+    if not set(new_cols) <= set(old_cols):
+        return None
+
+    old_step: int | None = None
+    new_step: int | None = None
+    if new.graph_type == "timeseries":
+        if old.bucket_size is None or new.bucket_size is None:
+            return None
+        if new.bucket_size % old.bucket_size:
+            return None
+        old_step, new_step = old.bucket_size, new.bucket_size
+    slice_step = old_step if new.x_axis in (None, new.time_column) else None
+    if not _covers_range(old, new, slice_step):
+        return None
+    if new_step is not None and new.start != old.start and new.start is not None:
+        # The first bucket of the new query must not mix in cached rows from
+        # before its start.
+        if _epoch_seconds(new.start) % new_step:
+            return None
+    if new_step is not None and new.end != old.end and new.end is not None:
+        if _epoch_seconds(new.end) % new_step:
+            return None
+
+    idx = {c: i for i, c in enumerate(old_cols)}
+    key_cols = ["bucket"] if new.graph_type == "timeseries" else []
+    key_cols += new.group_by
+    value_cols = [c for c in new_cols if c not in key_cols]
+    old_keys = set(old.group_by)
+    if old.graph_type == "timeseries":
+        old_keys.add("bucket")
+    if any(c in old_keys for c in value_cols):
+        # A group key of the cached query can't be re-aggregated as a value.
+        return None
+    lo: float | None = None
+    hi: float | None = None
+    if new.start is not None and new.start != old.start:
+        lo = _epoch_seconds(new.start)
+    if new.end is not None and (
+        new.end != old.end or new.end_exclusive != old.end_exclusive
+    ):
+        hi = _epoch_seconds(new.end)
+
+    groups: dict[Row, list[Any]] = {}
+    for row in cached.rows:
+        key_vals: list[Any] = []
+        for c in key_cols:
+            v = row[idx[c]]
+            if c == "bucket" and new_step is not None:
+                secs = (v - _EPOCH).total_seconds()
+                if (lo is not None and secs < lo) or (hi is not None and secs >= hi):
+                    break
+                v = _EPOCH + timedelta(seconds=secs - secs % new_step)
+            key_vals.append(v)
+        else:
+            key = tuple(key_vals)
+            vals = [row[idx[c]] for c in value_cols]
+            cur = groups.get(key)
+            if cur is None:
+                groups[key] = vals
+            else:
+                for i, c in enumerate(value_cols):
+                    m = "sum" if c in {"Hits", "Count"} else agg
+                    cur[i] = _merge(m, cur[i], vals[i])
+
+    pos = {c: i for i, c in enumerate(new_cols)}
+    rows: list[Row] = []
+    for key, vals in groups.items():
+        out: list[Any] = [None] * len(new_cols)
+        for c, v in zip(key_cols, key):
+            out[pos[c]] = v
+        for c, v in zip(value_cols, vals):
+            out[pos[c]] = v
+        rows.append(tuple(out))
+
+    desc = new.order_dir.upper() == "DESC"
+    keys = [(pos[c], desc and c == new.order_by) for c in sort_columns(new) if c in pos]
+    rows = _sort_rows(rows, keys)
+    if new.limit is not None:
+        rows = rows[: new.limit]
+    return rows
+
+
+def extend_range(
+    cached: CachedResult, new: QueryParams
+) -> tuple[list[Row], QueryParams] | None:
+    """Split ``new`` into rows derived from ``cached`` and a query for the rest.
+
+    Returns the rows of ``new`` up to the end of ``cached`` and the parameters
+    of the query for the remaining buckets, or ``None`` if ``new`` doesn't
+    continue ``cached`` on a bucket boundary.
+    """
+    old = cached.params
+    if new.graph_type != "timeseries" or new.x_axis not in (None, new.time_column):
+        return None
+    if new.bucket_size is None or new.start is None or new.end is None:
+        return None
+    if old.end is None:
+        return None
+    new_cols = output_columns(new)
+    if new_cols is None or (new.order_by in new_cols and new.order_by != "bucket"):
+        # The rows have to come back in bucket order to be concatenated.
+        return None
+    # Split on the last bucket boundary the cached result fully covers.
+    split = _epoch_seconds(old.end)
+    split -= split % new.bucket_size
+    if not _epoch_seconds(new.start) < split < _epoch_seconds(new.end):
+        return None
+    boundary = (_EPOCH + timedelta(seconds=split)).strftime("%Y-%m-%d %H:%M:%S")
+    head = derive_rows(cached, replace(new, end=boundary, end_exclusive=True))
+    if head is None:
+        return None
+    return head, replace(new, start=boundary)
+
+
+class ResultCache:
+    """TTL/LRU cache of query results keyed by query fingerprint.
+
+    At most ``limit`` results of about ``max_bytes`` bytes in total are kept
+    in memory.  ``version(table)`` must change whenever the table does;
+    results are only reused while the version they were computed at is
+    current.  With a ``store``, results are also kept on disk keyed by the
+    fingerprint and the version.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300.0,
+        limit: int = 100,
+        store: DiskCache | None = None,
+        version: Callable[[str], str] | None = None,
+        max_bytes: int | None = None,
+    ) -> None:
+        self.ttl = ttl
+        self.limit = limit
+        self.store = store
+        self.version = version
+        self.max_bytes = max_bytes
+        self._bytes = 0
+        self._entries: dict[str, CachedResult] = {}
+        self._lock = threading.Lock()
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def bytes(self) -> int:
+        """Return the estimated size of the results kept in memory."""
+        with self._lock:
+            return self._bytes
+
+    def _version(self, table: str) -> str:
+        return self.version(table) if self.version is not None else ""
+
+    def _candidates(self, table: str, version: str) -> list[CachedResult]:
+        """Return the fresh entries of ``table`` computed at ``version``."""
+        now = time.time()
+        with self._lock:
+            return [
+                e
+                for e in self._entries.values()
+                if e.params.table == table
+                and e.version == version
+                and now - e.created <= self.ttl
+            ]
+
+    def get(self, params: QueryParams) -> tuple[list[Row], str] | None:
+        """Return cached rows for ``params`` and how they were obtained."""
+        key = fingerprint(params)
+        version = self._version(params.table)
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry is not None
+                and entry.version == version
+                and time.time() - entry.created <= self.ttl
+            ):
+                return entry.rows, "exact"
+        if self.store is not None:
+            stored = self.store.get(f"{key}:{version}")
+            if stored is not None:
+                self._remember(params, stored, version)
+                return stored, "disk"
+        for entry in self._candidates(params.table, version):
+            rows = derive_rows(entry, params)
+            if rows is not None:
+                return rows, "derived"
+        return None
+
+    def put(self, params: QueryParams, rows: list[Row]) -> None:
+        version = self._version(params.table)
+        self._remember(params, rows, version)
+        if self.store is not None:
+            self.store.put_later(f"{fingerprint(params)}:{version}", rows)
+
+    def _remember(self, params: QueryParams, rows: list[Row], version: str) -> None:
+        complete = params.limit is None or len(rows) < params.limit
+        size = sum(row_bytes(r) for r in rows)
+        key = fingerprint(params)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            entry = CachedResult(params, rows, complete, time.time(), version, size)
+            self._entries[key] = entry
+            self._bytes += size
+            while len(self._entries) > self.limit or (
+                self.max_bytes is not None and self._bytes > self.max_bytes
+            ):
+                oldest = min(self._entries.items(), key=lambda kv: kv[1].created)[0]
+                self._bytes -= self._entries.pop(oldest).size
+
+    def extend(self, params: QueryParams) -> tuple[list[Row], QueryParams] | None:
+        """Return cached leading rows of ``params`` and a query for the rest.
+
+        The cached result reaching furthest into the range of ``params`` is
+        used, so the remaining query is as small as possible.
+        """
+        candidates = self._candidates(params.table, self._version(params.table))
+        candidates.sort(
+            key=lambda e: _epoch_seconds(e.params.end) if e.params.end else 0.0,
+            reverse=True,
+        )
+        for entry in candidates:
+            split = extend_range(entry, params)
+            if split is not None:
+                return split
+        return None
+
+    def fetch(
+        self,
+        params: QueryParams,
+        run: Callable[[QueryParams], tuple[list[Row], bool]],
+    ) -> tuple[list[Row], str | None, bool]:
+        """Return rows for ``params`` from the cache or by calling ``run``.
+
+        ``run`` executes the query for the parameters it is given and returns
+        the rows and whether they were truncated; truncated results are not
+        cached.  The last element of the result is that flag.
+        """
+        hit = self.get(params)
+        if hit is not None:
+            if hit[1] == "derived":
+                self.put(params, hit[0])
+            return hit[0], hit[1], False
+        split = self.extend(params)
+        if split is not None:
+            head, rest = split
+            tail, truncated = run(rest)
+            rows = head + tail
+            if params.limit is not None:
+                rows = rows[: params.limit]
+            if not truncated:
+                self.put(params, rows)
+            return rows, "extended", truncated
+        rows, truncated = run(params)
+        if not truncated:
+            self.put(params, rows)
+        return rows, None, truncated
@@ -0,0 +1,359 @@
+"""Named queries kept fresh by a background scheduler.
+
+A saved query holds an ``/api/query`` payload, a refresh interval and a TTL.
+The scheduler re-runs each query once its interval has elapsed and keeps the
+latest response, so opening a saved query is normally just a read of that
+response.  A response older than the TTL is recomputed when it is opened.
+
+Refreshes go through the result cache, so re-running a sliding time window
+(for instance from "-1 hour" to "now") only queries the buckets added since
+the previous run.
+
+Saved queries are recorded in a SQLite file owned by ScubaDuck (by default
+``saved_queries.sqlite`` in its config directory), keyed by the database they
+query, so that they are picked up again when it is reopened.  The user's
+database is never written to, and it may be read-only.  Processes serving the
+same database share the file and pick up each other's changes, including the
+latest response: each due refresh is claimed in the file first, so only one
+of them runs it and the others adopt its response.  Listeners
+added with :meth:`SavedQueries.subscribe` are called after every run, for
+instance to push the new response to open dashboards.
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from collections.abc import Generator
+from contextlib import closing, contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+
+SAVED_QUERIES_FILE = "saved_queries.sqlite"
+
+# Runs an ``/api/query`` payload and returns the response and status code.
+Runner = Callable[[dict[str, Any]], tuple[dict[str, Any], int]]
+
+Listener = Callable[["SavedQuery"], None]
+
+
+@dataclass
+class SavedQuery:
+    name: str
+    payload: dict[str, Any]
+    refresh_interval: float
+    ttl: float
+    result: dict[str, Any] | None = None
+    error: str | None = None
+    refreshed: float = 0.0
+    attempted: float = 0.0
+    runs: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def info(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "payload": self.payload,
+            "refresh_interval": self.refresh_interval,
+            "ttl": self.ttl,
+            "refreshed": self.refreshed,
+            "runs": self.runs,
+            "error": self.error,
+        }
+
+
+def _adopt(
+    query: SavedQuery,
+    attempted: float,
+    refreshed: float,
+    runs: int,
+    result: str | None,
+    error: str | None,
+) -> bool:
+    """Take over a run of ``query`` recorded by another process.
+
+    Returns whether its response changed.
+    """
+    with query.lock:
+        query.attempted = max(query.attempted, attempted)
+        if refreshed <= query.refreshed and runs <= query.runs:
+            return False
+        query.refreshed = refreshed
+        query.runs = runs
+        query.error = error
+        if result is not None:
+            query.result = json.loads(result)
+        return True
+
+
+class SavedQueries:
+    """Registry of saved queries and the scheduler that refreshes them.
+
+    ``path`` is the SQLite file the queries of ``database`` are recorded in;
+    with ``None`` they are only kept in memory.
+    """
+
+    def __init__(
+        self,
+        path: str | Path | None,
+        database: str,
+        run: Runner,
+        tick: float = 1.0,
+    ) -> None:
+        self.path = None if path is None else Path(path)
+        self.database = database
+        self.run = run
+        self.tick = tick
+        self._queries: dict[str, SavedQuery] = {}
+        self._lock = threading.Lock()
+        # Serializes reading and writing the file with updating the registry.
+        self._file_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._listeners: list[Listener] = []
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self._connect() as con:
+                con.execute(
+                    "CREATE TABLE IF NOT EXISTS saved_queries (database TEXT, "
+                    "name TEXT, payload TEXT, refresh_interval REAL, ttl REAL, "
+                    "PRIMARY KEY (database, name))"
+                )
+                con.execute(
+                    "CREATE TABLE IF NOT EXISTS saved_query_runs (database TEXT, "
+                    "name TEXT, attempted REAL, refreshed REAL, runs INTEGER, "
+                    "result TEXT, error TEXT, PRIMARY KEY (database, name))"
+                )
+        self._sync()
+
+    @contextmanager
+    def _connect(self) -> Generator[sqlite3.Connection]:
+        assert self.path is not None
+        with closing(sqlite3.connect(self.path, timeout=30)) as con:
+            with con:
+                yield con
+
+    def _sync(self) -> None:
+        """Pick up queries saved or deleted by other processes."""
+        if self.path is None:
+            return
+        adopted: list[SavedQuery] = []
+        with self._file_lock:
+            with self._connect() as con:
+                rows = con.execute(
+                    "SELECT name, payload, refresh_interval, ttl "
+                    "FROM saved_queries WHERE database = ?",
+                    [self.database],
+                ).fetchall()
+                runs = con.execute(
+                    "SELECT name, attempted, refreshed, runs, result, error "
+                    "FROM saved_query_runs WHERE database = ?",
+                    [self.database],
+                ).fetchall()
+            shared = {r[0]: r[1:] for r in runs}
+            with self._lock:
+                recorded: dict[str, SavedQuery] = {}
+                for name, payload, interval, ttl in rows:
+                    query = self._queries.get(name)
+                    settings = (json.loads(payload), interval, ttl)
+                    if query is None or (
+                        (query.payload, query.refresh_interval, query.ttl) != settings
+                    ):
+                        query = SavedQuery(name, *settings)
+                    recorded[name] = query
+                    if name in shared and _adopt(query, *shared[name]):
+                        adopted.append(query)
+                self._queries = recorded
+        for query in adopted:
+            self._notify(query)
+
+    def _claim(self, query: SavedQuery, now: float) -> bool:
+        """Return whether this process should run the due ``query``.
+
+        Other processes sharing the file skip it until the interval has
+        elapsed again and adopt the response instead (see ``_sync``).
+        """
+        if self.path is None:
+            return True
+        with self._connect() as con:
+            con.execute(
+                "INSERT OR IGNORE INTO saved_query_runs (database, name, attempted, "
+                "refreshed, runs) VALUES (?, ?, 0, 0, 0)",
+                [self.database, query.name],
+            )
+            # A single UPDATE, so only one process can move ``attempted`` on.
+            claimed = con.execute(
+                "UPDATE saved_query_runs SET attempted = ? "
+                "WHERE database = ? AND name = ? AND attempted <= ?",
+                [now, self.database, query.name, now - query.refresh_interval],
+            ).rowcount
+        return claimed == 1
+
+    def _record(self, query: SavedQuery, con: sqlite3.Connection | None = None) -> None:
+        """Share the latest run of ``query`` with other processes."""
+        if self.path is None:
+            return
+        if con is None:
+            with self._connect() as con:
+                self._record(query, con)
+            return
+        with query.lock:
+            values = [
+                query.attempted,
+                query.refreshed,
+                query.runs,
+                None if query.result is None else json.dumps(query.result),
+                query.error,
+            ]
+        con.execute(
+            "INSERT OR REPLACE INTO saved_query_runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [self.database, query.name, *values],
+        )
+
+    def status(self) -> list[dict[str, Any]]:
+        self._sync()
+        with self._lock:
+            queries = sorted(self._queries.values(), key=lambda q: q.name)
+        return [q.info() for q in queries]
+
+    def save(
+        self,
+        name: str,
+        payload: dict[str, Any],
+        refresh_interval: float,
+        ttl: float | None = None,
+    ) -> SavedQuery:
+        """Save ``payload`` as ``name`` after running it once.
+
+        ``ttl`` defaults to twice the refresh interval.  Raises ``ValueError``
+        when the settings are invalid or the query fails.
+        """
+        if not name:
+            raise ValueError("name required")
+        if refresh_interval <= 0:
+            raise ValueError("refresh_interval must be positive")
+        ttl = 2 * refresh_interval if ttl is None else ttl
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+        query = SavedQuery(name, payload, float(refresh_interval), float(ttl))
+        self._execute(query)
+        if query.error is not None:
+            raise ValueError(query.error)
+        with self._file_lock:
+            if self.path is not None:
+                with self._connect() as con:
+                    con.execute(
+                        "INSERT OR REPLACE INTO saved_queries VALUES (?, ?, ?, ?, ?)",
+                        [
+                            self.database,
+                            name,
+                            json.dumps(payload),
+                            query.refresh_interval,
+                            query.ttl,
+                        ],
+                    )
+                    # In the same transaction, so that no other process pairs
+                    # the new settings with the previous response.
+                    self._record(query, con)
+            with self._lock:
+                self._queries[name] = query
+        # Only once it can be loaded, so listeners see the new query.
+        self._notify(query)
+        return query
+
+    def delete(self, name: str) -> None:
+        self._sync()
+        with self._file_lock:
+            with self._lock:
+                if name not in self._queries:
+                    raise KeyError(name)
+                del self._queries[name]
+            if self.path is not None:
+                with self._connect() as con:
+                    for table in ("saved_queries", "saved_query_runs"):
+                        con.execute(
+                            f"DELETE FROM {table} WHERE database = ? AND name = ?",
+                            [self.database, name],
+                        )
+
+    def load(self, name: str) -> SavedQuery:
+        """Return ``name`` with a result no older than its TTL."""
+        self._sync()
+        with self._lock:
+            query = self._queries.get(name)
+        if query is None:
+            raise KeyError(name)
+        if query.result is None or time.time() - query.refreshed > query.ttl:
+            self.refresh(query)
+        return query
+
+    def subscribe(self, listener: Listener) -> None:
+        """Call ``listener`` with each saved query after it was run."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Listener) -> None:
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def refresh(self, query: SavedQuery) -> None:
+        """Run ``query`` and keep its response.
+
+        A failed run is recorded in ``error`` and the previous response, if
+        any, is kept.
+        """
+        self._execute(query)
+        self._record(query)
+        self._notify(query)
+
+    def _execute(self, query: SavedQuery) -> None:
+        with query.lock:
+            try:
+                result, status = self.run(query.payload)
+            except Exception as exc:
+                result, status = {"error": str(exc)}, 500
+            query.runs += 1
+            query.attempted = time.time()
+            if status == 200:
+                query.result = result
+                query.error = None
+                query.refreshed = time.time()
+            else:
+                query.error = str(result.get("error", f"status {status}"))
+
+    def _notify(self, query: SavedQuery) -> None:
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(query)
+
+    def refresh_due(self) -> list[str]:
+        """Refresh every query whose refresh interval has elapsed."""
+        self._sync()
+        now = time.time()
+        with self._lock:
+            due = [
+                q
+                for q in self._queries.values()
+                if now - q.attempted >= q.refresh_interval
+            ]
+        due = [q for q in due if self._claim(q, now)]
+        for query in due:
+            self.refresh(query)
+        return [q.name for q in due]
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.tick):
+            self.refresh_due()
@@ -1,58 +1,181 @@
 from __future__ import annotations
 
-from dataclasses import dataclass, field, replace
-from typing import Any, Dict, List, Tuple, cast
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from functools import partial
+from typing import Any, Callable, Dict, Generator, Iterator, List, Tuple, cast
 
 import re
 from datetime import datetime, timedelta, timezone
 
+import atexit
+import threading
 import time
 from pathlib import Path
 import os
+import shutil
+import sqlite3
+import tempfile
 import traceback
 import math
+import base64
+import hashlib
+import json
 
 import duckdb
 from dateutil import parser as dtparser
 from dateutil.relativedelta import relativedelta
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory
+
+from .estimate import CostEstimator
+from .indexes import IndexAdvisor
+from .json_paths import JsonPaths
+from .materialize import (
+    SOURCE_ROWID_COLUMN,
+    MaterializedColumns,
+    StoredValues,
+    is_hidden,
+)
+from .query_ir import Filter, QueryParams, canonicalize
+from .admission import (
+    CLIENT_COOKIE,
+    CLIENT_HEADER,
+    PRIORITIES,
+    AdmissionController,
+    Overloaded,
+)
+from .disk_cache import DiskCache
+from .execution import (
+    QueryPool,
+    ValueTables,
+    create_value_tables,
+    fetch_rows,
+)
+from .resources import PRIORITY_HEADER, ResourceGovernor
+from .result_cache import ResultCache
+from .saved_queries import SAVED_QUERIES_FILE, SavedQueries
+from .sql import UNIT_SCALE, epoch_unit, literal, quote
+from .warmup import Warmup
 
 
-def _quote(ident: str) -> str:
-    """Return identifier quoted for SQL."""
-    return f'"{ident.replace('"', '""')}"'
+# ``=``/``!=`` filters with more values than this are compiled to a semi-join
+# against a temporary table instead of an inline IN list.
+IN_LIST_TABLE_THRESHOLD = 1000
 
+# Trailing sort key and row id columns of keyset paginated samples queries.
+KEYSET_COLUMN = "__scubaduck_key"
+ROW_ID_COLUMN = "__scubaduck_rowid"
 
-@dataclass
-class Filter:
-    column: str
-    op: str
-    value: str | int | float | list[str] | None
+
+def _encode_cursor(value: Any, rowid: int) -> str:
+    """Return an opaque cursor for the samples row at ``(value, rowid)``."""
+    if value is not None and not isinstance(value, (str, int, float)):
+        value = str(value)
+    raw = json.dumps([value, rowid]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[str | int | float | None, int]:
+    try:
+        value, rowid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as exc:
+        raise ValueError("Invalid cursor") from exc
+    if not isinstance(rowid, int) or isinstance(value, (list, dict)):
+        raise ValueError("Invalid cursor")
+    return value, rowid
+
+
+class _BadRequest(Exception):
+    """Raised for an invalid query payload; the message goes to the client."""
 
 
 @dataclass
-class QueryParams:
-    start: str | None = None
-    end: str | None = None
-    order_by: str | None = None
-    order_dir: str = "ASC"
-    limit: int | None = None
-    columns: list[str] = field(default_factory=lambda: [])
-    filters: list[Filter] = field(default_factory=lambda: [])
-    derived_columns: dict[str, str] = field(default_factory=lambda: {})
-    graph_type: str = "samples"
-    group_by: list[str] = field(default_factory=lambda: [])
-    aggregate: str | None = None
-    show_hits: bool = False
-    x_axis: str | None = None
-    granularity: str = "Auto"
-    fill: str = "0"
-    table: str = "events"
-    time_column: str | None = "timestamp"
-    time_unit: str = "s"
-
-
-def _load_database(path: Path) -> duckdb.DuckDBPyConnection:
+class _PreparedQuery:
+    params: QueryParams
+    base_types: Dict[str, str]
+    column_types: Dict[str, str]
+    relative_end: bool
+    series_limit: int | None
+    bucket_size: int | None
+    requested_bucket_size: int | None
+
+
+def _value_table_name(values: list[str]) -> str:
+    digest = hashlib.sha1(json.dumps(values).encode()).hexdigest()[:16]
+    return f"_scubaduck_values_{digest}"
+
+
+def _value_tables(
+    params: QueryParams, column_types: Dict[str, str] | None
+) -> ValueTables:
+    """Return the temporary tables ``build_query`` expects for ``params``.
+
+    Maps table name to the SQL type of the filtered column and its values.
+    """
+    tables: ValueTables = {}
+    for f in params.filters:
+        if f.op not in {"=", "!="} or not isinstance(f.value, list):
+            continue
+        if len(f.value) <= IN_LIST_TABLE_THRESHOLD:
+            continue
+        ctype = (column_types or {}).get(f.column, "VARCHAR")
+        tables[_value_table_name(f.value)] = (ctype, f.value)
+    return tables
+
+
+@contextmanager
+def _query_cursor(
+    con: duckdb.DuckDBPyConnection,
+    params: QueryParams,
+    column_types: Dict[str, str] | None,
+) -> Generator[duckdb.DuckDBPyConnection]:
+    """Yield a connection with the value tables ``params`` needs registered."""
+    tables = _value_tables(params, column_types)
+    if not tables:
+        yield con
+        return
+    # Temporary tables are private to a connection, so concurrent queries
+    # with the same values don't interfere.
+    cur = con.cursor()
+    try:
+        create_value_tables(cur, tables)
+        yield cur
+    finally:
+        cur.close()
+
+
+def _execute(
+    con: duckdb.DuckDBPyConnection,
+    params: QueryParams,
+    sql: str,
+    column_types: Dict[str, str] | None,
+    max_rows: int | None = None,
+    max_bytes: int | None = None,
+) -> Tuple[List[Tuple[Any, ...]], bool]:
+    """Run ``sql`` registering any value tables it needs for the duration.
+
+    Rows are fetched in chunks and fetching stops once ``max_rows`` rows or
+    about ``max_bytes`` bytes have been read.  Returns the rows and whether
+    they were truncated.
+    """
+    with _query_cursor(con, params, column_types) as cur:
+        return fetch_rows(cur.execute(sql), max_rows, max_bytes)
+
+
+# Export format -> (file extension, mimetype, COPY options).
+EXPORT_FORMATS: Dict[str, Tuple[str, str, str]] = {
+    "csv": ("csv", "text/csv", "FORMAT CSV, HEADER"),
+    "parquet": ("parquet", "application/vnd.apache.parquet", "FORMAT PARQUET"),
+    "ndjson": ("ndjson", "application/x-ndjson", "FORMAT JSON"),
+}
+EXPORT_CHUNK_SIZE = 1 << 20
+
+
+# Sources that are loaded into memory rather than opened in place.
+_LOADED_SUFFIXES = {".csv", ".parquet", ".parq", ".db", ".sqlite"}
+
+
+def _load_database(path: Path, read_only: bool = False) -> duckdb.DuckDBPyConnection:
     if not path.exists():
         raise FileNotFoundError(path)
 
@@ -80,10 +203,100 @@ def _load_database(path: Path) -> duckdb.DuckDBPyConnection:
         for t in tables:
             con.execute(f'CREATE VIEW "{t}" AS SELECT * FROM db."{t}"')
     else:
-        con = duckdb.connect(path)
+        con = duckdb.connect(path, read_only=read_only)
     return con
 
 
+def create_snapshot(db_file: str | Path, path: str | Path) -> Path:
+    """Copy the tables of ``db_file`` into the DuckDB database ``path``.
+
+    CSV, Parquet and SQLite sources are loaded once into the snapshot, which
+    several server processes can then open read-only instead of each
+    loading its own copy into memory.  ``db_file`` may be ``"TEST"``.  The
+    snapshot is written next to ``path`` and renamed into place.
+    """
+    path = Path(path)
+    if isinstance(db_file, str) and db_file.upper() == "TEST":
+        con = _create_test_database()
+    else:
+        con = _load_database(Path(db_file).resolve())
+    tmp = path.with_name(f".{path.name}.{os.getpid()}")
+    tmp.unlink(missing_ok=True)
+    try:
+        con.execute(f"ATTACH {literal(str(tmp))} AS snapshot")
+        for (table,) in con.execute(
+            "SELECT table_name FROM duckdb_tables() WHERE database_name = "
+            "current_database() UNION ALL SELECT view_name FROM duckdb_views() "
+            "WHERE database_name = current_database() AND NOT internal"
+        ).fetchall():
+            con.execute(
+                f"CREATE TABLE snapshot.{quote(table)} AS SELECT * FROM {quote(table)}"
+            )
+        con.execute("DETACH snapshot")
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    finally:
+        con.close()
+    os.replace(tmp, path)
+    return path
+
+
+def prepare_snapshot(db_file: str | None, path: str | Path | None = None) -> Path:
+    """Return a DuckDB database with the data of ``db_file`` to open read-only.
+
+    A DuckDB database is used as is unless ``path`` is given.  Other sources
+    are copied into ``path`` (by default a file in the temp directory named
+    after the source), which is rebuilt when the source is newer.
+    """
+    if db_file is None:
+        db_file = os.environ.get("SCUBADUCK_DB") or str(
+            Path(__file__).with_name("sample.csv")
+        )
+    test = db_file.upper() == "TEST"
+    source = None if test else Path(db_file).resolve()
+    if path is None:
+        if source is not None and source.suffix.lower() not in _LOADED_SUFFIXES:
+            return source
+        name = hashlib.sha1(str(source or "TEST").encode()).hexdigest()[:16]
+        path = Path(tempfile.gettempdir()) / f"scubaduck-{name}.duckdb"
+    path = Path(path)
+    if (
+        not path.exists()
+        or source is None
+        or source.stat().st_mtime_ns > path.stat().st_mtime_ns
+    ):
+        create_snapshot(db_file, path)
+    return path
+
+
+class _ThreadLocalConnection:
+    """Give each thread its own cursor on a shared DuckDB database.
+
+    A DuckDB connection must not be used by several threads at once, while
+    cursors are cheap extra connections to the same database.
+    """
+
+    def __init__(self, con: duckdb.DuckDBPyConnection) -> None:
+        self._con = con
+        self._local = threading.local()
+
+    def _thread_cursor(self) -> duckdb.DuckDBPyConnection:
+        cur = getattr(self._local, "cursor", None)
+        if cur is None:
+            cur = self._con.cursor()
+            self._local.cursor = cur
+        return cur
+
+    def execute(self, query: str, parameters: Any = None) -> Any:
+        if parameters is None:
+            return self._thread_cursor().execute(query)
+        return self._thread_cursor().execute(query, parameters)
+
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        return self._con.cursor()
+
+
 def _create_test_database() -> duckdb.DuckDBPyConnection:
     """Return a DuckDB connection with a small multi-table dataset."""
     con = duckdb.connect()
@@ -104,20 +317,24 @@ _REL_RE = re.compile(
 )
 
 
-def parse_time(val: str | None) -> str | None:
-    """Parse an absolute or relative time string into ``YYYY-MM-DD HH:MM:SS``."""
+def parse_time(val: str | None, now: datetime | None = None) -> str | None:
+    """Parse an absolute or relative time string into ``YYYY-MM-DD HH:MM:SS``.
+
+    Relative times are resolved against ``now`` (UTC), by default the
+    current time.
+    """
     if val is None or val == "":
         return None
     s = val.strip()
+    if now is None:
+        now = datetime.now(timezone.utc)
     if s.lower() == "now":
-        dt = datetime.now(timezone.utc)
-        return dt.replace(microsecond=0).strftime("%Y-%m-%d %H:%M:%S")
+        return now.replace(microsecond=0).strftime("%Y-%m-%d %H:%M:%S")
 
     m = _REL_RE.fullmatch(s)
     if m:
         qty = float(m.group(1))
         unit = m.group(2).lower()
-        now = datetime.now(timezone.utc)
         dt: datetime
         if unit.startswith("hour"):
             dt = now + timedelta(hours=qty)
@@ -145,6 +362,22 @@ def parse_time(val: str | None) -> str | None:
     return dt.replace(microsecond=0, tzinfo=None).strftime("%Y-%m-%d %H:%M:%S")
 
 
+def _is_relative_time(val: str | None) -> bool:
+    """Return whether ``val`` is resolved relative to the current time."""
+    if not val:
+        return False
+    s = val.strip()
+    return s.lower() == "now" or _REL_RE.fullmatch(s) is not None
+
+
+def _align_time(val: str, seconds: int) -> str:
+    """Round ``val`` down to an absolute multiple of ``seconds`` since the epoch."""
+    dt = dtparser.parse(val).replace(tzinfo=timezone.utc)
+    ts = int(dt.timestamp())
+    aligned = datetime.fromtimestamp(ts - ts % seconds, tz=timezone.utc)
+    return aligned.strftime("%Y-%m-%d %H:%M:%S")
+
+
 def _numeric_to_datetime(value: int | float, unit: str) -> datetime:
     """Convert a numeric timestamp ``value`` with unit ``unit`` to ``datetime``.
 
@@ -184,106 +417,163 @@ def _suggest_time_unit(value: int | float, given: str) -> str | None:
     return None
 
 
-def _granularity_seconds(granularity: str, start: str | None, end: str | None) -> int:
+_GRANULARITIES = {
+    "1 second": 1,
+    "5 seconds": 5,
+    "10 seconds": 10,
+    "30 seconds": 30,
+    "1 minute": 60,
+    "4 minutes": 240,
+    "5 minutes": 300,
+    "10 minutes": 600,
+    "15 minutes": 900,
+    "30 minutes": 1800,
+    "1 hour": 3600,
+    "3 hours": 10800,
+    "6 hours": 21600,
+    "1 day": 86400,
+    "1 week": 604800,
+    "30 days": 2592000,
+}
+
+_NICE_BUCKETS = sorted(_GRANULARITIES.values())
+
+
+def _nice_bucket(raw: float, round_up: bool = True) -> int:
+    """Snap ``raw`` seconds to one of the selectable granularities.
+
+    Sizes beyond the largest granularity become multiples of it.
+    """
+    largest = _NICE_BUCKETS[-1]
+    if raw > largest:
+        mult = math.ceil(raw / largest) if round_up else int(raw // largest)
+        return max(mult, 1) * largest
+    if round_up:
+        return next(b for b in _NICE_BUCKETS if b >= raw)
+    return max((b for b in _NICE_BUCKETS if b <= raw), default=_NICE_BUCKETS[0])
+
+
+def _span_seconds(start: str | None, end: str | None) -> float | None:
+    if not start or not end:
+        return None
+    try:
+        s = dtparser.parse(start)
+        e = dtparser.parse(end)
+    except Exception:
+        return None
+    return max((e - s).total_seconds(), 1)
+
+
+def _granularity_seconds(
+    granularity: str,
+    start: str | None,
+    end: str | None,
+    chart_width: int | None = None,
+) -> int:
+    """Return the bucket size in seconds for ``granularity``.
+
+    "Auto" aims for at most one bucket per pixel of ``chart_width`` and "Fine"
+    for at least one.  Without a width they target 100 and 500 buckets.
+    """
     gran = granularity.lower()
-    mapping = {
-        "1 second": 1,
-        "5 seconds": 5,
-        "10 seconds": 10,
-        "30 seconds": 30,
-        "1 minute": 60,
-        "4 minutes": 240,
-        "5 minutes": 300,
-        "10 minutes": 600,
-        "15 minutes": 900,
-        "30 minutes": 1800,
-        "1 hour": 3600,
-        "3 hours": 10800,
-        "6 hours": 21600,
-        "1 day": 86400,
-        "1 week": 604800,
-        "30 days": 2592000,
-    }
-    if gran in mapping:
-        return mapping[gran]
-    if gran in {"auto", "fine"} and start and end:
-        try:
-            s = dtparser.parse(start)
-            e = dtparser.parse(end)
-        except Exception:
+    if gran in _GRANULARITIES:
+        return _GRANULARITIES[gran]
+    if gran in {"auto", "fine"}:
+        total = _span_seconds(start, end)
+        if total is None:
             return 3600
-        total = max((e - s).total_seconds(), 1)
+        if chart_width:
+            return _nice_bucket(total / chart_width, round_up=gran == "auto")
         buckets = 100 if gran == "auto" else 500
-        return max(int(total // buckets), 1)
+        return _nice_bucket(total / buckets)
     return 3600
 
 
-def _time_expr(col: str, column_types: Dict[str, str] | None, unit: str) -> str:
-    """Return SQL expression for column interpreted as timestamp."""
-    qcol = _quote(col)
-    if column_types is None:
-        return qcol
-    ctype = column_types.get(col, "").upper()
-    if not any(t in ctype for t in ["TIMESTAMP", "DATE", "TIME"]):
-        if any(
-            t in ctype
-            for t in [
-                "INT",
-                "DECIMAL",
-                "REAL",
-                "DOUBLE",
-                "FLOAT",
-                "NUMERIC",
-                "HUGEINT",
-            ]
-        ):
-            if unit == "ns":
-                # Use nanosecond helper unless column cannot represent such large values
-                if "INT" in ctype and "BIGINT" not in ctype and "HUGEINT" not in ctype:
-                    unit = "s"
-                else:
-                    expr = f"CAST({qcol} AS BIGINT)"
-                    return f"make_timestamp_ns({expr})"
+def _cap_bucket_size(
+    bucket_size: int, start: str | None, end: str | None, max_buckets: int
+) -> int:
+    """Coarsen ``bucket_size`` so the range has at most ``max_buckets`` buckets."""
+    total = _span_seconds(start, end)
+    if total is None or total / bucket_size <= max_buckets:
+        return bucket_size
+    return max(_nice_bucket(total / max_buckets), bucket_size)
 
-            if (
-                unit != "s"
-                and "INT" in ctype
-                and "BIGINT" not in ctype
-                and "HUGEINT" not in ctype
-            ):
-                # 32-bit integers cannot store sub-second precision for modern dates
-                unit = "s"
 
-            multiplier = {
-                "s": 1_000_000,
-                "ms": 1_000,
-                "us": 1,
-            }.get(unit, 1_000_000)
-            base = f"CAST({qcol} AS BIGINT)"
-            expr = f"CAST({base} * {multiplier} AS BIGINT)" if multiplier != 1 else base
-            return f"make_timestamp({expr})"
-    return qcol
+def _is_string_type(ctype: str) -> bool:
+    ctype = ctype.upper()
+    return "CHAR" in ctype or "STRING" in ctype or "TEXT" in ctype
+
 
+def _is_time_type(ctype: str) -> bool:
+    ctype = ctype.upper()
+    return "TIMESTAMP" in ctype or "DATE" in ctype
 
-def build_query(params: QueryParams, column_types: Dict[str, str] | None = None) -> str:
+
+def _time_bound(
+    col: str, column_types: Dict[str, str] | None, unit: str, value: str
+) -> str:
+    """Return a SQL literal comparable against the bare time column ``col``.
+
+    For numeric epoch columns ``value`` is converted into the column's unit so
+    that the predicate is on the raw column and DuckDB can use min/max zone
+    maps to skip row groups.  Other columns compare against the string.
+    """
+    eunit = epoch_unit(col, column_types, unit)
+    if eunit is None:
+        return f"'{value}'"
+    dt = dtparser.parse(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt - datetime(1970, 1, 1, tzinfo=timezone.utc)
+    micros = (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+    scale = UNIT_SCALE[eunit]
+    return str(micros * scale // 1_000_000)
+
+
+def build_query(
+    params: QueryParams,
+    column_types: Dict[str, str] | None = None,
+    stored: StoredValues | None = None,
+) -> str:
+    """Return the SQL for ``params``.
+
+    ``stored`` describes the derived expressions that have been materialized
+    for the table and the sidecar table holding their values.
+    """
     select_parts: list[str] = []
     group_cols = params.group_by[:]
+    bucket_to_ts: str | None = None
     selected_for_order = set(params.columns) | set(params.derived_columns.keys())
     if params.graph_type == "timeseries":
-        sec = _granularity_seconds(params.granularity, params.start, params.end)
+        sec = params.bucket_size or _granularity_seconds(
+            params.granularity, params.start, params.end, params.chart_width
+        )
         x_axis = params.x_axis or params.time_column
         if x_axis is None:
             raise ValueError("x_axis required for timeseries")
-        xexpr = _time_expr(x_axis, column_types, params.time_unit)
-        if params.start:
+        # Buckets are aligned to absolute multiples of their size so that
+        # overlapping ranges share buckets.
+        origin = "1970-01-01 00:00:00"
+        eunit = epoch_unit(x_axis, column_types, params.time_unit)
+        if eunit is not None:
+            # Bucket numeric epoch columns with integer arithmetic on the raw
+            # column; ids are only turned into timestamps after aggregation.
+            width = sec * UNIT_SCALE[eunit]
+            offset = _time_bound(x_axis, column_types, params.time_unit, origin)
+            delta = f"(CAST({quote(x_axis)} AS BIGINT) - {offset})"
             bucket_expr = (
-                f"TIMESTAMP '{params.start}' + INTERVAL '{sec} second' * "
-                f"CAST(floor((epoch({xexpr}) - epoch(TIMESTAMP '{params.start}'))/{sec}) AS BIGINT)"
+                f"({delta} // {width} - CAST({delta} % {width} < 0 AS BIGINT))"
             )
+            bucket_to_ts = f"TIMESTAMP '{origin}' + INTERVAL '{sec} second' * bucket"
         else:
+            ctype = column_types.get(x_axis, "").upper() if column_types else ""
+            xexpr = quote(x_axis)
+            if "WITH TIME ZONE" in ctype or "TIMESTAMPTZ" in ctype:
+                xexpr = f"make_timestamp(epoch_us({xexpr}))"
+            elif column_types is not None and not ctype.startswith("TIMESTAMP"):
+                xexpr = f"CAST({xexpr} AS TIMESTAMP)"
             bucket_expr = (
-                f"TIMESTAMP 'epoch' + INTERVAL '{sec} second' * "
-                f"CAST(floor(epoch({xexpr})/{sec}) AS BIGINT)"
+                f"time_bucket(INTERVAL '{sec} second', {xexpr}, TIMESTAMP '{origin}')"
             )
         select_parts.append(f"{bucket_expr} AS bucket")
         group_cols = ["bucket"] + group_cols
@@ -293,42 +583,66 @@ def build_query(params: QueryParams, column_types: Dict[str, str] | None = None)
         select_cols = (
             group_cols[1:] if params.graph_type == "timeseries" else group_cols
         )
-        select_parts.extend(_quote(c) for c in select_cols)
+        select_parts.extend(quote(c) for c in select_cols)
         agg = (params.aggregate or "count").lower()
         selected_for_order.update(group_cols)
+        # Counts and sums over a sample are scaled up to the whole table.
+        factor = None
+        if params.sample_percent:
+            factor = f"CAST({100 / params.sample_percent!r} AS DOUBLE)"
+
+        def scaled(expr: str, integral: bool = True) -> str:
+            if factor is None:
+                return expr
+            if integral:
+                return f"CAST(round({expr} * {factor}) AS BIGINT)"
+            return f"{expr} * {factor}"
 
         def agg_expr(col: str) -> str:
-            expr = _quote(col)
+            expr = quote(col)
             ctype = column_types.get(col, "").upper() if column_types else ""
             if "BOOL" in ctype:
-                expr = f"CAST({_quote(col)} AS BIGINT)"
+                expr = f"CAST({quote(col)} AS BIGINT)"
             if agg.startswith("p"):
                 quant = float(agg[1:]) / 100
                 return f"quantile({expr}, {quant})"
             if agg == "count distinct":
                 return f"count(DISTINCT {expr})"
+            if agg == "count":
+                return scaled(f"count({expr})")
+            if agg == "sum":
+                return scaled(f"sum({expr})", integral=False)
             if agg == "avg" and column_types is not None:
                 if "TIMESTAMP" in ctype or "DATE" in ctype or "TIME" in ctype:
                     return (
                         "TIMESTAMP 'epoch' + INTERVAL '1 second' * "
-                        f"CAST(avg(epoch({_quote(col)})) AS BIGINT)"
+                        f"CAST(avg(epoch({quote(col)})) AS BIGINT)"
                     )
             return f"{agg}({expr})"
 
         if agg == "count":
             if params.graph_type != "table":
-                select_parts.append("count(*) AS Count")
+                select_parts.append(f"{scaled('count(*)')} AS Count")
                 selected_for_order.add("Count")
+            # Derived columns are always shown, as the count of their
+            # non-NULL values.
+            agg_cols = list(params.derived_columns)
         else:
-            for col in params.columns:
-                if col in group_cols:
-                    continue
-                select_parts.append(f"{agg_expr(col)} AS {_quote(col)}")
-                selected_for_order.add(col)
-        select_parts.insert(len(group_cols), "count(*) AS Hits")
+            agg_cols = params.columns + [
+                c for c in params.derived_columns if c not in params.columns
+            ]
+        for col in agg_cols:
+            if col in group_cols:
+                continue
+            select_parts.append(f"{agg_expr(col)} AS {quote(col)}")
+            selected_for_order.add(col)
+        select_parts.insert(len(group_cols), f"{scaled('count(*)')} AS Hits")
         selected_for_order.add("Hits")
     else:
-        select_parts.extend(_quote(c) for c in params.columns)
+        select_parts.extend(quote(c) for c in params.columns)
+        select_parts.extend(
+            quote(c) for c in params.derived_columns if c not in params.columns
+        )
         selected_for_order.update(params.columns)
 
     order_by = params.order_by
@@ -336,46 +650,83 @@ def build_query(params: QueryParams, column_types: Dict[str, str] | None = None)
         order_by = "Hits"
     order_by = order_by if order_by in selected_for_order else None
 
-    if has_agg and params.derived_columns:
-        inner_params = replace(
-            params,
-            derived_columns={},
-            order_by=None,
-            limit=None,
+    projected = {**params.json_columns, **params.derived_columns}
+    saved = stored.columns if stored is not None else {}
+    joined = {e.strip() for e in projected.values()} & saved.keys()
+    keyset = params.keyset and not has_agg
+    hidden = [quote(c) for c in params.json_columns if c not in params.derived_columns]
+    if keyset:
+        if not select_parts:
+            # Without chosen columns pages carry every visible column, as
+            # unpaginated samples do.
+            select_parts.append(
+                f"* EXCLUDE ({', '.join(hidden + [quote(ROW_ID_COLUMN)])})"
+            )
+        # Paginated samples only carry the requested columns; the full row
+        # can be fetched by its id.  The sort key and row id trail the
+        # columns so that the next page can start right after this one.
+        key = quote(order_by) if order_by else "NULL"
+        select_parts += [f"{key} AS {quote(KEYSET_COLUMN)}", quote(ROW_ID_COLUMN)]
+    if select_parts:
+        select_clause = ", ".join(select_parts)
+    elif hidden:
+        select_clause = f"* EXCLUDE ({', '.join(hidden)})"
+    else:
+        select_clause = "*"
+    lines = [f"SELECT {select_clause}"]
+    source = f'"{params.table}"'
+    if joined:
+        source += " AS t"
+    if params.sample_percent is not None:
+        # A fixed seed keeps sampled results stable, and therefore cacheable.
+        source += f" TABLESAMPLE {params.sample_percent}% (bernoulli, 42)"
+    if joined:
+        # Saved expressions read their stored values.  ``stored`` is only
+        # handed out while the sidecar is current, so rows are matched by id.
+        assert stored is not None
+        source += (
+            f" LEFT JOIN {stored.sidecar} AS s ON s.{SOURCE_ROWID_COLUMN} = t.rowid"
         )
-        inner_sql = build_query(inner_params, column_types)
-        outer_select = ["t.*"] + [
-            f"{expr} AS {name}" for name, expr in params.derived_columns.items()
-        ]
-        indented_inner = "\n".join("    " + line for line in inner_sql.splitlines())
+
+    def project(expr: str) -> str:
+        if expr.strip() not in joined:
+            return expr
+        column = quote(saved[expr.strip()])
+        return (
+            f"CASE WHEN s.{SOURCE_ROWID_COLUMN} IS NULL THEN {expr} ELSE s.{column} END"
+        )
+
+    projections = [
+        f"{project(expr)} AS {quote(name)}" for name, expr in projected.items()
+    ]
+    if keyset:
+        rowid = "t.rowid" if joined else "rowid"
+        projections.append(f"{rowid} AS {quote(ROW_ID_COLUMN)}")
+    if projections:
+        # Derived columns are computed once per row in a projection below
+        # the filters and aggregation, so they behave like real columns.
         lines = [
-            f"SELECT {', '.join(outer_select)}",
-            "FROM (",
-            indented_inner,
-            ") t",
+            "WITH base AS (",
+            f"    SELECT {'t.*' if joined else '*'}, {', '.join(projections)}",
+            f"    FROM {source}",
+            ")",
+            *lines,
+            "FROM base",
         ]
-        if order_by:
-            lines.append(f"ORDER BY {_quote(order_by)} {params.order_dir}")
-        elif params.graph_type == "timeseries":
-            lines.append("ORDER BY bucket")
-        if params.limit is not None:
-            lines.append(f"LIMIT {params.limit}")
-        return "\n".join(lines)
-
-    for name, expr in params.derived_columns.items():
-        select_parts.append(f"{expr} AS {name}")
-        selected_for_order.add(name)
-    select_clause = ", ".join(select_parts) if select_parts else "*"
-    lines = [f"SELECT {select_clause}", f'FROM "{params.table}"']
+    else:
+        lines.append(f"FROM {source}")
     where_parts: list[str] = []
     if params.time_column:
-        time_expr = _time_expr(params.time_column, column_types, params.time_unit)
-    else:
-        time_expr = None
-    if time_expr and params.start:
-        where_parts.append(f"{time_expr} >= '{params.start}'")
-    if time_expr and params.end:
-        where_parts.append(f"{time_expr} <= '{params.end}'")
+        tcol = params.time_column
+        qtcol = quote(tcol)
+        unit = params.time_unit
+        if params.start:
+            bound = _time_bound(tcol, column_types, unit, params.start)
+            where_parts.append(f"{qtcol} >= {bound}")
+        if params.end:
+            bound = _time_bound(tcol, column_types, unit, params.end)
+            end_op = "<" if params.end_exclusive else "<="
+            where_parts.append(f"{qtcol} {end_op} {bound}")
     for f in params.filters:
         op = f.op
         if op in {"empty", "!empty"}:
@@ -386,14 +737,19 @@ def build_query(params: QueryParams, column_types: Dict[str, str] | None = None)
             if isinstance(f.value, list):
                 if not f.value:
                     continue
-                if op == "=":
-                    qcol = _quote(f.column)
-                    vals = " OR ".join(f"{qcol} = '{v}'" for v in f.value)
-                    where_parts.append(f"({vals})")
+                if op in {"=", "!="}:
+                    qcol = quote(f.column)
+                    neg = "NOT " if op == "!=" else ""
+                    if len(f.value) > IN_LIST_TABLE_THRESHOLD:
+                        table = quote(_value_table_name(f.value))
+                        source = f"SELECT value FROM {table}"
+                    else:
+                        source = ", ".join(literal(v) for v in f.value)
+                    where_parts.append(f"{qcol} {neg}IN ({source})")
                     continue
-            val = f"'{f.value}'" if isinstance(f.value, str) else str(f.value)
+            val = literal(str(f.value) if isinstance(f.value, list) else f.value)
 
-        qcol = _quote(f.column)
+        qcol = quote(f.column)
         if op == "contains":
             where_parts.append(f"{qcol} ILIKE '%' || {val} || '%'")
         elif op == "!contains":
@@ -404,12 +760,46 @@ def build_query(params: QueryParams, column_types: Dict[str, str] | None = None)
             where_parts.append(f"{qcol} != {val}")
         else:
             where_parts.append(f"{qcol} {op} {val}")
+    if keyset and params.after_rowid is not None:
+        rid = quote(ROW_ID_COLUMN)
+        after = f"{rid} > {params.after_rowid}"
+        if order_by and params.after_value is not None:
+            qcol = quote(order_by)
+            val = literal(params.after_value)
+            cmp = "<" if params.order_dir.upper() == "DESC" else ">"
+            # NULLs sort last in both directions.
+            where_parts.append(
+                f"({qcol} {cmp} {val} OR ({qcol} = {val} AND {after})"
+                f" OR {qcol} IS NULL)"
+            )
+        elif order_by:
+            where_parts.append(f"({quote(order_by)} IS NULL AND {after})")
+        else:
+            where_parts.append(after)
     if where_parts:
         lines.append("WHERE " + " AND ".join(where_parts))
     if group_cols:
-        lines.append("GROUP BY " + ", ".join(_quote(c) for c in group_cols))
-    if order_by:
-        lines.append(f"ORDER BY {_quote(order_by)} {params.order_dir}")
+        lines.append("GROUP BY " + ", ".join(quote(c) for c in group_cols))
+    if bucket_to_ts is not None:
+        indented_inner = "\n".join("    " + line for line in lines)
+        lines = [
+            f"SELECT * REPLACE ({bucket_to_ts} AS bucket)",
+            "FROM (",
+            indented_inner,
+            ") t",
+        ]
+    if keyset:
+        key = f"{quote(order_by)} {params.order_dir}, " if order_by else ""
+        lines.append(f"ORDER BY {key}{quote(ROW_ID_COLUMN)}")
+    elif has_agg and (order_by or group_cols):
+        # Aggregates are sorted by every group column after ``order_by`` so
+        # that rows derived from cached results come out in the same order
+        # (see ``result_cache.sort_columns``).
+        keys = [f"{quote(order_by)} {params.order_dir}"] if order_by else []
+        keys += [quote(c) for c in group_cols if c != order_by]
+        lines.append("ORDER BY " + ", ".join(keys))
+    elif order_by:
+        lines.append(f"ORDER BY {quote(order_by)} {params.order_dir}")
     elif params.graph_type == "timeseries":
         lines.append("ORDER BY bucket")
     if params.limit is not None:
@@ -417,21 +807,180 @@ def build_query(params: QueryParams, column_types: Dict[str, str] | None = None)
     return "\n".join(lines)
 
 
-def create_app(db_file: str | Path | None = None) -> Flask:
+def _env_int(name: str) -> int | None:
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def _default_config_dir() -> Path:
+    base = os.environ.get("XDG_CONFIG_HOME") or Path.home() / ".config"
+    return Path(base) / "scubaduck"
+
+
+def create_app(
+    db_file: str | Path | None = None,
+    landing_queries: List[Dict[str, Any]] | None = None,
+    cache_dir: str | Path | None = None,
+    config: Dict[str, Any] | None = None,
+) -> Flask:
+    """Create the ScubaDuck app for ``db_file``.
+
+    ``landing_queries`` are ``/api/query`` payloads that are run during the
+    background warmup so that their results are cached before users ask.
+    Query results are also kept as Parquet files in ``cache_dir`` when one
+    is given, so they survive restarts and can be shared between processes.  ``config`` overrides
+    ``SCUBADUCK_*`` settings before anything is loaded; most of them default
+    to the environment variable of the same name.
+    """
     app = Flask(__name__, static_folder="static")
+    app.config["SCUBADUCK_MAX_BUCKETS"] = 5000
+    # Per response budget; larger results are truncated.
+    app.config["SCUBADUCK_MAX_ROWS"] = 1_000_000
+    app.config["SCUBADUCK_MAX_BYTES"] = 256 * 1024 * 1024
+    # Queries whose estimated cost exceeds this are rejected ("reject") or
+    # run on a sample of the table ("sample").  ``None`` disables the check.
+    app.config["SCUBADUCK_MAX_COST"] = None
+    app.config["SCUBADUCK_COST_ACTION"] = "reject"
+    # How long min/max bounds of time columns are reused.
+    app.config["SCUBADUCK_BOUNDS_TTL"] = 300.0
+    app.config["SCUBADUCK_LANDING_QUERIES"] = list(landing_queries or [])
+    app.config["SCUBADUCK_WARMUP"] = True
+    # In-memory result cache size and lifetime, and the optional disk cache.
+    app.config["SCUBADUCK_RESULT_CACHE_SIZE"] = 100
+    app.config["SCUBADUCK_RESULT_CACHE_BYTES"] = 256 * 1024 * 1024
+    app.config["SCUBADUCK_RESULT_CACHE_TTL"] = 300.0
+    app.config["SCUBADUCK_CACHE_DIR"] = os.environ.get("SCUBADUCK_CACHE_DIR")
+    app.config["SCUBADUCK_CACHE_MAX_BYTES"] = (
+        _env_int("SCUBADUCK_CACHE_MAX_BYTES") or 1 << 30
+    )
+    # DuckDB settings applied at startup; unset ones keep DuckDB's defaults.
+    app.config["SCUBADUCK_MEMORY_LIMIT"] = os.environ.get("SCUBADUCK_MEMORY_LIMIT")
+    app.config["SCUBADUCK_THREADS"] = _env_int("SCUBADUCK_THREADS")
+    app.config["SCUBADUCK_TEMP_DIRECTORY"] = os.environ.get("SCUBADUCK_TEMP_DIRECTORY")
+    app.config["SCUBADUCK_MAX_CONCURRENT"] = _env_int("SCUBADUCK_MAX_CONCURRENT") or 4
+    # Threads that run request handlers when served through ASGI; by default
+    # a few more than the queries admitted at a time.
+    app.config["SCUBADUCK_ASGI_THREADS"] = _env_int("SCUBADUCK_ASGI_THREADS")
+    # Run query SQL in this many worker processes, which are killed when a
+    # query runs longer than SCUBADUCK_QUERY_TIMEOUT seconds or grows past
+    # SCUBADUCK_QUERY_MAX_MEMORY bytes; 0 runs queries in this process.
+    app.config["SCUBADUCK_QUERY_WORKERS"] = _env_int("SCUBADUCK_QUERY_WORKERS") or 0
+    app.config["SCUBADUCK_QUERY_TIMEOUT"] = float(
+        os.environ.get("SCUBADUCK_QUERY_TIMEOUT") or 60
+    )
+    app.config["SCUBADUCK_QUERY_MAX_MEMORY"] = _env_int("SCUBADUCK_QUERY_MAX_MEMORY")
+    # Open DuckDB databases read-only, e.g. a snapshot shared by workers.
+    app.config["SCUBADUCK_READ_ONLY"] = False
+    # Where ScubaDuck keeps its own files, such as the saved queries; with
+    # an empty value saved queries are only kept in memory.
+    app.config["SCUBADUCK_CONFIG_DIR"] = os.environ.get(
+        "SCUBADUCK_CONFIG_DIR", str(_default_config_dir())
+    )
+    # Returns the current UTC time relative times are resolved against;
+    # ``None`` uses the system clock.
+    app.config["SCUBADUCK_CLOCK"] = None
+    # Thread caps for warmup and saved query refreshes, and for typeahead.
+    app.config["SCUBADUCK_BACKGROUND_THREADS"] = 1
+    app.config["SCUBADUCK_TYPEAHEAD_THREADS"] = 1
+    for key, value in (config or {}).items():
+        app.config[key] = value
+    if cache_dir is not None:
+        app.config["SCUBADUCK_CACHE_DIR"] = cache_dir
     if db_file is None:
         env_db = os.environ.get("SCUBADUCK_DB")
         if env_db:
             db_file = env_db
+    if isinstance(db_file, str) and db_file.upper() == "TEST":
+        source = "TEST"
+    else:
+        source = str(Path(db_file or Path(__file__).with_name("sample.csv")).resolve())
+    query_workers = cast(int, app.config["SCUBADUCK_QUERY_WORKERS"])
+    if query_workers:
+        # Workers attach the database file and only one process may open it
+        # read-write, so other sources are copied into a snapshot that every
+        # process opens read-only.
+        db_file = prepare_snapshot(None if db_file is None else str(db_file))
+        app.config["SCUBADUCK_READ_ONLY"] = True
+    db_path: Path | None = None
     if isinstance(db_file, str) and db_file.upper() == "TEST":
         con = _create_test_database()
     else:
         db_path = Path(db_file or Path(__file__).with_name("sample.csv")).resolve()
-        con = _load_database(db_path)
-    tables = [r[0] for r in con.execute("SHOW TABLES").fetchall()]
+        con = _load_database(db_path, cast(bool, app.config["SCUBADUCK_READ_ONLY"]))
+    # Requests, warmup and the index advisor run on different threads.
+    con = cast(duckdb.DuckDBPyConnection, _ThreadLocalConnection(con))
+    governor = ResourceGovernor(
+        con,
+        cast(str | None, app.config["SCUBADUCK_MEMORY_LIMIT"]),
+        cast(int | None, app.config["SCUBADUCK_THREADS"]),
+        cast(str | None, app.config["SCUBADUCK_TEMP_DIRECTORY"]),
+    )
+    app.extensions["scubaduck_resources"] = governor
+
+    query_pool: QueryPool | None = None
+    if query_workers:
+        assert db_path is not None
+        settings: Dict[str, Any] = {
+            "memory_limit": app.config["SCUBADUCK_MEMORY_LIMIT"],
+            "threads": app.config["SCUBADUCK_THREADS"],
+            "temp_directory": app.config["SCUBADUCK_TEMP_DIRECTORY"],
+        }
+        query_pool = QueryPool(
+            db_path,
+            query_workers,
+            cast(float | None, app.config["SCUBADUCK_QUERY_TIMEOUT"]),
+            cast(int | None, app.config["SCUBADUCK_QUERY_MAX_MEMORY"]),
+            {k: v for k, v in settings.items() if v is not None},
+        )
+        atexit.register(query_pool.close)
+    app.extensions["scubaduck_query_pool"] = query_pool
+
+    def execute(
+        params: QueryParams,
+        sql: str,
+        column_types: Dict[str, str] | None,
+        max_rows: int | None = None,
+        max_bytes: int | None = None,
+        threads: int | None = None,
+    ) -> Tuple[List[Tuple[Any, ...]], bool]:
+        """Run query SQL in a query worker if there are any, else here."""
+        if query_pool is None:
+            return _execute(con, params, sql, column_types, max_rows, max_bytes)
+        tables = _value_tables(params, column_types)
+        return query_pool.execute(sql, tables, max_rows, max_bytes, threads)
+
+    def count_rows(
+        params: QueryParams, sql: str, column_types: Dict[str, str] | None
+    ) -> int:
+        """Return the number of rows ``sql`` produces."""
+        rows, _ = execute(params, f"SELECT count(*) FROM ({sql}) t", column_types)
+        return rows[0][0]
+
+    def thread_cap(payload: Dict[str, Any]) -> int | None:
+        """Return the DuckDB thread cap for the current request.
+
+        Background requests get ``SCUBADUCK_BACKGROUND_THREADS`` and a
+        payload may ask for fewer threads with ``threads``.
+        """
+        caps: List[int] = []
+        if request.headers.get(PRIORITY_HEADER) == "background":
+            caps.append(cast(int, app.config["SCUBADUCK_BACKGROUND_THREADS"]))
+        requested = payload.get("threads")
+        if requested is not None:
+            if not isinstance(requested, int) or requested < 1:
+                raise _BadRequest("threads must be a positive integer")
+            caps.append(requested)
+        return min(caps, default=None)
+
+    tables = [
+        r[0] for r in con.execute("SHOW TABLES").fetchall() if not is_hidden(r[0])
+    ]
     if not tables:
         raise ValueError("No tables found in database")
     default_table = tables[0]
+    base_tables = {
+        r[0] for r in con.execute("SELECT table_name FROM duckdb_tables()").fetchall()
+    }
     columns_cache: Dict[str, Dict[str, str]] = {}
 
     def get_columns(table: str) -> Dict[str, str]:
@@ -439,13 +988,106 @@ def create_app(db_file: str | Path | None = None) -> Flask:
             rows = con.execute(f'PRAGMA table_info("{table}")').fetchall()
             if not rows:
                 raise ValueError(f"Unknown table: {table}")
-            columns_cache[table] = {r[1]: r[2] for r in rows}
+            columns_cache[table] = {r[1]: r[2] for r in rows if not is_hidden(r[1])}
         return columns_cache[table]
 
+    # A read-only database can't be indexed.
+    index_advisor = IndexAdvisor(con, enabled=not app.config["SCUBADUCK_READ_ONLY"])
+    app.extensions["scubaduck_indexes"] = index_advisor
+
     sample_cache: Dict[Tuple[str, str, str], Tuple[List[str], float]] = {}
     CACHE_TTL = 60.0
     CACHE_LIMIT = 200
 
+    def data_version(table: str) -> str:
+        """Return a string that changes whenever ``table`` may have changed."""
+        stat = db_path.stat() if db_path is not None else None
+        rows = con.execute(
+            "SELECT estimated_size FROM duckdb_tables() WHERE table_name = ?",
+            [table],
+        ).fetchall()
+        parts = [
+            str(stat.st_mtime_ns) if stat else "",
+            str(stat.st_size) if stat else "",
+            str(rows[0][0]) if rows else "",
+        ]
+        return "-".join(parts)
+
+    materialized = MaterializedColumns(
+        con, version=data_version, writable=not app.config["SCUBADUCK_READ_ONLY"]
+    )
+    app.extensions["scubaduck_materialized"] = materialized
+
+    json_paths = JsonPaths(
+        con, materialized, extract=not app.config["SCUBADUCK_READ_ONLY"]
+    )
+    app.extensions["scubaduck_json_paths"] = json_paths
+
+    disk_cache: DiskCache | None = None
+    if app.config["SCUBADUCK_CACHE_DIR"]:
+        disk_cache = DiskCache(
+            cast(str | Path, app.config["SCUBADUCK_CACHE_DIR"]),
+            cast(int, app.config["SCUBADUCK_CACHE_MAX_BYTES"]),
+        )
+    result_cache = ResultCache(
+        cast(float, app.config["SCUBADUCK_RESULT_CACHE_TTL"]),
+        cast(int, app.config["SCUBADUCK_RESULT_CACHE_SIZE"]),
+        store=disk_cache,
+        version=data_version,
+        max_bytes=cast(int | None, app.config["SCUBADUCK_RESULT_CACHE_BYTES"]),
+    )
+    app.extensions["scubaduck_results"] = result_cache
+    if disk_cache is not None:
+        # Let results being written in the background reach the disk.
+        atexit.register(disk_cache.wait)
+
+    estimator = CostEstimator(con, version=data_version)
+    app.extensions["scubaduck_estimator"] = estimator
+
+    admission = AdmissionController(cast(int, app.config["SCUBADUCK_MAX_CONCURRENT"]))
+    app.extensions["scubaduck_admission"] = admission
+    # Endpoints that run queries and the priority they get by default.
+    admitted_endpoints = {
+        "columns": "interactive",
+        "sample_values": "interactive",
+        "query": "interactive",
+        "estimate": "interactive",
+        "row": "interactive",
+        "export": "heavy",
+    }
+
+    @app.before_request
+    def admit_request() -> Any:  # pyright: ignore[reportUnusedFunction]
+        default = admitted_endpoints.get(request.endpoint or "")
+        if default is None:
+            return None
+        requested = request.headers.get(PRIORITY_HEADER, default)
+        if requested not in PRIORITIES:
+            requested = default
+        # Clients may lower the priority of a request but not raise it.
+        priority = max(default, requested, key=PRIORITIES.index)
+        client = (
+            request.headers.get(CLIENT_HEADER)
+            or request.cookies.get(CLIENT_COOKIE)
+            or request.remote_addr
+            or "-"
+        )
+        try:
+            ticket = admission.acquire(priority, client)
+        except Overloaded as exc:
+            resp = jsonify({"error": str(exc), "priority": exc.priority})
+            resp.status_code = 429
+            resp.headers["Retry-After"] = str(math.ceil(exc.retry_after))
+            return resp
+        request.environ["scubaduck.admission"] = ticket
+        return None
+
+    @app.teardown_request
+    def release_request(exc: BaseException | None) -> None:  # pyright: ignore[reportUnusedFunction]
+        ticket = request.environ.pop("scubaduck.admission", None)
+        if ticket is not None:
+            admission.release(ticket)
+
     @app.route("/")
     def index() -> Any:  # pyright: ignore[reportUnusedFunction]
         assert app.static_folder is not None
@@ -465,7 +1107,71 @@ def create_app(db_file: str | Path | None = None) -> Flask:
     def columns() -> Any:  # pyright: ignore[reportUnusedFunction]
         table = request.args.get("table", default_table)
         rows = con.execute(f'PRAGMA table_info("{table}")').fetchall()
-        return jsonify([{"name": r[1], "type": r[2]} for r in rows])
+        cols = [{"name": r[1], "type": r[2]} for r in rows if not is_hidden(r[1])]
+        if table in tables:
+            for name, ctype in json_paths.discover(table, get_columns(table)):
+                cols.append({"name": name, "type": ctype})
+        return jsonify(cols)
+
+    @app.route("/api/admin/indexes")
+    def admin_indexes() -> Any:  # pyright: ignore[reportUnusedFunction]
+        return jsonify(index_advisor.status())
+
+    @app.route("/api/admin/json_paths")
+    def admin_json_paths() -> Any:  # pyright: ignore[reportUnusedFunction]
+        return jsonify(json_paths.status())
+
+    @app.route("/api/admin/resources")
+    def admin_resources() -> Any:  # pyright: ignore[reportUnusedFunction]
+        return jsonify(governor.status())
+
+    @app.route("/api/admin/workers")
+    def admin_workers() -> Any:  # pyright: ignore[reportUnusedFunction]
+        return jsonify(query_pool.status() if query_pool is not None else None)
+
+    @app.route("/api/admin/admission")
+    def admin_admission() -> Any:  # pyright: ignore[reportUnusedFunction]
+        return jsonify(admission.status())
+
+    @app.route("/api/admin/cache")
+    def admin_cache() -> Any:  # pyright: ignore[reportUnusedFunction]
+        return jsonify(
+            {
+                "entries": result_cache.size(),
+                "bytes": result_cache.bytes(),
+                "disk": disk_cache.status() if disk_cache is not None else None,
+            }
+        )
+
+    @app.route("/api/materialized", methods=["GET", "POST", "DELETE"])
+    def materialized_columns() -> Any:  # pyright: ignore[reportUnusedFunction]
+        if request.method == "GET":
+            return jsonify(materialized.status())
+        payload = request.get_json(force=True)
+        table = payload.get("table", default_table)
+        name = payload.get("name")
+        if not name:
+            return jsonify({"error": "name required"}), 400
+        try:
+            if request.method == "DELETE":
+                materialized.drop(table, name)
+                return jsonify(materialized.status())
+            materialized.save(table, name, payload.get("expr", ""))
+        except KeyError:
+            return jsonify({"error": f"Unknown materialized column: {name}"}), 404
+        except Exception as exc:
+            return jsonify({"error": str(exc)}), 400
+        return jsonify(materialized.status())
+
+    @app.route("/api/materialized/refresh", methods=["POST"])
+    def refresh_materialized() -> Any:  # pyright: ignore[reportUnusedFunction]
+        payload = request.get_json(force=True)
+        table = payload.get("table", default_table)
+        try:
+            updated = materialized.refresh(table)
+        except Exception as exc:
+            return jsonify({"error": str(exc)}), 400
+        return jsonify({"table": table, "rows_updated": updated})
 
     def _cache_get(key: Tuple[str, str, str]) -> List[str] | None:
         item = sample_cache.get(key)
@@ -473,7 +1179,7 @@ def create_app(db_file: str | Path | None = None) -> Flask:
             return None
         vals, ts = item
         if time.time() - ts > CACHE_TTL:
-            del sample_cache[key]
+            sample_cache.pop(key, None)
             return None
         sample_cache[key] = (vals, time.time())
         return vals
@@ -482,7 +1188,23 @@ def create_app(db_file: str | Path | None = None) -> Flask:
         sample_cache[key] = (vals, time.time())
         if len(sample_cache) > CACHE_LIMIT:
             oldest = min(sample_cache.items(), key=lambda kv: kv[1][1])[0]
-            del sample_cache[oldest]
+            sample_cache.pop(oldest, None)
+
+    def top_values(table: str, column: str, substr: str) -> List[str]:
+        """Return the most common values of ``column`` containing ``substr``."""
+        key = (table, column, substr)
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached
+        qcol = quote(column)
+        rows = con.execute(
+            f"SELECT {qcol} FROM \"{table}\" WHERE CAST({qcol} AS VARCHAR) ILIKE '%' || ? || '%' "
+            f"GROUP BY {qcol} ORDER BY count(*) DESC, {qcol} LIMIT 20",
+            [substr],
+        ).fetchall()
+        values = [r[0] for r in rows]
+        _cache_set(key, values)
+        return values
 
     @app.route("/api/samples")
     def sample_values() -> Any:  # pyright: ignore[reportUnusedFunction]
@@ -492,30 +1214,61 @@ def create_app(db_file: str | Path | None = None) -> Flask:
         column_types = get_columns(table)
         if not column or column not in column_types:
             return jsonify([])
-        ctype = column_types[column].upper()
-        if "CHAR" not in ctype and "STRING" not in ctype and "VARCHAR" not in ctype:
+        if not _is_string_type(column_types[column]):
             return jsonify([])
-        key = (table, column, substr)
-        cached = _cache_get(key)
-        if cached is not None:
-            return jsonify(cached)
-        qcol = _quote(column)
-        rows = con.execute(
-            f"SELECT DISTINCT {qcol} FROM \"{table}\" WHERE CAST({qcol} AS VARCHAR) ILIKE '%' || ? || '%' LIMIT 20",
-            [substr],
-        ).fetchall()
-        values = [r[0] for r in rows]
-        _cache_set(key, values)
-        return jsonify(values)
+        with governor.limit(cast(int, app.config["SCUBADUCK_TYPEAHEAD_THREADS"])):
+            return jsonify(top_values(table, column, substr))
 
-    @app.route("/api/query", methods=["POST"])
-    def query() -> Any:  # pyright: ignore[reportUnusedFunction]
-        payload = request.get_json(force=True)
+    bounds_cache: Dict[Tuple[str, str], Tuple[Any, Any, Any, float]] = {}
+
+    def time_bounds(table: str, column: str) -> Tuple[Any, Any]:
+        """Return the (cached) smallest and largest value of ``column``.
+
+        Cached bounds are reused for ``SCUBADUCK_BOUNDS_TTL`` seconds unless
+        the table's row count changes in the meantime.
+        """
+        ttl = cast(float, app.config["SCUBADUCK_BOUNDS_TTL"])
+        sizes = con.execute(
+            "SELECT estimated_size FROM duckdb_tables() WHERE table_name = ?",
+            [table],
+        ).fetchall()
+        size = sizes[0][0] if sizes else None
+        item = bounds_cache.get((table, column))
+        if item is not None and item[2] == size and time.time() - item[3] <= ttl:
+            return item[0], item[1]
+        mn, mx = con.execute(
+            f'SELECT min({quote(column)}), max({quote(column)}) FROM "{table}"'
+        ).fetchall()[0]
+        bounds_cache[(table, column)] = (mn, mx, size, time.time())
+        return mn, mx
+
+    def prepare_query(payload: Dict[str, Any]) -> _PreparedQuery:
+        """Validate a query payload and resolve what SQL generation needs."""
+        relative_start = _is_relative_time(payload.get("start"))
+        relative_end = _is_relative_time(payload.get("end"))
+        clock = cast(Callable[[], datetime] | None, app.config["SCUBADUCK_CLOCK"])
+        # One "now" for both ends, so "-1 hour" to "now" spans exactly an hour.
+        now = clock() if clock is not None else datetime.now(timezone.utc)
         try:
-            start = parse_time(payload.get("start"))
-            end = parse_time(payload.get("end"))
+            start = parse_time(payload.get("start"), now)
+            end = parse_time(payload.get("end"), now)
         except Exception as exc:
-            return jsonify({"error": str(exc)}), 400
+            raise _BadRequest(str(exc))
+
+        cursor = payload.get("cursor")
+        after_value: str | int | float | None = None
+        after_rowid: int | None = None
+        if cursor is not None:
+            try:
+                after_value, after_rowid = _decode_cursor(str(cursor))
+            except ValueError as exc:
+                raise _BadRequest(str(exc))
+
+        chart_width = payload.get("chart_width")
+        if chart_width is not None and (
+            not isinstance(chart_width, int) or chart_width <= 0
+        ):
+            raise _BadRequest("Invalid chart_width")
 
         params = QueryParams(
             start=start,
@@ -535,6 +1288,9 @@ def create_app(db_file: str | Path | None = None) -> Flask:
             table=payload.get("table", default_table),
             time_column=payload.get("time_column", "timestamp"),
             time_unit=payload.get("time_unit", "s"),
+            chart_width=chart_width,
+            after_value=after_value,
+            after_rowid=after_rowid,
         )
         if params.order_by and params.order_by.strip().lower() == "samples":
             params.order_by = "Hits"
@@ -542,26 +1298,39 @@ def create_app(db_file: str | Path | None = None) -> Flask:
             params.filters.append(Filter(f["column"], f["op"], f.get("value")))
 
         if params.table not in tables:
-            return jsonify({"error": "Invalid table"}), 400
+            raise _BadRequest("Invalid table")
+        # Pages are keyed on the row id, which views don't have.
+        params.keyset = (
+            "cursor" in payload
+            and params.graph_type == "samples"
+            and params.table in base_tables
+        )
 
-        column_types = get_columns(params.table)
+        base_types = get_columns(params.table)
+        column_types = dict(base_types)
+        referenced = (
+            params.columns + params.group_by + [f.column for f in params.filters]
+        )
+        if params.order_by:
+            referenced.append(params.order_by)
+        for name in referenced:
+            if name in column_types or name in params.derived_columns:
+                continue
+            resolved = json_paths.resolve(params.table, name, base_types)
+            if resolved is not None:
+                params.json_columns[name], column_types[name] = resolved
 
         if params.time_column and params.time_column not in column_types:
-            return jsonify({"error": "Invalid time_column"}), 400
+            raise _BadRequest("Invalid time_column")
 
         if params.time_unit not in {"s", "ms", "us", "ns"}:
-            return jsonify({"error": "Invalid time_unit"}), 400
+            raise _BadRequest("Invalid time_unit")
 
         if params.graph_type not in {"table", "timeseries"} and (
             params.group_by or params.aggregate or params.show_hits
         ):
-            return (
-                jsonify(
-                    {
-                        "error": "group_by, aggregate and show_hits are only valid for table or timeseries view"
-                    }
-                ),
-                400,
+            raise _BadRequest(
+                "group_by, aggregate and show_hits are only valid for table or timeseries view"
             )
 
         valid_cols = set(column_types.keys())
@@ -571,7 +1340,7 @@ def create_app(db_file: str | Path | None = None) -> Flask:
             if params.x_axis is None:
                 params.x_axis = params.time_column
             if params.x_axis is None or params.x_axis not in valid_cols:
-                return jsonify({"error": "Invalid x_axis"}), 400
+                raise _BadRequest("Invalid x_axis")
             ctype = column_types.get(params.x_axis, "").upper()
             is_time = any(t in ctype for t in ["TIMESTAMP", "DATE", "TIME"])
             is_numeric = any(
@@ -587,15 +1356,15 @@ def create_app(db_file: str | Path | None = None) -> Flask:
                 ]
             )
             if not (is_time or is_numeric):
-                return jsonify({"error": "x_axis must be a time column"}), 400
+                raise _BadRequest("x_axis must be a time column")
         for col in params.columns:
             if col not in valid_cols:
-                return jsonify({"error": f"Unknown column: {col}"}), 400
+                raise _BadRequest(f"Unknown column: {col}")
         for col in params.group_by:
             if col not in valid_cols:
-                return jsonify({"error": f"Unknown column: {col}"}), 400
+                raise _BadRequest(f"Unknown column: {col}")
         if params.order_by and params.order_by not in valid_cols:
-            return jsonify({"error": f"Unknown column: {params.order_by}"}), 400
+            raise _BadRequest(f"Unknown column: {params.order_by}")
 
         if params.group_by or params.graph_type == "timeseries":
             agg = (params.aggregate or "count").lower()
@@ -629,35 +1398,22 @@ def create_app(db_file: str | Path | None = None) -> Flask:
                     )
                     is_time = "TIMESTAMP" in ctype or "DATE" in ctype or "TIME" in ctype
                     if need_numeric and not is_numeric:
-                        return (
-                            jsonify(
-                                {
-                                    "error": f"Aggregate {agg} cannot be applied to column {c}",
-                                }
-                            ),
-                            400,
+                        raise _BadRequest(
+                            f"Aggregate {agg} cannot be applied to column {c}"
                         )
                     if allow_time and not (is_numeric or is_time):
-                        return (
-                            jsonify(
-                                {
-                                    "error": f"Aggregate {agg} cannot be applied to column {c}",
-                                }
-                            ),
-                            400,
+                        raise _BadRequest(
+                            f"Aggregate {agg} cannot be applied to column {c}"
                         )
         if (params.start is None or params.end is None) and (
             params.x_axis or params.time_column
         ):
             axis = params.x_axis or params.time_column
             assert axis is not None
-            row = cast(
+            mn, mx = cast(
                 tuple[datetime | None, datetime | None],
-                con.execute(
-                    f'SELECT min({_quote(axis)}), max({_quote(axis)}) FROM "{params.table}"'
-                ).fetchall()[0],
+                time_bounds(params.table, axis),
             )
-            mn, mx = row
             if isinstance(mn, (int, float)):
                 try:
                     mn = _numeric_to_datetime(mn, params.time_unit)
@@ -666,7 +1422,7 @@ def create_app(db_file: str | Path | None = None) -> Flask:
                     msg = f"Invalid time value {mn} for column {axis} with time_unit {params.time_unit}"
                     if suggestion:
                         msg += f"; maybe try time_unit {suggestion}"
-                    return jsonify({"error": msg}), 400
+                    raise _BadRequest(msg)
             if isinstance(mx, (int, float)):
                 try:
                     mx = _numeric_to_datetime(mx, params.time_unit)
@@ -675,7 +1431,7 @@ def create_app(db_file: str | Path | None = None) -> Flask:
                     msg = f"Invalid time value {mx} for column {axis} with time_unit {params.time_unit}"
                     if suggestion:
                         msg += f"; maybe try time_unit {suggestion}"
-                    return jsonify({"error": msg}), 400
+                    raise _BadRequest(msg)
             if params.start is None and mn is not None:
                 params.start = (
                     mn.strftime("%Y-%m-%d %H:%M:%S") if not isinstance(mn, str) else mn
@@ -686,13 +1442,24 @@ def create_app(db_file: str | Path | None = None) -> Flask:
                 )
 
         bucket_size: int | None = None
+        requested_bucket_size: int | None = None
         series_limit = params.limit
         if params.graph_type == "timeseries":
-            bucket_size = _granularity_seconds(
+            requested_bucket_size = _granularity_seconds(
                 params.granularity,
                 params.start if isinstance(params.start, str) else None,
                 params.end if isinstance(params.end, str) else None,
+                params.chart_width,
             )
+            bucket_size = _cap_bucket_size(
+                requested_bucket_size,
+                params.start,
+                params.end,
+                cast(int, app.config["SCUBADUCK_MAX_BUCKETS"]),
+            )
+            params.bucket_size = bucket_size
+            if relative_start and params.start is not None:
+                params.start = _align_time(params.start, bucket_size)
             if (
                 params.limit is not None
                 and params.start is not None
@@ -708,15 +1475,111 @@ def create_app(db_file: str | Path | None = None) -> Flask:
                         params.limit *= buckets
                 except Exception:
                     pass
+        return _PreparedQuery(
+            params,
+            base_types,
+            column_types,
+            relative_end,
+            series_limit,
+            bucket_size,
+            requested_bucket_size,
+        )
 
-        sql = build_query(params, column_types)
+    @app.route("/api/query", methods=["POST"])
+    def query() -> Any:  # pyright: ignore[reportUnusedFunction]
+        payload = request.get_json(force=True)
         try:
-            rows = con.execute(sql).fetchall()
+            prepared = prepare_query(payload)
+            cap = thread_cap(payload)
+        except _BadRequest as exc:
+            return jsonify({"error": str(exc)}), 400
+        params = prepared.params
+        base_types = prepared.base_types
+        column_types = prepared.column_types
+        bucket_size = prepared.bucket_size
+        requested_bucket_size = prepared.requested_bucket_size
+        series_limit = prepared.series_limit
+        estimate: Dict[str, Any] | None = None
+        max_cost = cast(float | None, app.config["SCUBADUCK_MAX_COST"])
+        if max_cost is not None:
+            estimate = estimator.estimate(params, prepared.base_types)
+            if estimate["cost"] > max_cost:
+                if app.config["SCUBADUCK_COST_ACTION"] != "sample":
+                    msg = (
+                        f"Query is too expensive (estimated cost "
+                        f"{estimate['cost']:,.0f}, limit {max_cost:,.0f}); "
+                        "narrow the time range, add filters or group by fewer "
+                        "columns"
+                    )
+                    return jsonify({"error": msg, "estimate": estimate}), 400
+                percent = max(0.01, math.floor(max_cost / estimate["cost"] * 1e4) / 100)
+                params.sample_percent = percent
+        edge_params: QueryParams | None = None
+        query_params = params
+        if bucket_size is not None:
+            # An explicit sort on an output column (other than the bucket)
+            # interleaves edge rows with the rest, so only split when the
+            # rows come back in bucket order.
+            sort_cols = set(params.columns) | set(params.group_by)
+            sort_cols.update(params.derived_columns)
+            sort_cols.add("Hits")
+            bucket_order = params.order_by not in sort_cols
+            if prepared.relative_end and params.end is not None and bucket_order:
+                edge_start = _align_time(params.end, bucket_size)
+                if edge_start != params.end and (
+                    params.start is None or edge_start > params.start
+                ):
+                    # Only the partial bucket at the open edge changes from
+                    # one "now" to the next; it's queried separately so the
+                    # rest of the range can be served from the result cache.
+                    edge_params = replace(params, start=edge_start)
+                    query_params = replace(params, end=edge_start, end_exclusive=True)
+
+        index_advisor.record(params.table, params.filters, base_types)
+
+        query_params = canonicalize(query_params)
+        stored = materialized.stored(params.table)
+        sql = build_query(query_params, column_types, stored)
+        edge_sql: str | None = None
+        max_rows = cast(int | None, app.config["SCUBADUCK_MAX_ROWS"])
+        max_bytes = cast(int | None, app.config["SCUBADUCK_MAX_BYTES"])
+        total_rows: int | None = None
+
+        def run(p: QueryParams) -> Tuple[List[Tuple[Any, ...]], bool]:
+            # The result cache may only need part of the range queried.
+            run_sql = sql if p is query_params else build_query(p, column_types, stored)
+            return execute(p, run_sql, column_types, max_rows, max_bytes, cap)
+
+        try:
+            with governor.limit(cap):
+                rows, cache_state, truncated = result_cache.fetch(query_params, run)
+                if edge_params is not None and not truncated:
+                    # Edge buckets sort after every cached bucket, so appending
+                    # them gives the same rows as querying the whole range.
+                    edge_params = canonicalize(edge_params)
+                    edge_sql = build_query(edge_params, column_types, stored)
+                    edge_rows, edge_truncated = execute(
+                        edge_params, edge_sql, column_types, max_rows, max_bytes, cap
+                    )
+                    truncated = truncated or edge_truncated
+                    rows = rows + edge_rows
+                    if params.limit is not None:
+                        rows = rows[: params.limit]
+                if max_rows is not None and len(rows) > max_rows:
+                    rows = rows[:max_rows]
+                    truncated = True
+                if truncated:
+                    total_rows = count_rows(query_params, sql, column_types)
+                    if edge_params is not None:
+                        edge_params = canonicalize(edge_params)
+                        edge_sql = build_query(edge_params, column_types, stored)
+                        total_rows += count_rows(edge_params, edge_sql, column_types)
         except Exception as exc:
             tb = traceback.format_exc()
-            print(f"Query failed:\n{sql}\n{tb}")
+            failed = edge_sql or sql
+            print(f"Query failed:\n{failed}\n{tb}")
             return (
-                jsonify({"sql": sql, "error": str(exc), "traceback": tb}),
+                jsonify({"sql": failed, "error": str(exc), "traceback": tb}),
                 400,
             )
 
@@ -725,6 +1588,15 @@ def create_app(db_file: str | Path | None = None) -> Flask:
                 return repr(value)
             return value
 
+        next_cursor: str | None = None
+        row_ids: List[int] | None = None
+        if params.keyset:
+            full_page = params.limit is not None and len(rows) == params.limit
+            if rows and (full_page or truncated):
+                next_cursor = _encode_cursor(rows[-1][-2], rows[-1][-1])
+            row_ids = [r[-1] for r in rows]
+            rows = [r[:-2] for r in rows]
+
         rows = [[_serialize(v) for v in r] for r in rows]
 
         if (
@@ -745,19 +1617,243 @@ def create_app(db_file: str | Path | None = None) -> Flask:
             rows = filtered
 
         result: Dict[str, Any] = {"sql": sql, "rows": rows}
+        if edge_sql is not None:
+            result["edge_sql"] = edge_sql
+        if cache_state is not None:
+            result["cache"] = cache_state
+        if row_ids is not None:
+            result["row_ids"] = row_ids
+        if params.sample_percent is not None:
+            result["sampled"] = params.sample_percent
+            result["estimate"] = estimate
+        if truncated:
+            result["truncated"] = True
+            result["total_rows"] = total_rows
+        if next_cursor is not None:
+            result["next_cursor"] = next_cursor
         if params.start is not None:
             result["start"] = str(params.start)
         if params.end is not None:
             result["end"] = str(params.end)
         if bucket_size is not None:
             result["bucket_size"] = bucket_size
+            if bucket_size != requested_bucket_size:
+                result["granularity_adjusted"] = True
+                result["requested_bucket_size"] = requested_bucket_size
         return jsonify(result)
 
+    @app.route("/api/estimate", methods=["POST"])
+    def estimate_endpoint() -> Any:  # pyright: ignore[reportUnusedFunction]
+        payload = request.get_json(force=True)
+        try:
+            prepared = prepare_query(payload)
+        except _BadRequest as exc:
+            return jsonify({"error": str(exc)}), 400
+        estimate = estimator.estimate(prepared.params, prepared.base_types)
+        estimate["max_cost"] = app.config["SCUBADUCK_MAX_COST"]
+        return jsonify(estimate)
+
+    @app.route("/api/row")
+    def row_detail() -> Any:  # pyright: ignore[reportUnusedFunction]
+        table = request.args.get("table", default_table)
+        rowid = request.args.get("rowid", type=int)
+        if table not in base_tables:
+            return jsonify({"error": "Invalid table"}), 400
+        if rowid is None:
+            return jsonify({"error": "rowid required"}), 400
+        names = list(get_columns(table))
+        select = ", ".join(quote(c) for c in names)
+        rows = con.execute(
+            f"SELECT {select} FROM {quote(table)} WHERE rowid = ?", [rowid]
+        ).fetchall()
+        if not rows:
+            return jsonify({"error": f"Unknown row: {rowid}"}), 404
+        values = [repr(v) if isinstance(v, bytes) else v for v in rows[0]]
+        return jsonify(
+            {"columns": [{"name": n, "value": v} for n, v in zip(names, values)]}
+        )
+
+    @app.route("/api/export", methods=["POST"])
+    def export() -> Any:  # pyright: ignore[reportUnusedFunction]
+        fmt = request.args.get("format", "csv")
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({"error": f"Unsupported format: {fmt}"}), 400
+        ext, mimetype, options = EXPORT_FORMATS[fmt]
+        # Plain HTML forms can post the payload as a form field.
+        try:
+            if "payload" in request.form:
+                raw = json.loads(request.form["payload"])
+            else:
+                raw = request.get_json(force=True, silent=True)
+        except ValueError as exc:
+            return jsonify({"error": f"Invalid payload: {exc}"}), 400
+        if not isinstance(raw, dict):
+            return jsonify({"error": "Invalid payload: expected an object"}), 400
+        payload = cast(Dict[str, Any], raw)
+        payload.pop("cursor", None)
+        try:
+            prepared = prepare_query(payload)
+            cap = thread_cap(payload)
+        except _BadRequest as exc:
+            return jsonify({"error": str(exc)}), 400
+        params = canonicalize(prepared.params)
+        sql = build_query(
+            params, prepared.column_types, materialized.stored(params.table)
+        )
+        if request.args.get("check"):
+            # The UI checks the query before starting the download itself,
+            # as the browser can't show an error in place of a file.
+            try:
+                con.execute(f"DESCRIBE {sql}").fetchall()
+            except duckdb.Error as exc:
+                return jsonify({"sql": sql, "error": str(exc)}), 400
+            return jsonify({"sql": sql})
+        # DuckDB writes the file itself, so rows never pass through Python.
+        tmpdir = tempfile.mkdtemp(prefix="scubaduck-export-")
+        path = Path(tmpdir) / f"export.{ext}"
+        try:
+            with governor.limit(cap):
+                copy = f"COPY ({sql}) TO {literal(str(path))} ({options})"
+                execute(params, copy, prepared.column_types, threads=cap)
+        except Exception as exc:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            tb = traceback.format_exc()
+            print(f"Export failed:\n{sql}\n{tb}")
+            return jsonify({"sql": sql, "error": str(exc), "traceback": tb}), 400
+
+        def generate() -> Iterator[bytes]:
+            try:
+                with open(path, "rb") as fh:
+                    while chunk := fh.read(EXPORT_CHUNK_SIZE):
+                        yield chunk
+            finally:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+        filename = f"{params.table}.{ext}"
+        return Response(
+            generate(),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
+    def run_payload(payload: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+        """Run an ``/api/query`` payload as background work."""
+        with app.test_request_context(
+            "/api/query",
+            method="POST",
+            json=payload,
+            headers={PRIORITY_HEADER: "background", CLIENT_HEADER: "scubaduck"},
+        ):
+            # Go through the request hooks so background queries are
+            # admitted like any other.
+            rv = app.preprocess_request()
+            if rv is None:
+                rv = query()
+            resp = app.make_response(rv)
+            return cast(Dict[str, Any], resp.get_json()), resp.status_code
+
+    config_dir = cast(str | Path | None, app.config["SCUBADUCK_CONFIG_DIR"])
+    saved_path = Path(config_dir) / SAVED_QUERIES_FILE if config_dir else None
+    try:
+        saved_queries = SavedQueries(saved_path, source, run_payload)
+    except (OSError, sqlite3.Error) as exc:
+        print(f"Saved queries are kept in memory, {saved_path} is unusable: {exc}")
+        saved_queries = SavedQueries(None, source, run_payload)
+    app.extensions["scubaduck_saved_queries"] = saved_queries
+
+    @app.route("/api/saved", methods=["GET", "POST"])
+    def saved() -> Any:  # pyright: ignore[reportUnusedFunction]
+        if request.method == "GET":
+            return jsonify(saved_queries.status())
+        payload = request.get_json(force=True)
+        if not isinstance(payload.get("payload"), dict):
+            return jsonify({"error": "payload must be an object"}), 400
+        try:
+            entry = saved_queries.save(
+                payload.get("name", ""),
+                payload.get("payload"),
+                float(payload.get("refresh_interval", 60)),
+                None if payload.get("ttl") is None else float(payload["ttl"]),
+            )
+        except (TypeError, ValueError, duckdb.Error, sqlite3.Error) as exc:
+            return jsonify({"error": str(exc)}), 400
+        return jsonify(entry.info())
+
+    @app.route("/api/saved/<name>", methods=["GET", "DELETE"])
+    def saved_query(name: str) -> Any:  # pyright: ignore[reportUnusedFunction]
+        try:
+            if request.method == "DELETE":
+                saved_queries.delete(name)
+                return jsonify(saved_queries.status())
+            entry = saved_queries.load(name)
+        except KeyError:
+            return jsonify({"error": f"Unknown saved query: {name}"}), 404
+        if entry.result is None:
+            return jsonify({"error": entry.error, "saved": entry.info()}), 400
+        return jsonify({**entry.result, "saved": entry.info()})
+
+    @app.route("/api/ready")
+    def ready() -> Any:  # pyright: ignore[reportUnusedFunction]
+        status = warmup.status()
+        return jsonify(status), 200 if status["ready"] else 503
+
+    def warm_table(table: str) -> None:
+        with governor.limit(cast(int, app.config["SCUBADUCK_BACKGROUND_THREADS"])):
+            column_types = get_columns(table)
+            if table in materialized.tables():
+                # Catch up with rows written while the server was down.
+                materialized.check(table)
+            json_paths.discover(table, column_types)
+            for col, ctype in column_types.items():
+                if _is_time_type(ctype):
+                    time_bounds(table, col)
+                elif _is_string_type(ctype):
+                    top_values(table, col, "")
+
+    def warm_query(payload: Dict[str, Any]) -> None:
+        result, status = run_payload(payload)
+        if status != 200:
+            raise RuntimeError(result["error"])
+
+    tasks: List[Tuple[str, Callable[[], None]]] = [
+        (f"table {t}", partial(warm_table, t)) for t in tables
+    ]
+    landing = cast(List[Dict[str, Any]], app.config["SCUBADUCK_LANDING_QUERIES"])
+    for i, payload in enumerate(landing):
+        tasks.append((f"landing query {i}", partial(warm_query, payload)))
+    if not app.config["SCUBADUCK_WARMUP"]:
+        tasks = []
+    warmup = Warmup(tasks)
+    app.extensions["scubaduck_warmup"] = warmup
+    warmup.start()
+    saved_queries.start()
+    index_advisor.start()
+    # Exiting while a background thread is inside DuckDB aborts the process.
+    atexit.register(saved_queries.stop)
+    atexit.register(warmup.stop)
+    atexit.register(index_advisor.stop)
+
     return app
 
 
-app = create_app()
+_app: Flask | None = None
+_app_lock = threading.Lock()
+
+
+def __getattr__(name: str) -> Any:
+    """Create the module level ``app`` on first access.
+
+    ``flask --app scubaduck.server`` and tests use it; importing the module
+    doesn't load any data.
+    """
+    global _app
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _app_lock:
+        if _app is None:
+            _app = create_app()
+        return _app
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,51 @@
+"""Helpers for building DuckDB SQL."""
+
+from __future__ import annotations
+
+NUMERIC_TYPES = [
+    "INT",
+    "DECIMAL",
+    "REAL",
+    "DOUBLE",
+    "FLOAT",
+    "NUMERIC",
+    "HUGEINT",
+]
+
+UNIT_SCALE = {"s": 1, "ms": 1_000, "us": 1_000_000, "ns": 1_000_000_000}
+
+
+def quote(ident: str) -> str:
+    """Return identifier quoted for SQL."""
+    return '"' + ident.replace('"', '""') + '"'
+
+
+def literal(value: str | int | float) -> str:
+    """Return ``value`` as a SQL literal."""
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+def epoch_unit(col: str, column_types: dict[str, str] | None, unit: str) -> str | None:
+    """Return the effective epoch unit of numeric column ``col``.
+
+    ``None`` is returned when the column is not a numeric epoch column.  32-bit
+    integers cannot store sub-second precision for modern dates, so they are
+    always interpreted as seconds.
+    """
+    if column_types is None:
+        return None
+    ctype = column_types.get(col, "").upper()
+    if any(t in ctype for t in ["TIMESTAMP", "DATE", "TIME"]):
+        return None
+    if not any(t in ctype for t in NUMERIC_TYPES):
+        return None
+    if (
+        unit != "s"
+        and "INT" in ctype
+        and "BIGINT" not in ctype
+        and "HUGEINT" not in ctype
+    ):
+        return "s"
+    return unit if unit in UNIT_SCALE else "s"
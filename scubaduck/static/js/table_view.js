@@ -2,6 +2,7 @@
 // the inline script only handles wiring up the UI.
 
 let originalRows = [];
+let lastQueryPayload = null;
 let sortState = { index: null, dir: null };
 
 function renderTable(rows) {
@@ -45,6 +46,9 @@ function renderTable(rows) {
         .forEach((el) => el.classList.remove("selected"));
       if (!wasSelected) {
         tr.classList.add("selected");
+        if (row.rowId !== undefined) showRowDetail(row.rowId);
+      } else {
+        hideRowDetail();
       }
     });
     row.forEach((v, i) => {
@@ -142,9 +146,13 @@ function showResults(data) {
     } else {
       view.innerHTML = '<table id="results"></table>';
     }
+    attachRowIds(data.rows, data.row_ids);
     originalRows = data.rows.slice();
     sortState = { index: null, dir: null };
     renderTable(originalRows);
+    if (data.next_cursor) {
+      addLoadMore(view, data.next_cursor);
+    }
   }
   const sqlEl = document.createElement("pre");
   sqlEl.id = "sql_query";
@@ -152,7 +160,98 @@ function showResults(data) {
   sqlEl.style.marginTop = "10px";
   sqlEl.textContent = data.sql;
   view.appendChild(sqlEl);
-  document.getElementById("query_info").textContent = `Your query took about ${lastQueryTime} ms`;
+  let info = `Your query took about ${lastQueryTime} ms`;
+  if (data.granularity_adjusted) {
+    info += ` (granularity coarsened to ${data.bucket_size} seconds to limit the number of buckets)`;
+  }
+  if (data.sampled) {
+    info += ` (computed on a ${data.sampled}% sample because the full query was estimated to be too expensive)`;
+  }
+  if (data.truncated) {
+    info += ` (showing ${data.rows.length} of ${data.total_rows} rows; the result was too large to send)`;
+  }
+  document.getElementById("query_info").textContent = info;
+}
+
+// Samples only fetch the selected columns; the row id lets the full row be
+// loaded when it is clicked.
+function attachRowIds(rows, rowIds) {
+  if (!rowIds) return;
+  rows.forEach((r, i) => {
+    r.rowId = rowIds[i];
+  });
+}
+
+function hideRowDetail() {
+  const el = document.getElementById("row_detail");
+  if (el) el.remove();
+}
+
+function showRowDetail(rowId) {
+  const table = document.getElementById("table").value;
+  fetch(`/api/row?table=${encodeURIComponent(table)}&rowid=${rowId}`)
+    .then((r) => r.json())
+    .then((data) => {
+      hideRowDetail();
+      if (!data.columns) return;
+      const detail = document.createElement("table");
+      detail.id = "row_detail";
+      data.columns.forEach((c) => {
+        const tr = document.createElement("tr");
+        const th = document.createElement("th");
+        th.textContent = c.name;
+        th.style.textAlign = "left";
+        const td = document.createElement("td");
+        td.textContent = c.value === null ? "" : c.value;
+        tr.appendChild(th);
+        tr.appendChild(td);
+        detail.appendChild(tr);
+      });
+      document.getElementById("results").after(detail);
+    });
+}
+
+function addLoadMore(view, cursor) {
+  const btn = document.createElement("button");
+  btn.id = "load_more";
+  btn.type = "button";
+  btn.textContent = "Load more";
+  btn.dataset.cursor = cursor;
+  btn.addEventListener("click", () => loadMoreRows(btn));
+  view.appendChild(btn);
+}
+
+function loadMoreRows(btn) {
+  btn.disabled = true;
+  const payload = Object.assign({}, lastQueryPayload, {
+    cursor: btn.dataset.cursor,
+  });
+  fetch("/api/query", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(payload),
+  })
+    .then(async (r) => {
+      const data = await r.json();
+      if (!r.ok) throw data;
+      return data;
+    })
+    .then((data) => {
+      attachRowIds(data.rows, data.row_ids);
+      originalRows = originalRows.concat(data.rows);
+      window.lastResults.rows = window.lastResults.rows.concat(data.rows);
+      sortState = { index: null, dir: null };
+      renderTable(originalRows);
+      if (data.next_cursor) {
+        btn.dataset.cursor = data.next_cursor;
+        btn.disabled = false;
+      } else {
+        btn.remove();
+      }
+    })
+    .catch((err) => {
+      btn.textContent = err.error || "Failed to load more rows";
+    });
 }
 
 function showError(err) {
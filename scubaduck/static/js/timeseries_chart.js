@@ -1,6 +1,33 @@
 let resizeObserver = null;
 let currentChart = null;
 
+// Space left of the plot for the y axis labels, and right of it.
+const PLOT_MARGIN_LEFT = 50;
+const PLOT_MARGIN_RIGHT = 10;
+// Width of #legend including its margin, used before a chart was drawn.
+const LEGEND_WIDTH = 160;
+
+// Return the width the plot will get when a chart is drawn in the view, so
+// the server can pick a bucket size that fits it.
+function plotWidth(view) {
+  const style = getComputedStyle(view);
+  let width =
+    view.clientWidth -
+    parseFloat(style.paddingLeft) -
+    parseFloat(style.paddingRight);
+  const legend = document.getElementById('legend');
+  if (legend && view.contains(legend)) {
+    const legendStyle = getComputedStyle(legend);
+    width -=
+      legend.offsetWidth +
+      parseFloat(legendStyle.marginLeft) +
+      parseFloat(legendStyle.marginRight);
+  } else {
+    width -= LEGEND_WIDTH;
+  }
+  return width - PLOT_MARGIN_LEFT - PLOT_MARGIN_RIGHT;
+}
+
 function showTimeSeries(data) {
   function parseTs(s) {
     if (s.match(/GMT/) || s.endsWith('Z') || /\+\d{2}:?\d{2}$/.test(s)) {
@@ -32,15 +59,19 @@ function showTimeSeries(data) {
   const hasHits = document.getElementById('show_hits').checked ? 1 : 0;
   const fill = document.getElementById('fill').value;
   const bucketMs = (data.bucket_size || 3600) * 1000;
-  const start = data.start ? parseTs(data.start) : null;
+  // Buckets are aligned to absolute multiples of the bucket size, so the
+  // first one may begin before the requested start.
+  const start = data.start
+    ? Math.floor(parseTs(data.start) / bucketMs) * bucketMs
+    : null;
   const end = data.end ? parseTs(data.end) : null;
   const startIdx = 1 + groups.length + hasHits;
   let valueCols = selectedColumns.slice(groups.length + hasHits);
-  if (
-    valueCols.length === 0 &&
-    document.getElementById('aggregate').value.toLowerCase() === 'count'
-  ) {
-    valueCols = ['Count'];
+  if (document.getElementById('aggregate').value.toLowerCase() === 'count') {
+    // Count queries return the row count followed by the derived columns.
+    valueCols = ['Count'].concat(
+      valueCols.filter(c => derivedColumns.some(dc => dc.include && dc.name === c))
+    );
   }
   const series = {};
   data.rows.forEach(r => {
@@ -283,7 +314,8 @@ function showTimeSeries(data) {
     let colorIndex = 0;
     const xRange = maxX - minX || 1;
     const yRange = maxY - minY || 1;
-    const xScale = x => ((x - minX) / xRange) * (width - 60) + 50;
+    const plot = width - PLOT_MARGIN_LEFT - PLOT_MARGIN_RIGHT;
+    const xScale = x => ((x - minX) / xRange) * plot + PLOT_MARGIN_LEFT;
     const yScale = y => height - 30 - ((y - minY) / yRange) * (height - 60);
     const grid = document.createElementNS('http://www.w3.org/2000/svg', 'g');
     svg.appendChild(grid);
@@ -399,7 +431,7 @@ function showTimeSeries(data) {
     const intv = chooseInterval(minX, maxX);
     const ticks = generateTicks(minX, maxX, intv);
     const lu = labelUnit(intv);
-    const rotate = ticks.length > 0 && (width - 60) / ticks.length < 60;
+    const rotate = ticks.length > 0 && plot / ticks.length < 60;
     const axis = document.createElementNS('http://www.w3.org/2000/svg', 'g');
     const axisLine = document.createElementNS('http://www.w3.org/2000/svg', 'line');
     axisLine.setAttribute('x1', xScale(minX));
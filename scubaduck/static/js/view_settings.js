@@ -458,10 +458,11 @@ function updateSelectedColumns(type = graphTypeSel.value) {
       base.forEach(c => {
         if (!selectedColumns.includes(c)) selectedColumns.push(c);
       });
-      derivedColumns.forEach(dc => {
-        if (dc.include && !selectedColumns.includes(dc.name)) selectedColumns.push(dc.name);
-      });
     }
+    // Derived columns are returned for every aggregate, counted under Count.
+    derivedColumns.forEach(dc => {
+      if (dc.include && !selectedColumns.includes(dc.name)) selectedColumns.push(dc.name);
+    });
   } else {
     selectedColumns = base.slice();
     derivedColumns.forEach(dc => {
@@ -605,6 +606,7 @@ function addDerived(data = {}) {
         <option value="numeric">Numeric</option>
       </select>
       <input class="d-name" type="text">
+      <button type="button" class="materialize" title="Store on table" onclick="materializeDerived(this)">Store</button>
       <button type="button" class="remove" onclick="removeDerived(this)">✖</button>
     </div>
     <label><input type="checkbox" class="d-use" checked> Include in Query</label>
@@ -639,6 +641,18 @@ function removeDerived(btn) {
   refreshDerivedColumns();
 }
 
+function materializeDerived(btn) {
+  const d = derivedColumns.find(d => d.el === btn.closest('.derived'));
+  if (!d) return;
+  const body = {table: document.getElementById('table').value, name: d.name, expr: d.expr};
+  fetch('/api/materialized', {method:'POST', headers:{'Content-Type':'application/json'}, body:JSON.stringify(body)})
+    .then(async r => {
+      const data = await r.json();
+      btn.title = r.ok ? 'Stored on table' : data.error;
+      btn.classList.toggle('stored', r.ok);
+    });
+}
+
 function refreshDerivedColumns() {
   allColumns.splice(0, allColumns.length, ...baseColumns);
   stringColumns.splice(0, stringColumns.length, ...baseStringColumns);
@@ -665,18 +679,71 @@ function refreshDerivedColumns() {
 let lastQueryTime = 0;
 let queryStart = 0;
 
-function dive(push=true) {
-  const params = collectParams();
-  if (push) {
-    history.pushState(params, '', paramsToSearch(params));
-  }
+function queryPayload(params) {
   const payload = Object.assign({}, params);
   const dcMap = {};
   (params.derived_columns || []).forEach(d => {
     if (d.include) dcMap[d.name] = d.expr;
   });
   payload.derived_columns = dcMap;
+  return payload;
+}
+
+function exportResults() {
+  const payload = queryPayload(collectParams());
+  if (payload.graph_type === 'samples') {
+    // Export every matching row, not just the first page.
+    delete payload.limit;
+  }
+  const format = document.getElementById('export_format').value;
+  const url = '/api/export?format=' + encodeURIComponent(format);
+  const btn = document.getElementById('export_button');
+  btn.disabled = true;
+  // Check the query first: once the download has started the browser has no
+  // way to show an error, but the file itself is streamed straight to disk.
+  fetch(url + '&check=1', {
+    method: 'POST',
+    headers: {'Content-Type': 'application/json'},
+    body: JSON.stringify(payload),
+  })
+    .then(async r => {
+      if (!r.ok) throw await r.json();
+      const form = document.createElement('form');
+      form.method = 'POST';
+      form.action = url;
+      const field = document.createElement('input');
+      field.type = 'hidden';
+      field.name = 'payload';
+      field.value = JSON.stringify(payload);
+      form.appendChild(field);
+      document.body.appendChild(form);
+      form.submit();
+      form.remove();
+    })
+    .catch(err => {
+      showError(err);
+    })
+    .finally(() => {
+      btn.disabled = false;
+    });
+}
+
+function dive(push=true) {
+  const params = collectParams();
+  if (push) {
+    history.pushState(params, '', paramsToSearch(params));
+  }
+  const payload = queryPayload(params);
   const view = document.getElementById('view');
+  if (params.graph_type === 'timeseries') {
+    const width = plotWidth(view);
+    if (width > 0) payload.chart_width = Math.round(width);
+  }
+  if (params.graph_type === 'samples') {
+    // Ask for a cursor so further pages can be fetched on demand.
+    payload.cursor = null;
+  }
+  lastQueryPayload = payload;
   view.innerHTML = '<p>Loading...</p>';
   window.lastResults = undefined;
   queryStart = performance.now();
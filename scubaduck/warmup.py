@@ -0,0 +1,87 @@
+"""Prime the server's caches in the background after startup.
+
+The first queries against a cold server pay for loading column metadata,
+time bounds, typeahead values and the landing page results.  The server
+builds a list of tasks doing that work and :class:`Warmup` runs them on a
+background thread; ``/api/ready`` reports its progress.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+import traceback
+from typing import Any, Callable
+
+Task = tuple[str, Callable[[], None]]
+
+
+class Warmup:
+    """Run a list of cache priming tasks on a background thread.
+
+    Tasks run in order; a failing task is recorded and skipped so that one
+    bad table doesn't keep the rest of the caches cold.
+    """
+
+    def __init__(self, tasks: list[Task]) -> None:
+        self.tasks = tasks
+        self._done = 0
+        self._current: str | None = None
+        self._errors: list[dict[str, str]] = []
+        self._started = 0.0
+        self._finished: float | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._started = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        for name, task in self.tasks:
+            if self._stop.is_set():
+                break
+            with self._lock:
+                self._current = name
+            try:
+                task()
+            except Exception as exc:
+                traceback.print_exc()
+                with self._lock:
+                    self._errors.append({"task": name, "error": str(exc)})
+            with self._lock:
+                self._done += 1
+        with self._lock:
+            self._current = None
+            self._finished = time.time()
+
+    def stop(self) -> None:
+        """Skip the remaining tasks and wait for the current one."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until warmup has finished; returns whether it did."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.ready
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return self._finished is not None
+
+    def status(self) -> dict[str, Any]:
+        with self._lock:
+            end = self._finished if self._finished is not None else time.time()
+            return {
+                "ready": self._finished is not None,
+                "done": self._done,
+                "total": len(self.tasks),
+                "current": self._current,
+                "errors": list(self._errors),
+                "elapsed": end - self._started if self._started else 0.0,
+            }
@@ -3,13 +3,22 @@ from __future__ import annotations
 from typing import Any, Mapping, Sequence
 from os import PathLike
 
+class Error(Exception): ...
+class IOException(Error): ...
+
 class DuckDBPyRelation:
     def fetchall(self) -> list[tuple[Any, ...]]: ...
+    def fetchmany(self, size: int = ...) -> list[tuple[Any, ...]]: ...
 
 class DuckDBPyConnection:
     def execute(
         self, query: str, parameters: Sequence[Any] | Mapping[str, Any] | None = ...
     ) -> DuckDBPyRelation: ...
+    def executemany(
+        self, query: str, parameters: Sequence[Sequence[Any]] = ...
+    ) -> DuckDBPyConnection: ...
+    def cursor(self) -> DuckDBPyConnection: ...
+    def close(self) -> None: ...
 
 def connect(
     database: str | PathLike[str] | None = ...,
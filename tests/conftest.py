@@ -1,12 +1,26 @@
 from __future__ import annotations
 
+import os
+import tempfile
 import threading
 from collections.abc import Iterator
+from pathlib import Path
 
 import pytest
 from werkzeug.serving import make_server
 
-from scubaduck.server import app
+# Keep the saved queries of the tests out of the user's config directory.
+os.environ["SCUBADUCK_CONFIG_DIR"] = tempfile.mkdtemp(prefix="scubaduck-config-")
+
+from scubaduck.server import app  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def config_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """A config directory of the test's own, so saved queries don't leak."""
+    path = tmp_path / "config"
+    monkeypatch.setenv("SCUBADUCK_CONFIG_DIR", str(path))
+    return path
 
 
 @pytest.fixture()
@@ -20,3 +34,16 @@ def server_url() -> Iterator[str]:
     finally:
         httpd.shutdown()
         thread.join()
+
+
+@pytest.fixture()
+def events_csv(tmp_path: Path) -> Path:
+    """A small ``events`` table in a CSV file the test may modify."""
+    csv_file = tmp_path / "events.csv"
+    csv_file.write_text(
+        "timestamp,user,value\n"
+        "2024-01-01 00:00:00,alice,10\n"
+        "2024-01-01 01:00:00,bob,20\n"
+        "2024-01-01 02:00:00,alice,30\n"
+    )
+    return csv_file
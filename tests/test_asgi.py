@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any
+
+import pytest
+
+from scubaduck import server
+from scubaduck.asgi import AsgiApp, Message
+from scubaduck.saved_queries import SavedQueries
+
+QUERY: dict[str, Any] = {
+    "table": "events",
+    "start": "2024-01-01 00:00:00",
+    "end": "2024-01-02 00:00:00",
+    "order_by": "timestamp",
+    "limit": 10,
+    "columns": ["timestamp", "event"],
+}
+
+
+def _scope(method: str, path: str, query_string: bytes = b"") -> dict[str, Any]:
+    return {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "path": path,
+        "query_string": query_string,
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("127.0.0.1", 8000),
+    }
+
+
+async def _request(
+    app: AsgiApp, method: str, path: str, body: bytes = b"", query: bytes = b""
+) -> tuple[int, dict[str, str], bytes]:
+    sent: list[Message] = []
+    requests = [{"type": "http.request", "body": body}]
+
+    async def receive() -> Message:
+        if requests:
+            return requests.pop()
+        await asyncio.Event().wait()
+        raise AssertionError("unreachable")
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    await app(_scope(method, path, query), receive, send)
+    start = sent[0]
+    headers = {k.decode(): v.decode() for k, v in start["headers"]}
+    assert not sent[-1].get("more_body", False)
+    return start["status"], headers, b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def test_routes_served_through_asgi() -> None:
+    asgi = AsgiApp(server.create_app())
+    status, _, body = asyncio.run(_request(asgi, "GET", "/api/tables"))
+    assert status == 200
+    assert json.loads(body) == ["events"]
+
+    status, _, body = asyncio.run(
+        _request(asgi, "POST", "/api/query", json.dumps(QUERY).encode())
+    )
+    assert status == 200
+    expected = asgi.app.test_client().post("/api/query", json=QUERY).get_json()
+    assert json.loads(body)["rows"] == expected["rows"]
+
+    status, headers, body = asyncio.run(
+        _request(asgi, "POST", "/api/export", json.dumps(QUERY).encode(), b"format=csv")
+    )
+    assert status == 200
+    assert headers["content-type"].startswith("text/csv")
+    assert body.startswith(b"timestamp,")
+    asgi.close()
+
+
+@pytest.mark.parametrize("resave", [False, True])
+def test_saved_query_events_pushed_after_refresh(resave: bool) -> None:
+    asgi = AsgiApp(server.create_app())
+    saved: SavedQueries = asgi.app.extensions["scubaduck_saved_queries"]
+    saved.save("recent", QUERY, refresh_interval=3600)
+
+    async def subscribe() -> list[Message]:
+        sent: list[Message] = []
+        disconnect = asyncio.Event()
+
+        async def receive() -> Message:
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message: Message) -> None:
+            sent.append(message)
+            if message.get("body"):
+                events = [m for m in sent if m.get("body")]
+                if len(events) == 1 and resave:
+                    # Saving again replaces the query object.
+                    await asyncio.to_thread(saved.save, "recent", QUERY, 1800)
+                elif len(events) == 1:
+                    await asyncio.to_thread(saved.refresh, saved.load("recent"))
+                else:
+                    disconnect.set()
+
+        scope = _scope("GET", "/api/saved/recent/events")
+        await asyncio.wait_for(asgi(scope, receive, send), 30)
+        return sent
+
+    sent = asyncio.run(subscribe())
+    assert sent[0]["status"] == 200
+    assert (b"content-type", b"text/event-stream") in sent[0]["headers"]
+    events = [m["body"].decode() for m in sent[1:]]
+    assert len(events) == 2
+    runs: list[int] = []
+    for event in events:
+        assert event.startswith("event: result\ndata: ")
+        data = json.loads(event.split("data: ", 1)[1])
+        assert len(data["rows"]) == 3
+        runs.append(data["saved"]["runs"])
+    assert runs == ([1, 1] if resave else [1, 2])
+
+    status, _, _ = asyncio.run(_request(asgi, "GET", "/api/saved/missing/events"))
+    assert status == 404
+    asgi.close()
@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from scubaduck.cli import build_app, load_options
+
+
+def test_options_from_config_file_and_flags(tmp_path: Path) -> None:
+    config = tmp_path / "scubaduck.toml"
+    config.write_text('threads = 2\nmemory-limit = "1GB"\nwarmup = false\n')
+    options = load_options(
+        ["serve", "events.csv", "--config", str(config), "--threads", "3"]
+    )
+    assert options["db"] == "events.csv"
+    assert options["threads"] == 3
+    assert options["memory_limit"] == "1GB"
+    assert options["warmup"] is False
+
+
+def test_build_app_times_first_query(tmp_path: Path) -> None:
+    csv_file = tmp_path / "events.csv"
+    csv_file.write_text("timestamp,value\n2024-01-01 00:00:00,1\n")
+    landing = tmp_path / "landing.json"
+    landing.write_text(json.dumps([{"table": "events"}]))
+    options = load_options(
+        [
+            "serve",
+            str(csv_file),
+            "--threads",
+            "2",
+            "--result-cache-size",
+            "5",
+            "--no-warmup",
+            "--landing-queries",
+            str(landing),
+        ]
+    )
+    app, timings = build_app(options)
+    assert app.config["SCUBADUCK_THREADS"] == 2
+    assert app.config["SCUBADUCK_RESULT_CACHE_SIZE"] == 5
+    assert app.config["SCUBADUCK_LANDING_QUERIES"] == [{"table": "events"}]
+    assert app.extensions["scubaduck_warmup"].status()["total"] == 0
+    assert 0 < timings["load"] <= timings["first_query"]
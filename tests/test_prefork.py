@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+from scubaduck import server
+
+
+def test_snapshot_served_read_only(tmp_path: Path) -> None:
+    csv_file = tmp_path / "events.csv"
+    csv_file.write_text("timestamp,value\n2024-01-01 00:00:00,1\n")
+    snapshot = server.prepare_snapshot(str(csv_file), tmp_path / "snapshot.duckdb")
+    app = server.create_app(snapshot, config={"SCUBADUCK_READ_ONLY": True})
+    client = app.test_client()
+    rv = client.post("/api/query", json={"table": "events", "columns": ["value"]})
+    assert rv.get_json()["rows"] == [[1]]
+    rv = client.post(
+        "/api/materialized",
+        json={"table": "events", "name": "double", "expr": "value * 2"},
+    )
+    assert rv.status_code == 400
+    assert "read-only" in rv.get_json()["error"]
+
+    # The snapshot is only rebuilt once the source changes.
+    inode = snapshot.stat().st_ino
+    assert server.prepare_snapshot(str(csv_file), snapshot).stat().st_ino == inode
+    os.utime(csv_file, ns=(0, snapshot.stat().st_mtime_ns + 1))
+    assert server.prepare_snapshot(str(csv_file), snapshot).stat().st_ino != inode
+    # DuckDB databases are opened in place.
+    assert server.prepare_snapshot(str(snapshot)) == snapshot
+
+
+def test_workers_serve_from_shared_snapshot(tmp_path: Path) -> None:
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "scubaduck.cli",
+            "serve",
+            "TEST",
+            "--workers",
+            "2",
+            "--port",
+            "0",
+            "--snapshot",
+            str(tmp_path / "snapshot.duckdb"),
+            "--cache-dir",
+            str(tmp_path / "cache"),
+            "--no-warmup",
+        ],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert proc.stderr is not None
+        line = proc.stderr.readline()
+        assert line.startswith("Serving on "), line
+        url = line.split()[2]
+        payload = json.dumps(
+            {"table": "events", "columns": ["id"], "time_column": ""}
+        ).encode()
+        for _ in range(4):
+            req = urllib.request.Request(
+                f"{url}/api/query",
+                data=payload,
+                headers={"Content-Type": "application/json"},
+            )
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                assert json.load(resp)["rows"] == [[1], [2]]
+        # The startup probe and the query, each stored once for both.  The
+        # results are written in the background.
+        deadline = time.monotonic() + 30
+        entries = 0
+        while entries != 2 and time.monotonic() < deadline:
+            with urllib.request.urlopen(f"{url}/api/admin/cache", timeout=30) as resp:
+                entries = json.load(resp)["disk"]["entries"]
+            time.sleep(0.05)
+        assert entries == 2
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(30)
+    assert proc.returncode == 0
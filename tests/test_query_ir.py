@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from typing import Any
+
+from scubaduck.query_ir import Filter, QueryParams, canonicalize, fingerprint
+
+
+def test_canonical_filters_sorted_and_deduplicated() -> None:
+    a = QueryParams(
+        filters=[
+            Filter("user", "=", ["bob", "alice", "bob"]),
+            Filter("event", "contains", "log"),
+            Filter("value", ">", 5),
+            Filter("event", "contains", "log"),
+            Filter("user", "=", None),
+        ]
+    )
+    b = QueryParams(
+        filters=[
+            Filter("value", ">", 5),
+            Filter("user", "=", ["alice", "bob"]),
+            Filter("event", "contains", "log"),
+        ]
+    )
+    ca = canonicalize(a)
+    assert ca.filters == canonicalize(b).filters
+    assert Filter("user", "=", ["alice", "bob"]) in ca.filters
+    assert len(ca.filters) == 3
+    assert fingerprint(a) == fingerprint(b)
+
+
+def test_equality_filters_intersected() -> None:
+    params = QueryParams(
+        filters=[
+            Filter("user", "=", ["alice", "bob"]),
+            Filter("user", "=", ["bob", "charlie"]),
+        ]
+    )
+    assert canonicalize(params).filters == [Filter("user", "=", "bob")]
+
+    disjoint = QueryParams(
+        filters=[Filter("user", "=", "alice"), Filter("user", "=", "bob")]
+    )
+    assert len(canonicalize(disjoint).filters) == 2
+
+
+def test_time_filters_folded_into_range() -> None:
+    params = QueryParams(
+        start="2024-01-01 00:00:00",
+        end="2024-01-03 00:00:00",
+        filters=[
+            Filter("timestamp", ">=", "2024-01-02"),
+            Filter("timestamp", "<=", "2024-01-05 00:00:00"),
+        ],
+    )
+    canon = canonicalize(params)
+    assert canon.start == "2024-01-02 00:00:00"
+    assert canon.end == "2024-01-03 00:00:00"
+    assert canon.filters == []
+
+
+def test_fingerprint_ignores_presentation_options() -> None:
+    a = QueryParams(
+        graph_type="timeseries",
+        granularity="Auto",
+        chart_width=800,
+        bucket_size=3600,
+        fill="blank",
+        show_hits=True,
+        aggregate="Count",
+    )
+    b = QueryParams(
+        graph_type="timeseries",
+        granularity="1 hour",
+        bucket_size=3600,
+        aggregate="count",
+    )
+    assert fingerprint(a) == fingerprint(b)
+    assert fingerprint(a) != fingerprint(QueryParams(graph_type="timeseries"))
+
+
+def test_inequality_filters_unioned() -> None:
+    params = QueryParams(
+        filters=[
+            Filter("user", "!=", "bob"),
+            Filter("user", "!=", ["alice", "bob"]),
+        ]
+    )
+    assert canonicalize(params).filters == [Filter("user", "!=", ["alice", "bob"])]
+
+
+def test_filters_with_mixed_value_types() -> None:
+    # JSON payloads can mix numbers and strings in a list.
+    mixed: list[Any] = ["1", 2]
+    params = QueryParams(
+        filters=[
+            Filter("value", "=", 1),
+            Filter("value", "=", mixed),
+            Filter("user", "!=", mixed),
+            Filter("user", "!=", "bob"),
+        ]
+    )
+    filters = canonicalize(params).filters
+    assert Filter("value", "=", 1) in filters
+    ne = [f.value for f in filters if f.op == "!="]
+    assert ne == [["1", "bob", 2]]
+
+
+def test_numeric_time_filters_not_folded() -> None:
+    params = QueryParams(
+        filters=[
+            Filter("timestamp", ">=", "20240101"),
+            Filter("timestamp", "<=", "5"),
+        ],
+    )
+    canon = canonicalize(params)
+    assert canon.start is None and canon.end is None
+    assert len(canon.filters) == 2
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+
+import pytest
+
+from scubaduck import server
+from scubaduck.admission import AdmissionController, Overloaded
+
+
+def _queued(controller: AdmissionController) -> int:
+    return sum(c["queued"] for c in controller.status()["classes"].values())
+
+
+def _enqueue(
+    controller: AdmissionController, priority: str, client: str, order: list[str]
+) -> threading.Thread:
+    """Queue a request on a thread that records when it's admitted."""
+    before = _queued(controller)
+
+    def run() -> None:
+        with controller.admit(priority, client):
+            order.append(f"{priority}:{client}")
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    while _queued(controller) == before:
+        time.sleep(0.001)
+    return thread
+
+
+def test_higher_priority_admitted_first() -> None:
+    controller = AdmissionController(max_concurrent=1)
+    order: list[str] = []
+    held = controller.acquire("interactive", "a")
+    threads = [
+        _enqueue(controller, p, "b", order)
+        for p in ["background", "heavy", "interactive"]
+    ]
+    controller.release(held)
+    for t in threads:
+        t.join()
+    assert order == ["interactive:b", "heavy:b", "background:b"]
+
+
+def test_client_with_fewest_running_requests_goes_first() -> None:
+    controller = AdmissionController(max_concurrent=2)
+    order: list[str] = []
+    first = controller.acquire("interactive", "x")
+    second = controller.acquire("interactive", "x")
+    threads = [_enqueue(controller, "interactive", c, order) for c in ["x", "y"]]
+    # "x" queued first, but already has a request running.
+    controller.release(first)
+    for t in threads:
+        t.join()
+    assert order == ["interactive:y", "interactive:x"]
+    controller.release(second)
+
+
+def test_request_shed_after_wait_budget() -> None:
+    controller = AdmissionController(max_concurrent=1, budgets={"interactive": 0.05})
+    held = controller.acquire("interactive", "a")
+    with pytest.raises(Overloaded):
+        controller.acquire("interactive", "b")
+    controller.release(held)
+    status = controller.status()
+    assert status["classes"]["interactive"]["shed"] == 1
+    assert status["classes"]["interactive"]["queued"] == 0
+    assert status["running"] == 0
+
+
+def test_overloaded_query_returns_429() -> None:
+    app = server.create_app()
+    app.extensions["scubaduck_warmup"].wait(10)
+    controller: AdmissionController = app.extensions["scubaduck_admission"]
+    client = app.test_client()
+    held = controller.acquire("interactive", "other")
+    controller.max_concurrent = 1
+    controller.budgets["interactive"] = 0.05
+    rv = client.post(
+        "/api/query",
+        data=json.dumps({"table": "events"}),
+        content_type="application/json",
+    )
+    assert rv.status_code == 429
+    assert rv.headers["Retry-After"] == "1"
+    controller.release(held)
+
+    rv = client.post(
+        "/api/query",
+        data=json.dumps({"table": "events"}),
+        content_type="application/json",
+        headers={"X-Scubaduck-Client": "me"},
+    )
+    assert rv.status_code == 200
+    status = client.get("/api/admin/admission").get_json()
+    assert status["classes"]["interactive"]["shed"] == 1
+    assert status["running"] == 0
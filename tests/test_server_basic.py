@@ -1,6 +1,9 @@
 from __future__ import annotations
 
 import json
+from typing import Any
+
+import pytest
 
 from scubaduck import server
 
@@ -62,6 +65,68 @@ def test_filter_multi_token() -> None:
     assert rows[-1][3] == "charlie"
 
 
+def test_filter_list_compiles_to_in() -> None:
+    app = server.app
+    client = app.test_client()
+    payload = {
+        "table": "events",
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-03 00:00:00",
+        "order_by": "timestamp",
+        "columns": ["timestamp", "user"],
+        "filters": [{"column": "user", "op": "!=", "value": ["alice", "bob"]}],
+    }
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    data = rv.get_json()
+    assert rv.status_code == 200
+    assert "\"user\" NOT IN ('alice', 'bob')" in data["sql"]
+    assert [r[1] for r in data["rows"]] == ["charlie"]
+
+
+def test_large_filter_list_uses_value_table(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(server, "IN_LIST_TABLE_THRESHOLD", 2)
+    app = server.create_app()
+    client = app.test_client()
+    base = {
+        "table": "events",
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-03 00:00:00",
+        "order_by": "timestamp",
+        "columns": ["timestamp", "user", "value"],
+    }
+    users = ["alice", "charlie", "dave", "it's"]
+    rv = client.post(
+        "/api/query",
+        data=json.dumps(
+            {**base, "filters": [{"column": "user", "op": "=", "value": users}]}
+        ),
+        content_type="application/json",
+    )
+    data = rv.get_json()
+    assert rv.status_code == 200
+    assert "IN (SELECT value FROM" in data["sql"]
+    assert [r[1] for r in data["rows"]] == ["alice", "alice", "charlie"]
+
+    rv = client.post(
+        "/api/query",
+        data=json.dumps(
+            {
+                **base,
+                "filters": [
+                    {"column": "value", "op": "!=", "value": ["10", "20", "30"]}
+                ],
+            }
+        ),
+        content_type="application/json",
+    )
+    data = rv.get_json()
+    assert rv.status_code == 200
+    assert "NOT IN (SELECT value FROM" in data["sql"]
+    assert [r[2] for r in data["rows"]] == [40]
+
+
 def test_empty_filter_is_noop() -> None:
     app = server.app
     client = app.test_client()
@@ -164,3 +229,102 @@ def test_order_by_ignored_when_not_selected() -> None:
     data = rv.get_json()
     assert rv.status_code == 200
     assert "ORDER BY" not in data["sql"]
+
+
+def _page(client: Any, payload: dict[str, Any]) -> Any:
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    return rv.get_json()
+
+
+@pytest.mark.parametrize("order_dir", ["ASC", "DESC"])
+def test_samples_keyset_pagination(order_dir: str) -> None:
+    client = server.app.test_client()
+    payload: dict[str, Any] = {
+        "table": "events",
+        "columns": ["timestamp", "user"],
+        "order_by": "user",
+        "order_dir": order_dir,
+        "limit": 2,
+        "cursor": None,
+    }
+    seen: list[list[Any]] = []
+    pages = 0
+    while True:
+        data = _page(client, payload)
+        seen.extend(data["rows"])
+        pages += 1
+        if "next_cursor" not in data:
+            break
+        payload["cursor"] = data["next_cursor"]
+    users = [r[1] for r in seen]
+    assert sorted(users, reverse=order_dir == "DESC") == users
+    assert len(seen) == 4 and all(len(r) == 2 for r in seen)
+    assert pages == 3
+
+
+def test_samples_invalid_cursor() -> None:
+    client = server.app.test_client()
+    rv = client.post(
+        "/api/query",
+        data=json.dumps({"table": "events", "cursor": "nope"}),
+        content_type="application/json",
+    )
+    assert rv.status_code == 400
+    assert rv.get_json()["error"] == "Invalid cursor"
+
+
+def test_samples_row_detail() -> None:
+    client = server.app.test_client()
+    payload = {
+        "table": "events",
+        "columns": ["user"],
+        "order_by": "user",
+        "limit": 10,
+        "cursor": None,
+    }
+    data = _page(client, payload)
+    assert data["rows"] == [["alice"], ["alice"], ["bob"], ["charlie"]]
+    row_id = data["row_ids"][2]
+
+    rv = client.get(f"/api/row?table=events&rowid={row_id}")
+    detail = rv.get_json()["columns"]
+    assert [c["name"] for c in detail] == ["timestamp", "event", "value", "user"]
+    assert detail[3]["value"] == "bob"
+
+    assert client.get("/api/row?table=events&rowid=999").status_code == 404
+    assert client.get("/api/row?table=events").status_code == 400
+
+
+def test_samples_no_columns_returns_all_columns() -> None:
+    client = server.app.test_client()
+    payload = {"table": "events", "order_by": "timestamp", "limit": 10}
+    expected = _page(client, payload)["rows"]
+    data = _page(client, {**payload, "cursor": None})
+    assert data["rows"] == expected
+    assert len(data["rows"]) == 4 and len(data["rows"][0]) == 4
+    assert len(data["row_ids"]) == 4
+
+
+def test_response_budget_truncates() -> None:
+    app = server.create_app()
+    app.config["SCUBADUCK_MAX_ROWS"] = 2
+    client = app.test_client()
+    payload = {"table": "events", "columns": ["user"], "order_by": "user"}
+    data = _page(client, payload)
+    assert data["rows"] == [["alice"], ["alice"]]
+    assert data["truncated"] is True
+    assert data["total_rows"] == 4
+
+    app.config["SCUBADUCK_MAX_ROWS"] = None
+    app.config["SCUBADUCK_MAX_BYTES"] = 20
+    data = _page(client, {**payload, "cursor": None})
+    assert len(data["rows"]) < 4
+    assert data["total_rows"] == 4
+    assert "next_cursor" in data
+
+    app.config["SCUBADUCK_MAX_BYTES"] = None
+    data = _page(client, payload)
+    assert len(data["rows"]) == 4
+    assert "truncated" not in data
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import json
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from typing import Any
+from uuid import UUID
+
+from scubaduck import server
+from scubaduck.disk_cache import DiskCache
+
+QUERY: dict[str, Any] = {
+    "table": "events",
+    "start": "2024-01-01 00:00:00",
+    "end": "2024-01-03 00:00:00",
+    "graph_type": "timeseries",
+    "granularity": "1 hour",
+    "group_by": ["user"],
+    "aggregate": "Sum",
+    "columns": ["value"],
+}
+
+
+def _write_csv(path: Path, extra: str = "") -> None:
+    path.write_text(
+        "timestamp,user,value\n"
+        "2024-01-01 00:00:00,alice,10\n"
+        "2024-01-01 01:00:00,bob,20\n"
+        "2024-01-01 02:00:00,alice,30\n" + extra
+    )
+
+
+def _query(app: Any) -> dict[str, Any]:
+    rv = app.test_client().post(
+        "/api/query", data=json.dumps(QUERY), content_type="application/json"
+    )
+    assert rv.status_code == 200, rv.get_json()
+    return rv.get_json()
+
+
+def test_results_survive_restart(tmp_path: Path) -> None:
+    csv_file = tmp_path / "events.csv"
+    _write_csv(csv_file)
+    cache_dir = tmp_path / "cache"
+    app = server.create_app(csv_file, cache_dir=cache_dir)
+    first = _query(app)
+    assert "cache" not in first
+    # Results are written in the background.
+    app.extensions["scubaduck_results"].store.wait()
+
+    again = _query(server.create_app(csv_file, cache_dir=cache_dir))
+    assert again["cache"] == "disk"
+    assert again["rows"] == first["rows"]
+
+
+def test_changed_data_not_served_from_disk(tmp_path: Path) -> None:
+    csv_file = tmp_path / "events.csv"
+    _write_csv(csv_file)
+    cache_dir = tmp_path / "cache"
+    app = server.create_app(csv_file, cache_dir=cache_dir)
+    _query(app)
+    app.extensions["scubaduck_results"].store.wait()
+
+    _write_csv(csv_file, "2024-01-01 03:00:00,carol,40\n")
+    data = _query(server.create_app(csv_file, cache_dir=cache_dir))
+    assert "cache" not in data
+    assert len(data["rows"]) == 4
+
+
+def test_disk_cache_round_trips_and_evicts(tmp_path: Path) -> None:
+    cache = DiskCache(tmp_path / "cache", max_bytes=10_000)
+    rows = [
+        (datetime(2024, 1, 1), "alice", Decimal("1.50"), None),
+        (datetime(2024, 1, 2), None, Decimal("2"), None),
+    ]
+    assert cache.put("a", rows)
+    assert cache.get("a") == rows
+    assert cache.put("empty", [])
+    assert cache.get("empty") == []
+    assert not cache.put("mixed", [(1,), ("x",)])
+    assert not cache.put("huge", [(os.urandom(64).hex(),) for _ in range(200)])
+
+    # Entries written by one process are visible to another.
+    other = DiskCache(tmp_path / "cache", max_bytes=10_000)
+    assert other.get("a") == rows
+    assert other.put("b", [(1,)])
+    assert cache.get("a") == rows
+    # "empty" is now the least recently used entry and is evicted first.
+    other.max_bytes = other.status()["bytes"] - 1
+    assert other.put("b", [(1,)])
+    assert cache.get("empty") is None
+    assert cache.get("a") == rows
+    assert cache.get("b") == [(1,)]
+
+
+def test_disk_cache_writes_in_background(tmp_path: Path) -> None:
+    cache = DiskCache(tmp_path / "cache")
+    typed = [
+        (1, 2**70, 0.1, float("inf"), True, b"\x00x", 'a\n"b', "", UUID(int=1)),
+        (None, None, None, None, False, None, None, None, None),
+    ]
+    cache.put_later("typed", typed)
+    cache.put_later("interval", [(timedelta(seconds=1, milliseconds=5),)])
+    cache.wait()
+    assert cache.get("typed") == typed
+    assert cache.get("interval") == [(timedelta(seconds=1, milliseconds=5),)]
+    # Parquet can't keep microseconds of intervals.
+    assert not cache.put("micros", [(timedelta(microseconds=1),)])
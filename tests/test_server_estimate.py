@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import duckdb
+
+from scubaduck import server
+from scubaduck.estimate import CostEstimator
+from scubaduck.query_ir import QueryParams
+
+
+GROUPED = {
+    "table": "events",
+    "graph_type": "table",
+    "group_by": ["user"],
+    "aggregate": "Count Distinct",
+    "columns": ["event"],
+}
+
+
+def test_estimate_endpoint() -> None:
+    client = server.app.test_client()
+    data = client.post(
+        "/api/estimate", data=json.dumps(GROUPED), content_type="application/json"
+    ).get_json()
+    assert data["rows_total"] == 4
+    assert data["rows_scanned"] == 4
+    assert data["group_cardinality"] == 3
+    assert data["cost"] == 4 * 4 + 3
+    assert data["max_cost"] is None
+
+    payload = {
+        **GROUPED,
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-01 13:30:00",
+        "filters": [{"column": "user", "op": "=", "value": "alice"}],
+    }
+    data = client.post(
+        "/api/estimate", data=json.dumps(payload), content_type="application/json"
+    ).get_json()
+    # Half of the time range and one of three users.
+    assert data["rows_scanned"] == 1
+
+
+def test_timeseries_estimate_counts_buckets() -> None:
+    client = server.app.test_client()
+    payload = {
+        "table": "events",
+        "graph_type": "timeseries",
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-02 00:00:00",
+        "granularity": "1 hour",
+    }
+    data = client.post(
+        "/api/estimate", data=json.dumps(payload), content_type="application/json"
+    ).get_json()
+    assert data["buckets"] == 24
+
+
+def test_cost_ceiling_rejects() -> None:
+    app = server.create_app()
+    app.config["SCUBADUCK_MAX_COST"] = 10
+    client = app.test_client()
+    rv = client.post(
+        "/api/query", data=json.dumps(GROUPED), content_type="application/json"
+    )
+    assert rv.status_code == 400
+    data = rv.get_json()
+    assert "too expensive" in data["error"]
+    assert data["estimate"]["cost"] == 19
+
+
+def test_cost_ceiling_samples() -> None:
+    app = server.create_app()
+    app.config["SCUBADUCK_MAX_COST"] = 10
+    app.config["SCUBADUCK_COST_ACTION"] = "sample"
+    client = app.test_client()
+    rv = client.post(
+        "/api/query", data=json.dumps(GROUPED), content_type="application/json"
+    )
+    assert rv.status_code == 200
+    data = rv.get_json()
+    assert data["sampled"] == 52.63
+    assert "TABLESAMPLE 52.63% (bernoulli, 42)" in data["sql"]
+
+
+def test_sampled_counts_and_sums_are_scaled(tmp_path: Path) -> None:
+    db = tmp_path / "big.duckdb"
+    con = duckdb.connect(db)
+    con.execute(
+        "CREATE TABLE events AS SELECT TIMESTAMP '2024-01-01' + "
+        "INTERVAL 1 SECOND * range AS timestamp, 1 AS value FROM range(10000)"
+    )
+    con.close()
+    app = server.create_app(db)
+    app.config["SCUBADUCK_MAX_COST"] = 5000
+    app.config["SCUBADUCK_COST_ACTION"] = "sample"
+    client = app.test_client()
+    payload = {
+        "table": "events",
+        "graph_type": "table",
+        "aggregate": "Sum",
+        "columns": ["value"],
+    }
+    data = client.post("/api/query", json=payload).get_json()
+    assert data["sampled"] == 49.99
+    [[hits, total]] = data["rows"]
+    # Bernoulli sampling keeps about half of the rows, scaled back up.
+    assert 9500 < hits < 10500
+    assert abs(total - hits) < 1
+
+
+def test_estimator_follows_table_version() -> None:
+    con = duckdb.connect()
+    con.execute(
+        "CREATE TABLE e AS SELECT CAST(1704067200 + range * 3600 AS INTEGER) AS ts "
+        "FROM range(24)"
+    )
+    con.execute("CREATE VIEW v AS SELECT * FROM e")
+    version = ["1"]
+    estimator = CostEstimator(con, version=lambda table: version[0])
+    # 32-bit epochs are seconds whatever the requested unit.
+    params = QueryParams(
+        table="e",
+        time_column="ts",
+        time_unit="ms",
+        start="2024-01-01 00:00:00",
+        end="2024-01-01 11:30:00",
+    )
+    assert estimator.estimate(params, {"ts": "INTEGER"})["rows_scanned"] == 12
+
+    assert estimator.row_count("v") == 24
+    con.execute("INSERT INTO e SELECT * FROM e")
+    assert estimator.row_count("v") == 24
+    version[0] = "2"
+    assert estimator.row_count("v") == 48
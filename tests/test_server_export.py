@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import duckdb
+
+from scubaduck import server
+
+
+def _export(fmt: str, payload: dict[str, object]) -> tuple[int, bytes, str]:
+    client = server.app.test_client()
+    rv = client.post(
+        f"/api/export?format={fmt}",
+        data=json.dumps(payload),
+        content_type="application/json",
+    )
+    return rv.status_code, rv.data, rv.headers.get("Content-Disposition", "")
+
+
+PAYLOAD: dict[str, object] = {
+    "table": "events",
+    "columns": ["timestamp", "event", "user"],
+    "order_by": "timestamp",
+    "filters": [{"column": "user", "op": "=", "value": "alice"}],
+}
+
+
+def test_export_csv() -> None:
+    status, data, disposition = _export("csv", PAYLOAD)
+    assert status == 200
+    assert 'filename="events.csv"' in disposition
+    lines = data.decode().splitlines()
+    assert lines[0] == "timestamp,event,user"
+    assert lines[1:] == [
+        "2024-01-01 00:00:00,login,alice",
+        "2024-01-02 00:00:00,login,alice",
+    ]
+
+
+def test_export_ndjson() -> None:
+    status, data, _ = _export("ndjson", PAYLOAD)
+    assert status == 200
+    rows = [json.loads(line) for line in data.decode().splitlines()]
+    assert [r["event"] for r in rows] == ["login", "login"]
+
+
+def test_export_parquet(tmp_path: Path) -> None:
+    status, data, _ = _export("parquet", {**PAYLOAD, "cursor": None})
+    assert status == 200
+    out = tmp_path / "out.parquet"
+    out.write_bytes(data)
+    rows = duckdb.connect().execute(f"SELECT * FROM '{out}'").fetchall()
+    assert len(rows) == 2 and len(rows[0]) == 3
+
+
+def test_export_errors() -> None:
+    status, data, _ = _export("xlsx", PAYLOAD)
+    assert status == 400
+    status, data, _ = _export("csv", {**PAYLOAD, "columns": ["nope"]})
+    assert status == 400
+    assert json.loads(data)["error"] == "Unknown column: nope"
+
+    client = server.app.test_client()
+    for form in ({"payload": "{not json"}, {"payload": "[]"}):
+        rv = client.post("/api/export?format=csv", data=form)
+        assert rv.status_code == 400
+        assert rv.get_json()["error"].startswith("Invalid payload")
+    rv = client.post("/api/export?format=csv", data="{not json")
+    assert rv.status_code == 400
+    assert rv.get_json()["error"].startswith("Invalid payload")
+
+
+def test_export_check() -> None:
+    client = server.app.test_client()
+    rv = client.post("/api/export?format=csv&check=1", json=PAYLOAD)
+    assert rv.status_code == 200
+    assert rv.get_json()["sql"].startswith("SELECT")
+
+    bad = {**PAYLOAD, "derived_columns": {"x": "no_such_function(value)"}}
+    rv = client.post("/api/export?format=csv&check=1", json=bad)
+    assert rv.status_code == 400
+    assert "no_such_function" in rv.get_json()["error"]
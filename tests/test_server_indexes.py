@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any
+
+import duckdb
+
+from scubaduck import server
+from scubaduck.indexes import IndexAdvisor
+
+
+def _lookup(client: Any, value: str) -> Any:
+    payload = {
+        "table": "events",
+        "columns": ["timestamp", "user"],
+        "filters": [{"column": "user", "op": "=", "value": value}],
+    }
+    return client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+
+
+def test_index_created_after_threshold(events_csv: Path) -> None:
+    app = server.create_app(events_csv)
+    advisor: IndexAdvisor = app.extensions["scubaduck_indexes"]
+    advisor.threshold = 2
+    client = app.test_client()
+
+    rv = _lookup(client, "alice")
+    assert rv.status_code == 200
+    advisor.wait()
+    status = client.get("/api/admin/indexes").get_json()
+    assert status[0]["column"] == "user"
+    assert status[0]["state"] == "tracking"
+
+    rv = _lookup(client, "bob")
+    assert rv.get_json()["rows"][0][1] == "bob"
+    advisor.wait()
+    status = client.get("/api/admin/indexes").get_json()
+    assert status[0]["state"] == "indexed"
+    assert status[0]["index"] == "scubaduck_idx_events__user"
+
+    rv = _lookup(client, "alice")
+    assert rv.get_json()["rows"][0][1] == "alice"
+
+
+def test_idle_index_dropped(events_csv: Path) -> None:
+    app = server.create_app(events_csv)
+    advisor: IndexAdvisor = app.extensions["scubaduck_indexes"]
+    advisor.threshold = 1
+    client = app.test_client()
+    _lookup(client, "alice")
+    advisor.wait()
+    assert client.get("/api/admin/indexes").get_json()[0]["state"] == "indexed"
+
+    advisor.idle_seconds = -1
+    # What the background scheduler runs, without waiting for a query.
+    advisor.drop_idle()
+    advisor.wait()
+    status = client.get("/api/admin/indexes").get_json()
+    assert status[0]["state"] == "tracking"
+    assert status[0]["index"] is None
+
+
+def test_indexes_disabled_when_read_only(tmp_path: Path) -> None:
+    db_file = tmp_path / "events.duckdb"
+    con = duckdb.connect(db_file)
+    con.execute("CREATE TABLE events (timestamp TIMESTAMP, user VARCHAR)")
+    con.close()
+    app = server.create_app(db_file, config={"SCUBADUCK_READ_ONLY": True})
+    advisor: IndexAdvisor = app.extensions["scubaduck_indexes"]
+    assert not advisor.enabled
+    advisor.threshold = 1
+    assert _lookup(app.test_client(), "alice").status_code == 200
+    assert advisor.status() == []
+
+
+def test_existing_indexes_loaded_and_budgeted(tmp_path: Path) -> None:
+    db_file = tmp_path / "events.duckdb"
+    con = duckdb.connect(db_file)
+    con.execute(
+        "CREATE TABLE events (timestamp TIMESTAMP, request_id VARCHAR, user VARCHAR)"
+    )
+    con.execute("INSERT INTO events VALUES ('2024-01-01 00:00:00', 'a1', 'alice')")
+    con.execute('CREATE INDEX scubaduck_idx_events__user ON events ("user")')
+    con.close()
+
+    app = server.create_app(db_file)
+    advisor: IndexAdvisor = app.extensions["scubaduck_indexes"]
+    advisor.threshold = 1
+    advisor.max_indexes = 1
+    client = app.test_client()
+    status = client.get("/api/admin/indexes").get_json()
+    assert status[0]["column"] == "user"
+    assert status[0]["state"] == "indexed"
+
+    # The loaded index fills the budget.
+    rv = client.post(
+        "/api/query",
+        data=json.dumps(
+            {
+                "table": "events",
+                "filters": [{"column": "request_id", "op": "=", "value": "a1"}],
+            }
+        ),
+        content_type="application/json",
+    )
+    assert rv.status_code == 200
+    advisor.wait()
+    status = {s["column"]: s for s in client.get("/api/admin/indexes").get_json()}
+    assert status["request_id"]["state"] == "tracking"
+
+    advisor.idle_seconds = -1
+    _lookup(client, "alice")
+    advisor.wait()
+    names = advisor.con.execute("SELECT index_name FROM duckdb_indexes()").fetchall()
+    assert names == []
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any
+
+import duckdb
+import pytest
+
+from scubaduck import server
+from scubaduck.json_paths import JsonPaths, json_column_name, parse_json_column
+
+
+def _make_app(tmp_path: Path) -> Any:
+    db_file = tmp_path / "events.duckdb"
+    con = duckdb.connect(db_file)
+    con.execute("CREATE TABLE events (timestamp TIMESTAMP, payload VARCHAR)")
+    docs = [
+        ("2024-01-01 00:00:00", {"route": "/a", "ms": 10}),
+        ("2024-01-01 01:00:00", {"route": "/b", "ms": 20}),
+        ("2024-01-01 02:00:00", {"route": "/a", "ms": 30}),
+    ]
+    for ts, doc in docs:
+        con.execute("INSERT INTO events VALUES (?, ?)", [ts, json.dumps(doc)])
+    con.execute("INSERT INTO events VALUES ('2024-01-01 03:00:00', 'oops')")
+    con.execute("CREATE VIEW events_view AS SELECT * FROM events")
+    con.close()
+    return server.create_app(db_file)
+
+
+def test_json_column_names() -> None:
+    assert json_column_name("payload", "route") == "payload->>$.route"
+    assert json_column_name("payload", "a b") == 'payload->>$."a b"'
+    assert parse_json_column("payload->>$.route") == ("payload", "$.route")
+    assert parse_json_column("payload") is None
+
+
+def test_json_paths_in_column_list(tmp_path: Path) -> None:
+    app = _make_app(tmp_path)
+    client = app.test_client()
+    cols = client.get("/api/columns?table=events").get_json()
+    assert cols == [
+        {"name": "timestamp", "type": "TIMESTAMP"},
+        {"name": "payload", "type": "VARCHAR"},
+        {"name": "payload->>$.ms", "type": "BIGINT"},
+        {"name": "payload->>$.route", "type": "VARCHAR"},
+    ]
+
+
+def test_json_path_query_uses_stored_column(tmp_path: Path) -> None:
+    app = _make_app(tmp_path)
+    client = app.test_client()
+    payload = {
+        "table": "events",
+        "graph_type": "table",
+        "group_by": ["payload->>$.route"],
+        "aggregate": "Sum",
+        "columns": ["payload->>$.ms"],
+        "filters": [{"column": "payload->>$.ms", "op": ">", "value": 5}],
+        "order_by": "payload->>$.route",
+    }
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    data = rv.get_json()
+    assert rv.status_code == 200, data
+    assert data["rows"] == [["/a", 2, 40], ["/b", 1, 20]]
+
+    # The paths are extracted in the background after the first query.
+    paths: JsonPaths = app.extensions["scubaduck_json_paths"]
+    paths.wait()
+    rv = client.post("/api/query", json={**payload, "limit": 10})
+    data = rv.get_json()
+    assert data["rows"] == [["/a", 2, 40], ["/b", 1, 20]]
+    assert "LEFT JOIN" in data["sql"]
+    assert "hash(" not in data["sql"]
+    stored = paths.materialized.stored("events")
+    assert stored is not None
+    assert len(stored.columns) == 2
+    assert all(c.startswith("__scubaduck_") for c in stored.columns.values())
+
+
+def test_failed_json_path_extraction_not_retried(
+    tmp_path: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    app = _make_app(tmp_path)
+    client = app.test_client()
+    payload = {
+        "table": "events_view",
+        "graph_type": "table",
+        "columns": ["payload->>$.route"],
+        "order_by": "timestamp",
+    }
+    paths: JsonPaths = app.extensions["scubaduck_json_paths"]
+    for limit in (10, 20):
+        rv = client.post("/api/query", json={**payload, "limit": limit})
+        assert rv.status_code == 200
+        assert rv.get_json()["rows"] == [["/a"], ["/b"], ["/a"], [None]]
+        paths.wait()
+    status = client.get("/api/admin/json_paths").get_json()
+    assert status["pending"] == []
+    assert len(status["failed"]) == 1
+    assert "not a base table" in status["failed"][0]["error"]
+    assert capsys.readouterr().err.count("Could not extract") == 1
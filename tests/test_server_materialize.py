@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any
+
+import duckdb
+
+from scubaduck import server
+from scubaduck.materialize import MaterializedColumns
+
+
+def test_materialized_column_used_transparently(events_csv: Path) -> None:
+    app = server.create_app(events_csv)
+    client = app.test_client()
+    rv = client.post(
+        "/api/materialized",
+        data=json.dumps({"table": "events", "name": "double", "expr": "value * 2"}),
+        content_type="application/json",
+    )
+    assert rv.status_code == 200
+    status = rv.get_json()
+    assert status[0]["name"] == "double"
+    column = status[0]["column"]
+    assert column.startswith("__scubaduck_")
+
+    cols = client.get("/api/columns?table=events").get_json()
+    assert [c["name"] for c in cols] == ["timestamp", "user", "value"]
+    # The values are kept next to the table, which is left alone.
+    materialized: MaterializedColumns = app.extensions["scubaduck_materialized"]
+    cols = materialized.con.execute("PRAGMA table_info('events')").fetchall()
+    assert [c[1] for c in cols] == ["timestamp", "user", "value"]
+
+    payload = {
+        "table": "events",
+        "columns": ["timestamp", "user"],
+        "derived_columns": {"twice": " value * 2 "},
+        "order_by": "timestamp",
+    }
+    data = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    ).get_json()
+    assert "LEFT JOIN" in data["sql"]
+    # Rows are matched by id; freshness is checked once per table version.
+    assert "hash(" not in data["sql"]
+    assert f'ELSE s."{column}" END AS "twice"' in data["sql"]
+    assert [r[2] for r in data["rows"]] == [20, 40, 60]
+
+    data = client.post(
+        "/api/query",
+        data=json.dumps({"table": "events"}),
+        content_type="application/json",
+    ).get_json()
+    assert all(len(r) == 3 for r in data["rows"])
+
+
+def test_materialized_refresh_only_touches_changed_rows(events_csv: Path) -> None:
+    app = server.create_app(events_csv)
+    client = app.test_client()
+    client.post(
+        "/api/materialized",
+        data=json.dumps({"table": "events", "name": "double", "expr": "value * 2"}),
+        content_type="application/json",
+    )
+    materialized: MaterializedColumns = app.extensions["scubaduck_materialized"]
+    rv = client.post(
+        "/api/materialized/refresh",
+        data=json.dumps({"table": "events"}),
+        content_type="application/json",
+    )
+    assert rv.get_json()["rows_updated"] == 0
+
+    materialized.con.execute("UPDATE events SET value = 25 WHERE user = 'bob'")
+    materialized.con.execute(
+        "INSERT INTO events (timestamp, user, value) "
+        "VALUES ('2024-01-01 03:00:00', 'carol', 5)"
+    )
+    payload: dict[str, Any] = {
+        "table": "events",
+        "columns": ["timestamp", "user"],
+        "derived_columns": {"double": "value * 2"},
+        "order_by": "timestamp",
+    }
+    # Once the table changed, queries evaluate the expression until the
+    # sidecar has been refreshed in the background.
+    data = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    ).get_json()
+    assert "LEFT JOIN" not in data["sql"]
+    assert [r[2] for r in data["rows"]] == [20, 50, 60, 10]
+    materialized.wait()
+    assert materialized.status()[0]["rows_updated"] == 2
+    payload["limit"] = 100
+    data = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    ).get_json()
+    assert "LEFT JOIN" in data["sql"]
+    assert [r[2] for r in data["rows"]] == [20, 50, 60, 10]
+
+    materialized.con.execute("DELETE FROM events WHERE user = 'carol'")
+    rv = client.post(
+        "/api/materialized/refresh",
+        data=json.dumps({"table": "events"}),
+        content_type="application/json",
+    )
+    assert rv.get_json()["rows_updated"] == 0
+
+    # A different query, as deletes don't change the version the result
+    # cache checks.
+    payload["limit"] = 10
+    data = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    ).get_json()
+    assert [r[2] for r in data["rows"]] == [20, 50, 60]
+    sidecar = materialized.stored("events")
+    assert sidecar is not None
+    count = materialized.con.execute(f"SELECT count(*) FROM {sidecar.sidecar}")
+    assert count.fetchall() == [(3,)]
+
+
+def test_materialized_column_drop(events_csv: Path) -> None:
+    app = server.create_app(events_csv)
+    client = app.test_client()
+    client.post(
+        "/api/materialized",
+        data=json.dumps({"table": "events", "name": "double", "expr": "value * 2"}),
+        content_type="application/json",
+    )
+    rv = client.delete(
+        "/api/materialized",
+        data=json.dumps({"table": "events", "name": "double"}),
+        content_type="application/json",
+    )
+    assert rv.get_json() == []
+    materialized: MaterializedColumns = app.extensions["scubaduck_materialized"]
+    tables = materialized.con.execute("SELECT table_name FROM duckdb_tables()")
+    assert [t for (t,) in tables.fetchall() if "values" in t] == []
+
+    rv = client.post(
+        "/api/materialized",
+        data=json.dumps({"table": "events", "name": "x", "expr": "nope"}),
+        content_type="application/json",
+    )
+    assert rv.status_code == 400
+
+
+def test_materialized_read_only_checks_sidecar() -> None:
+    con = duckdb.connect()
+    con.execute("CREATE TABLE t AS SELECT range AS v FROM range(3)")
+    version = ["1"]
+    writer = MaterializedColumns(con, version=lambda table: version[0])
+    writer.save("t", "double", "v * 2")
+    assert writer.stored("t") is not None
+
+    reader = MaterializedColumns(con, version=lambda table: version[0], writable=False)
+    # Nothing is trusted before the sidecar has been checked.
+    assert reader.stored("t") is None
+    reader.wait()
+    assert reader.stored("t") is not None
+
+    con.execute("UPDATE t SET v = 10 WHERE v = 1")
+    version[0] = "2"
+    assert not reader.check("t")
+    assert reader.stored("t") is None
+    assert con.execute("SELECT count(*) FROM __scubaduck_materialized").fetchall() == [
+        (1,)
+    ]
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+
+import duckdb
+import pytest
+
+from scubaduck import server
+from scubaduck.execution import QueryFailed, QueryKilled, QueryPool
+
+QUERY: dict[str, Any] = {
+    "table": "events",
+    "start": "2024-01-01 00:00:00",
+    "end": "2024-01-03 00:00:00",
+    "graph_type": "table",
+    "group_by": ["user"],
+    "aggregate": "Count",
+    "columns": ["value"],
+}
+
+# Joins 10^12 rows, which takes far longer than the tests' budgets.
+RUNAWAY = "SELECT sum(a.range * b.range) FROM range(1000000) a, range(1000000) b"
+
+# Generous enough for the other queries on a busy machine.
+TIMEOUT = 2.0
+
+
+def test_pool_runs_queries_and_replaces_killed_workers(tmp_path: Path) -> None:
+    db = tmp_path / "data.duckdb"
+    con = duckdb.connect(db)
+    con.execute("CREATE TABLE t AS SELECT range AS x FROM range(100000)")
+    con.close()
+    pool = QueryPool(db, workers=2, timeout=TIMEOUT)
+    try:
+        # Large results come back through shared memory.
+        rows, truncated = pool.execute("SELECT x FROM t ORDER BY x")
+        assert len(rows) == 100000 and rows[-1] == (99999,)
+        assert not truncated
+        rows, truncated = pool.execute("SELECT x FROM t ORDER BY x", max_rows=10)
+        assert rows == [(i,) for i in range(10)] and truncated
+        values = [str(i) for i in range(2000)]
+        rows, _ = pool.execute(
+            'SELECT count(*) FROM t WHERE x IN (SELECT value FROM "vals")',
+            {"vals": ("BIGINT", values)},
+        )
+        assert rows == [(2000,)]
+
+        with pytest.raises(QueryFailed, match="nope"):
+            pool.execute("SELECT * FROM nope")
+        with pytest.raises(QueryKilled, match="longer than 2 s"):
+            pool.execute(RUNAWAY)
+        assert pool.execute("SELECT count(*) FROM t")[0] == [(100000,)]
+        # The killed worker's replacement only becomes idle once it's ready.
+        pool.wait_started()
+        status = pool.status()
+        assert status["killed"] == 1
+        assert status["idle"] == 2 and status["starting"] == 0
+        assert pool.execute("SELECT count(*) FROM t")[0] == [(100000,)]
+    finally:
+        pool.close()
+    # Queries fail right away instead of waiting for a worker forever.
+    with pytest.raises(QueryFailed, match="shut down"):
+        pool.execute("SELECT 1")
+
+
+def test_runaway_query_cancelled_without_affecting_others() -> None:
+    app = server.create_app(
+        config={"SCUBADUCK_QUERY_WORKERS": 2, "SCUBADUCK_QUERY_TIMEOUT": TIMEOUT}
+    )
+    client = app.test_client()
+    expected = server.create_app().test_client().post("/api/query", json=QUERY)
+
+    rv = client.post("/api/query", json=QUERY)
+    assert rv.status_code == 200
+    assert rv.get_json()["rows"] == expected.get_json()["rows"]
+
+    slow = {
+        **QUERY,
+        "derived_columns": {"slow": f"({RUNAWAY})"},
+        "columns": ["slow"],
+        "aggregate": "Max",
+    }
+    rv = client.post("/api/query", json=slow)
+    assert rv.status_code == 400
+    assert "cancelled" in rv.get_json()["error"]
+
+    rv = client.post("/api/query", json={**QUERY, "aggregate": "Sum"})
+    assert rv.status_code == 200
+    status = client.get("/api/admin/workers").get_json()
+    assert status["killed"] == 1
+    app.extensions["scubaduck_query_pool"].close()
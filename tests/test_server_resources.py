@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import duckdb
+import pytest
+
+from scubaduck import server
+from scubaduck.resources import ResourceGovernor
+
+
+def test_settings_from_environment(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("SCUBADUCK_MEMORY_LIMIT", "512MB")
+    monkeypatch.setenv("SCUBADUCK_THREADS", "2")
+    monkeypatch.setenv("SCUBADUCK_TEMP_DIRECTORY", str(tmp_path))
+    app = server.create_app()
+    app.extensions["scubaduck_warmup"].wait(10)
+    data = app.test_client().get("/api/admin/resources").get_json()
+    assert data["threads"] == 2
+    assert data["current_threads"] == 2
+    assert data["memory_limit"] == "488.2 MiB"
+    assert data["temp_directory"] == str(tmp_path)
+    assert data["memory_usage"] >= 0
+    assert data["running_queries"] == 0
+
+
+def test_thread_cap_only_applies_while_uncapped_queries_are_idle() -> None:
+    con = duckdb.connect()
+    governor = ResourceGovernor(con, threads=4)
+
+    def threads() -> int:
+        return int(con.execute("SELECT current_setting('threads')").fetchall()[0][0])
+
+    with governor.limit(1):
+        assert threads() == 1
+        with governor.limit(None):
+            assert threads() == 4
+        with governor.limit(8):
+            assert threads() == 4
+        assert threads() == 1
+    assert threads() == 4
+
+
+def test_query_thread_override() -> None:
+    client = server.create_app().test_client()
+    payload = {"table": "events", "threads": 1}
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    assert rv.status_code == 200
+    rv = client.post(
+        "/api/query",
+        data=json.dumps({**payload, "threads": 0}),
+        content_type="application/json",
+    )
+    assert rv.status_code == 400
+    assert "threads" in rv.get_json()["error"]
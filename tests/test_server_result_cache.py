@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any
+
+from scubaduck import server
+from scubaduck.materialize import MaterializedColumns
+
+
+def _post(client: Any, payload: dict[str, Any]) -> dict[str, Any]:
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    assert rv.status_code == 200
+    return rv.get_json()
+
+
+def _fresh(payload: dict[str, Any]) -> dict[str, Any]:
+    return _post(server.create_app().test_client(), payload)
+
+
+def test_coarser_buckets_derived_from_cache() -> None:
+    client = server.create_app().test_client()
+    base: dict[str, Any] = {
+        "table": "events",
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-03 00:00:00",
+        "graph_type": "timeseries",
+        "group_by": ["user"],
+        "aggregate": "Sum",
+        "columns": ["value"],
+        "limit": 100,
+    }
+    fine = _post(client, {**base, "granularity": "1 hour"})
+    assert "cache" not in fine
+    coarse_payload = {**base, "granularity": "1 day"}
+    coarse = _post(client, coarse_payload)
+    assert coarse["cache"] == "derived"
+    assert coarse["rows"] == _fresh(coarse_payload)["rows"]
+
+    again = _post(client, coarse_payload)
+    assert again["cache"] == "exact"
+
+
+def test_group_by_rollup_and_time_slice_derived() -> None:
+    client = server.create_app().test_client()
+    base: dict[str, Any] = {
+        "table": "events",
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-03 00:00:00",
+        "graph_type": "table",
+        "aggregate": "Max",
+        "columns": ["value"],
+        "order_by": "user",
+    }
+    _post(client, {**base, "group_by": ["user", "event"]})
+    rollup_payload = {**base, "group_by": ["user"]}
+    rollup = _post(client, rollup_payload)
+    assert rollup["cache"] == "derived"
+    assert rollup["rows"] == _fresh(rollup_payload)["rows"]
+
+    ts: dict[str, Any] = {
+        "table": "events",
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-03 00:00:00",
+        "graph_type": "timeseries",
+        "granularity": "1 hour",
+        "columns": [],
+    }
+    _post(client, ts)
+    # A narrower range ending on a bucket boundary is a slice of the cache,
+    # but an inclusive end would need the rows at exactly that instant.
+    narrow = {**ts, "end": "2024-01-02 00:00:00"}
+    assert "cache" not in _post(client, narrow)
+
+
+def test_group_key_not_rolled_up_as_value() -> None:
+    client = server.create_app().test_client()
+    base: dict[str, Any] = {
+        "table": "events",
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-03 00:00:00",
+        "graph_type": "table",
+        "aggregate": "Sum",
+        "columns": ["value", "user"],
+    }
+    _post(client, {**base, "group_by": ["value"], "columns": ["value"]})
+    payload = {**base, "columns": ["value"]}
+    data = _post(client, payload)
+    assert "cache" not in data
+    assert data["rows"] == _fresh(payload)["rows"]
+
+
+def test_non_mergeable_aggregate_not_derived() -> None:
+    client = server.create_app().test_client()
+    base: dict[str, Any] = {
+        "table": "events",
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-03 00:00:00",
+        "graph_type": "timeseries",
+        "aggregate": "Avg",
+        "columns": ["value"],
+    }
+    _post(client, {**base, "granularity": "1 hour"})
+    coarse = _post(client, {**base, "granularity": "1 day"})
+    assert "cache" not in coarse
+
+
+def test_time_subrange_sliced_from_cache() -> None:
+    from datetime import datetime
+
+    from scubaduck.query_ir import QueryParams
+    from scubaduck.result_cache import CachedResult, derive_rows
+
+    def params(start: str, end: str, bucket: int) -> QueryParams:
+        return QueryParams(
+            start=start,
+            end=end,
+            end_exclusive=True,
+            graph_type="timeseries",
+            aggregate="count",
+            bucket_size=bucket,
+        )
+
+    rows = [
+        (datetime(2024, 1, 1, h), 1, 1) for h in range(0, 24, 3)
+    ]  # bucket, Hits, Count
+    cached = CachedResult(
+        params("2024-01-01 00:00:00", "2024-01-02 00:00:00", 3600), rows, True, 0
+    )
+    sliced = derive_rows(
+        cached, params("2024-01-01 06:00:00", "2024-01-01 18:00:00", 21600)
+    )
+    assert sliced == [
+        (datetime(2024, 1, 1, 6), 2, 2),
+        (datetime(2024, 1, 1, 12), 2, 2),
+    ]
+    # 07:00 is not a boundary of the requested 6 hour buckets
+    assert (
+        derive_rows(cached, params("2024-01-01 07:00:00", "2024-01-01 18:00:00", 21600))
+        is None
+    )
+
+
+def test_memory_cache_capped_by_bytes() -> None:
+    from scubaduck.query_ir import QueryParams
+    from scubaduck.result_cache import ResultCache
+
+    cache = ResultCache(max_bytes=100)
+    rows = [("a" * 10, 1)] * 3
+    cache.put(QueryParams(table="a"), rows)
+    cache.put(QueryParams(table="b"), rows)
+    # Each result is about 60 bytes, so only the newer one is kept.
+    assert cache.size() == 1
+    assert 0 < cache.bytes() <= 100
+    assert cache.get(QueryParams(table="a")) is None
+    assert cache.get(QueryParams(table="b")) == (rows, "exact")
+    cache.put(QueryParams(table="c"), rows * 10)
+    assert cache.get(QueryParams(table="c")) is None
+
+
+def test_stale_results_not_served_after_writes(events_csv: Path) -> None:
+    app = server.create_app(events_csv)
+    client = app.test_client()
+    payload = {
+        "table": "events",
+        "graph_type": "table",
+        "group_by": ["user"],
+        "aggregate": "Sum",
+        "columns": ["value"],
+    }
+    first = _post(client, payload)
+    assert _post(client, payload)["cache"] == "exact"
+
+    materialized: MaterializedColumns = app.extensions["scubaduck_materialized"]
+    materialized.con.execute(
+        "INSERT INTO events VALUES ('2024-01-01 03:00:00', 'carol', 5)"
+    )
+    again = _post(client, payload)
+    assert "cache" not in again
+    assert len(again["rows"]) == len(first["rows"]) + 1
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any
+
+import duckdb
+
+from scubaduck import server
+from scubaduck.query_ir import QueryParams
+from scubaduck.result_cache import CachedResult, extend_range
+from scubaduck.saved_queries import SAVED_QUERIES_FILE, SavedQueries
+
+QUERY: dict[str, Any] = {
+    "table": "events",
+    "start": "2024-01-01 00:00:00",
+    "end": "2024-01-03 00:00:00",
+    "graph_type": "table",
+    "group_by": ["user"],
+    "aggregate": "Count",
+    "order_by": "user",
+}
+
+
+def test_saved_query_served_from_last_refresh() -> None:
+    app = server.create_app()
+    client = app.test_client()
+    rv = client.post(
+        "/api/saved",
+        data=json.dumps(
+            {"name": "by_user", "payload": QUERY, "refresh_interval": 3600}
+        ),
+        content_type="application/json",
+    )
+    assert rv.status_code == 200, rv.get_json()
+    assert rv.get_json()["ttl"] == 7200
+
+    first = client.get("/api/saved/by_user").get_json()
+    second = client.get("/api/saved/by_user").get_json()
+    assert first["rows"] == [["alice", 2], ["bob", 1], ["charlie", 1]]
+    assert second["rows"] == first["rows"]
+    assert second["saved"]["runs"] == 1
+    assert [q["name"] for q in client.get("/api/saved").get_json()] == ["by_user"]
+
+    rv = client.delete("/api/saved/by_user")
+    assert rv.get_json() == []
+    assert client.get("/api/saved/by_user").status_code == 404
+
+
+def test_saved_query_rejects_invalid_payload() -> None:
+    client = server.create_app().test_client()
+    rv = client.post(
+        "/api/saved",
+        data=json.dumps({"name": "bad", "payload": {**QUERY, "columns": ["nope"]}}),
+        content_type="application/json",
+    )
+    assert rv.status_code == 400
+    assert "nope" in rv.get_json()["error"]
+    assert client.get("/api/saved").get_json() == []
+
+
+def test_refresh_due_reruns_expired_queries() -> None:
+    app = server.create_app()
+    saved: SavedQueries = app.extensions["scubaduck_saved_queries"]
+    saved.save("fast", QUERY, 0.01)
+    saved.save("slow", QUERY, 3600)
+    time.sleep(0.02)
+    assert saved.refresh_due() == ["fast"]
+    assert saved.load("fast").runs == 2
+
+
+def test_sliding_window_refresh_queries_only_new_buckets(tmp_path: Path) -> None:
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    lines = ["timestamp,value"]
+    for i in range(30):
+        ts = now - timedelta(minutes=i)
+        lines.append(f"{ts:%Y-%m-%d %H:%M:%S},{i}")
+    csv_file = tmp_path / "events.csv"
+    csv_file.write_text("\n".join(lines) + "\n")
+    app = server.create_app(csv_file)
+    saved: SavedQueries = app.extensions["scubaduck_saved_queries"]
+    payload: dict[str, Any] = {
+        "table": "events",
+        "start": "-1 hour",
+        "end": "now",
+        "graph_type": "timeseries",
+        "granularity": "1 second",
+        "columns": [],
+    }
+    saved.save("window", payload, 3600)
+    time.sleep(1.1)
+    query = saved.load("window")
+    saved.refresh(query)
+    assert query.result is not None
+    assert query.result["cache"] == "extended"
+    assert sum(r[1] for r in query.result["rows"]) == 30
+
+
+def test_extend_range_splits_at_cached_end() -> None:
+    def params(start: str, end: str) -> QueryParams:
+        return QueryParams(
+            start=start,
+            end=end,
+            end_exclusive=True,
+            graph_type="timeseries",
+            aggregate="count",
+            bucket_size=3600,
+        )
+
+    rows = [(datetime(2024, 1, 1, h), 1, 1) for h in range(12)]
+    cached = CachedResult(
+        params("2024-01-01 00:00:00", "2024-01-01 12:00:00"), rows, True, 0
+    )
+    split = extend_range(cached, params("2024-01-01 02:00:00", "2024-01-01 15:00:00"))
+    assert split is not None
+    head, rest = split
+    assert head == rows[2:]
+    assert (rest.start, rest.end) == ("2024-01-01 12:00:00", "2024-01-01 15:00:00")
+    # Nothing to reuse when the new range starts after the cached one ends.
+    assert (
+        extend_range(cached, params("2024-01-01 12:00:00", "2024-01-01 15:00:00"))
+        is None
+    )
+
+
+def test_saved_queries_kept_outside_database(tmp_path: Path, config_dir: Path) -> None:
+    db = tmp_path / "events.duckdb"
+    con = duckdb.connect(db)
+    con.execute(
+        "CREATE TABLE events AS SELECT TIMESTAMP '2024-01-01' AS timestamp, "
+        "'alice' AS user"
+    )
+    con.close()
+    app = server.create_app(db, config={"SCUBADUCK_READ_ONLY": True})
+    saved: SavedQueries = app.extensions["scubaduck_saved_queries"]
+    saved.save("by_user", QUERY, 3600)
+    assert (config_dir / SAVED_QUERIES_FILE).exists()
+    assert app.test_client().get("/api/tables").get_json() == ["events"]
+
+    # Other servers of the same database pick the query up; others don't.
+    other = server.create_app(db, config={"SCUBADUCK_READ_ONLY": True})
+    client = other.test_client()
+    assert client.get("/api/saved/by_user").get_json()["rows"] == [["alice", 1]]
+    assert server.create_app().test_client().get("/api/saved").get_json() == []
+    saved.delete("by_user")
+    assert client.get("/api/saved").get_json() == []
+
+
+def test_due_refresh_runs_once_across_processes(tmp_path: Path) -> None:
+    calls: list[str] = []
+
+    def runner(name: str) -> Any:
+        def run(payload: dict[str, Any]) -> tuple[dict[str, Any], int]:
+            calls.append(name)
+            return {"rows": [[len(calls)]]}, 200
+
+        return run
+
+    path = tmp_path / SAVED_QUERIES_FILE
+    first = SavedQueries(path, "db", runner("first"))
+    second = SavedQueries(path, "db", runner("second"))
+    first.save("q", QUERY, 0.01)
+    time.sleep(0.02)
+    ran = [second.refresh_due(), first.refresh_due()]
+    assert ran == [["q"], []]
+    assert calls == ["first", "second"]
+    # The process that didn't run the refresh serves its response.
+    assert first.load("q").result == {"rows": [[2]]}
+    assert first.load("q").runs == 2
+    assert calls == ["first", "second"]
@@ -5,6 +5,7 @@ from pathlib import Path
 
 
 import pytest
+from dateutil import parser
 
 from scubaduck import server
 
@@ -52,6 +53,33 @@ def test_integer_time_unit_ms(tmp_path: Path) -> None:
     assert len(data["rows"]) == 2
 
 
+def test_integer_time_filter_is_on_raw_column(tmp_path: Path) -> None:
+    csv_file = tmp_path / "events.csv"
+    csv_file.write_text(
+        "created,event\n1704067200000,login\n1704070800000,logout\n"
+        "1704074400000,login\n"
+    )
+    app = server.create_app(csv_file)
+    client = app.test_client()
+    payload = {
+        "table": "events",
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-01 01:00:00",
+        "columns": ["created", "event"],
+        "time_column": "created",
+        "time_unit": "ms",
+    }
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    data = rv.get_json()
+    assert rv.status_code == 200
+    assert '"created" >= 1704067200000' in data["sql"]
+    assert '"created" <= 1704070800000' in data["sql"]
+    assert "make_timestamp" not in data["sql"]
+    assert len(data["rows"]) == 2
+
+
 def test_timeseries_default_xaxis_uses_time_column(tmp_path: Path) -> None:
     csv_file = tmp_path / "events.csv"
     csv_file.write_text("created,event\n1704067200000,login\n1704070800000,logout\n")
@@ -76,6 +104,43 @@ def test_timeseries_default_xaxis_uses_time_column(tmp_path: Path) -> None:
     assert len(data["rows"]) == 2
 
 
+def test_integer_timeseries_buckets_with_integer_math(tmp_path: Path) -> None:
+    csv_file = tmp_path / "events.csv"
+    csv_file.write_text(
+        "created,event\n1704067199,early\n1704067200,login\n"
+        "1704070799,login\n1704070800,logout\n"
+    )
+    app = server.create_app(csv_file)
+    client = app.test_client()
+    payload = {
+        "table": "events",
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-01 01:00:00",
+        "graph_type": "timeseries",
+        "granularity": "1 hour",
+        "columns": ["event"],
+        "aggregate": "Count",
+        "time_column": "created",
+        "x_axis": "created",
+        "time_unit": "s",
+    }
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    data = rv.get_json()
+    assert rv.status_code == 200
+    assert "epoch(" not in data["sql"]
+    assert "// 3600" in data["sql"]
+    rows = data["rows"]
+    assert [r[1] for r in rows] == [2, 1]
+    assert parser.parse(rows[0][0]).replace(tzinfo=None) == parser.parse(
+        "2024-01-01 00:00:00"
+    )
+    assert parser.parse(rows[1][0]).replace(tzinfo=None) == parser.parse(
+        "2024-01-01 01:00:00"
+    )
+
+
 def test_integer_time_unit_us_default_start_end(tmp_path: Path) -> None:
     csv_file = tmp_path / "events.csv"
     csv_file.write_text(
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
 import json
+from datetime import datetime, timezone
 from typing import Any, cast
 
+from dateutil import parser
+
 from scubaduck import server
 
 
@@ -274,6 +277,68 @@ def test_timeseries_derived_column() -> None:
     assert all(r[3] == r[2] * 2 for r in rows)
 
 
+def test_derived_column_group_by_and_filter() -> None:
+    app = server.app
+    client = app.test_client()
+    payload = {
+        "table": "events",
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-03 00:00:00",
+        "graph_type": "table",
+        "order_by": "kind",
+        "columns": ["value"],
+        "group_by": ["kind"],
+        "aggregate": "Sum",
+        "derived_columns": {
+            "kind": "CASE WHEN event = 'login' THEN 'in' ELSE 'out' END",
+            "big": "value * 10",
+        },
+        "filters": [{"column": "big", "op": ">", "value": 150}],
+    }
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    data = rv.get_json()
+    assert rv.status_code == 200
+    assert data["sql"].startswith("WITH base AS (")
+    assert data["sql"].count("value * 10") == 1
+    # rows: kind, Hits, sum(value), sum(big)
+    assert data["rows"] == [["in", 2, 70, 700], ["out", 1, 20, 200]]
+
+
+def test_derived_column_counted_under_count() -> None:
+    app = server.app
+    client = app.test_client()
+    payload: dict[str, Any] = {
+        "table": "events",
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-03 00:00:00",
+        "graph_type": "table",
+        "order_by": "user",
+        "columns": ["value"],
+        "group_by": ["user"],
+        "aggregate": "Count",
+        "derived_columns": {"big": "CASE WHEN value > 15 THEN value END"},
+    }
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    data = rv.get_json()
+    assert rv.status_code == 200
+    # rows: user, Hits, count(big)
+    assert data["rows"] == [["alice", 2, 1], ["bob", 1, 1], ["charlie", 1, 1]]
+
+    payload.update(graph_type="timeseries", granularity="1 day", group_by=[])
+    payload["order_by"] = None
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    data = rv.get_json()
+    assert rv.status_code == 200
+    # rows: bucket, Hits, Count, count(big)
+    assert [r[1:] for r in data["rows"]] == [[2, 2, 1], [2, 2, 2]]
+
+
 def test_reserved_word_column() -> None:
     app = server.create_app("TEST")
     client = app.test_client()
@@ -398,3 +463,128 @@ def test_show_hits_client_side() -> None:
     data = rv.get_json()
     assert rv.status_code == 200
     assert "count(*) AS Hits" in data["sql"]
+
+
+def test_timeseries_auto_uses_chart_width() -> None:
+    app = server.app
+    client = app.test_client()
+    payload: dict[str, Any] = {
+        "table": "events",
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-02 00:00:00",
+        "graph_type": "timeseries",
+        "columns": ["value"],
+        "granularity": "Auto",
+        "chart_width": 100,
+    }
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    data = rv.get_json()
+    assert rv.status_code == 200
+    # 86400s over 100px is 864s per pixel, snapped up to 15 minutes
+    assert data["bucket_size"] == 900
+    assert "granularity_adjusted" not in data
+
+    payload["granularity"] = "Fine"
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    assert rv.get_json()["bucket_size"] == 600
+
+
+def test_timeseries_granularity_capped() -> None:
+    app = server.create_app()
+    app.config["SCUBADUCK_MAX_BUCKETS"] = 10
+    client = app.test_client()
+    payload: dict[str, Any] = {
+        "table": "events",
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-03 00:00:00",
+        "graph_type": "timeseries",
+        "columns": ["value"],
+        "granularity": "1 second",
+    }
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    data = rv.get_json()
+    assert rv.status_code == 200
+    assert data["granularity_adjusted"] is True
+    assert data["requested_bucket_size"] == 1
+    assert data["bucket_size"] == 21600
+    assert "INTERVAL '21600 second'" in data["sql"]
+    assert len(data["rows"]) <= 10
+
+
+def test_timeseries_invalid_chart_width() -> None:
+    app = server.app
+    client = app.test_client()
+    payload: dict[str, Any] = {
+        "table": "events",
+        "graph_type": "timeseries",
+        "columns": ["value"],
+        "chart_width": "wide",
+    }
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    assert rv.status_code == 400
+    assert rv.get_json()["error"] == "Invalid chart_width"
+
+
+def test_timeseries_buckets_aligned_to_epoch() -> None:
+    app = server.app
+    client = app.test_client()
+    payload: dict[str, Any] = {
+        "table": "events",
+        "start": "2024-01-01 00:30:00",
+        "end": "2024-01-02 03:00:00",
+        "graph_type": "timeseries",
+        "granularity": "1 day",
+        "columns": [],
+    }
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    data = rv.get_json()
+    assert rv.status_code == 200
+    buckets = [parser.parse(r[0]).replace(tzinfo=None) for r in data["rows"]]
+    assert buckets == [
+        parser.parse("2024-01-01 00:00:00"),
+        parser.parse("2024-01-02 00:00:00"),
+    ]
+    assert [r[1] for r in data["rows"]] == [1, 2]
+
+
+def test_timeseries_relative_range_is_quantized() -> None:
+    now = [datetime(2024, 1, 2, 3, 0, 20, tzinfo=timezone.utc)]
+    app = server.create_app(config={"SCUBADUCK_CLOCK": lambda: now[0]})
+    client = app.test_client()
+
+    payload: dict[str, Any] = {
+        "table": "events",
+        "start": "-1 day",
+        "end": "now",
+        "graph_type": "timeseries",
+        "granularity": "1 hour",
+        "columns": [],
+    }
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    first = rv.get_json()
+    assert rv.status_code == 200
+    assert first["start"] == "2024-01-01 03:00:00"
+    assert "\"timestamp\" < '2024-01-02 03:00:00'" in first["sql"]
+    assert "\"timestamp\" >= '2024-01-02 03:00:00'" in first["edge_sql"]
+    # the edge bucket holds charlie's login at 03:00
+    assert [r[1] for r in first["rows"]] == [1, 1]
+
+    now[0] = datetime(2024, 1, 2, 3, 0, 50, tzinfo=timezone.utc)
+    rv = client.post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    second = rv.get_json()
+    assert second["sql"] == first["sql"]
+    assert second["rows"] == first["rows"]
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from scubaduck import server
+from scubaduck.warmup import Warmup
+
+
+def test_ready_reports_progress(events_csv: Path) -> None:
+    app = server.create_app(events_csv)
+    warmup: Warmup = app.extensions["scubaduck_warmup"]
+    assert warmup.wait(10)
+    rv = app.test_client().get("/api/ready")
+    assert rv.status_code == 200
+    data = rv.get_json()
+    assert data["ready"] is True
+    assert data["done"] == data["total"] == 1
+    assert data["errors"] == []
+
+
+def _boom() -> None:
+    raise ValueError("boom")
+
+
+def test_ready_not_ready_until_tasks_finish() -> None:
+    warmup = Warmup([("boom", _boom), ("ok", lambda: None)])
+    assert not warmup.ready
+    warmup.start()
+    assert warmup.wait(10)
+    status = warmup.status()
+    assert status["done"] == 2
+    assert status["errors"][0]["task"] == "boom"
+
+
+def test_landing_query_is_cached(events_csv: Path) -> None:
+    payload = {
+        "table": "events",
+        "graph_type": "table",
+        "group_by": ["user"],
+        "aggregate": "Sum",
+        "columns": ["value"],
+        "start": "2024-01-01 00:00:00",
+        "end": "2024-01-02 00:00:00",
+    }
+    app = server.create_app(events_csv, landing_queries=[payload])
+    warmup: Warmup = app.extensions["scubaduck_warmup"]
+    assert warmup.wait(10)
+    assert warmup.status()["total"] == 2
+    rv = app.test_client().post(
+        "/api/query", data=json.dumps(payload), content_type="application/json"
+    )
+    data = rv.get_json()
+    assert rv.status_code == 200, data
+    assert data["cache"] == "exact"